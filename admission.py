@@ -0,0 +1,130 @@
+import os
+import json
+import time
+import asyncio
+from collections import deque
+from metrics import ROUTE_LABEL_KEY, counter, gauge, histogram
+
+# Control de admisión (ADMISSION_ENABLED=0 lo desactiva)
+ADMISSION_ENABLED = os.getenv("ADMISSION_ENABLED", "1") != "0"
+
+# Peticiones simultáneas y cola de espera por clase de ruta. La suma de los
+# límites debería quedar por debajo de MONGODB_MAX_POOL_SIZE (100 por defecto)
+ADMISSION_LIMITS = {
+    "read": (int(os.getenv("ADMISSION_READ_LIMIT", "64")), int(os.getenv("ADMISSION_READ_QUEUE", "256"))),
+    "write": (int(os.getenv("ADMISSION_WRITE_LIMIT", "24")), int(os.getenv("ADMISSION_WRITE_QUEUE", "128"))),
+    "bulk": (int(os.getenv("ADMISSION_BULK_LIMIT", "4")), int(os.getenv("ADMISSION_BULK_QUEUE", "8"))),
+}
+
+# Tiempo máximo en cola antes de rechazar la petición, y valor de Retry-After
+ADMISSION_QUEUE_TIMEOUT = float(os.getenv("ADMISSION_QUEUE_TIMEOUT_MS", "2000")) / 1000
+ADMISSION_RETRY_AFTER = os.getenv("ADMISSION_RETRY_AFTER", "1")
+
+# Rutas que nunca se limitan (sondas y métricas deben responder aunque haya saturación)
+ADMISSION_EXEMPT = {"/healthz", "/readyz", "/metrics", "/cache/stats"}
+
+ADMISSION_IN_FLIGHT = gauge("admission_in_flight", "Peticiones admitidas en curso por clase", ("class",))
+ADMISSION_QUEUE_DEPTH = gauge("admission_queue_depth", "Peticiones esperando turno por clase", ("class",))
+ADMISSION_SHED = counter("admission_shed_total", "Peticiones rechazadas con 503 por clase y motivo", ("class", "reason"))
+ADMISSION_WAIT = histogram("admission_wait_seconds", "Tiempo de espera en cola antes de ser admitida", ("class",))
+
+class AdmissionRejected(Exception):
+    def __init__(self, reason):
+        super().__init__(reason)
+        self.reason = reason
+
+# Semáforo con cola acotada y orden de llegada. Al liberar un hueco se pasa
+# directamente al primero de la cola, así nadie se cuela por delante
+class Limiter:
+    def __init__(self, name, limit, max_queue, timeout=ADMISSION_QUEUE_TIMEOUT):
+        self.name = name
+        self.limit = limit
+        self.max_queue = max_queue
+        self.timeout = timeout
+        self.active = 0
+        self._waiters = deque()
+
+    async def acquire(self):
+        if self.active < self.limit and not self._waiters:
+            self.active += 1
+            ADMISSION_IN_FLIGHT.set(self.name, value=self.active)
+            return
+        if len(self._waiters) >= self.max_queue:
+            raise AdmissionRejected("queue_full")
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        ADMISSION_QUEUE_DEPTH.set(self.name, value=len(self._waiters))
+        start = time.perf_counter()
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter), self.timeout)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            if waiter.done() and not waiter.cancelled():
+                # El hueco llegó justo a la vez que el timeout: se devuelve
+                self.release()
+            else:
+                waiter.cancel()
+                self._waiters.remove(waiter)
+            ADMISSION_QUEUE_DEPTH.set(self.name, value=len(self._waiters))
+            if isinstance(e, asyncio.CancelledError):
+                raise
+            raise AdmissionRejected("timeout")
+        ADMISSION_WAIT.observe(self.name, value=time.perf_counter() - start)
+
+    def release(self):
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)  # El hueco pasa al siguiente sin cambiar active
+                ADMISSION_QUEUE_DEPTH.set(self.name, value=len(self._waiters))
+                return
+        self.active -= 1
+        ADMISSION_IN_FLIGHT.set(self.name, value=self.active)
+
+# Clase de una petición según el método y la ruta (antes de resolver la ruta)
+def route_class(method, path):
+    if path.endswith(("/bulk", "/export")) or path in ("/courses/enrollments", "/students/courses", "/courses/universities"):
+        return "bulk"
+    if method in ("GET", "HEAD"):
+        return "read"
+    return "write"
+
+# Middleware ASGI de control de admisión: limita las peticiones simultáneas de
+# cada clase para no saturar el pool de MongoDB; cuando la cola está llena (o la
+# espera supera el máximo) responde 503 con Retry-After al momento
+class AdmissionMiddleware:
+    def __init__(self, app, limits=None):
+        self.app = app
+        self.limiters = {name: Limiter(name, limit, queue) for name, (limit, queue) in (limits or ADMISSION_LIMITS).items()}
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not ADMISSION_ENABLED or scope["path"] in ADMISSION_EXEMPT:
+            await self.app(scope, receive, send)
+            return
+
+        name = route_class(scope["method"], scope["path"])
+        limiter = self.limiters[name]
+        try:
+            await limiter.acquire()
+        except AdmissionRejected as e:
+            ADMISSION_SHED.inc(name, e.reason)
+            # Sin ruta resuelta: las métricas HTTP lo cuentan como admission:<clase>, no como 404
+            scope[ROUTE_LABEL_KEY] = f"admission:{name}"
+            await self.reject(send)
+            return
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            limiter.release()
+
+    async def reject(self, send):
+        body = json.dumps({"detail": "Servidor saturado, inténtelo de nuevo más tarde"}).encode()
+        await send({
+            "type": "http.response.start",
+            "status": 503,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(body)).encode()),
+                (b"retry-after", ADMISSION_RETRY_AFTER.encode()),
+            ],
+        })
+        await send({"type": "http.response.body", "body": body})
@@ -0,0 +1,88 @@
+"""Tiempo de arranque en frío de un worker (respawn) hasta que responde /healthz.
+
+Lanza ``uvicorn <app>`` en un proceso nuevo, consulta ``/healthz`` hasta que
+responde 200 y anota el tiempo desde el lanzamiento; repite ``--runs`` veces.
+Con ``--unreachable`` apunta MONGODB_URI a un puerto cerrado para comprobar
+que el arranque no espera a MongoDB. Sale con código 1 si la mediana supera
+``--target-ms``.
+
+Uso:
+    python -m benchmarks.cold_start --app main:app --runs 5 --target-ms 2000 --unreachable
+"""
+import argparse
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def wait_ready(url, process, timeout):
+    deadline = time.perf_counter() + timeout
+    while time.perf_counter() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"uvicorn terminó con código {process.returncode}")
+        try:
+            with urllib.request.urlopen(url, timeout=0.5) as response:
+                if response.status == 200:
+                    return
+        except (urllib.error.URLError, ConnectionError, TimeoutError):
+            pass
+        time.sleep(0.005)
+    raise TimeoutError(f"{url} no respondió en {timeout} s")
+
+
+def one_run(app, env, timeout):
+    port = free_port()
+    command = [sys.executable, "-m", "uvicorn", app, "--port", str(port), "--log-level", "warning"]
+    start = time.perf_counter()
+    process = subprocess.Popen(command, cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        wait_ready(f"http://127.0.0.1:{port}/healthz", process, timeout)
+        return time.perf_counter() - start
+    finally:
+        process.terminate()
+        process.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--app", default="main:app")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--target-ms", type=float, default=2000)
+    parser.add_argument("--timeout", type=float, default=60, help="tiempo máximo de espera por arranque (s)")
+    parser.add_argument("--unreachable", action="store_true", help="arrancar con MongoDB inaccesible")
+    args = parser.parse_args()
+
+    env = dict(os.environ)
+    if args.unreachable:
+        env["MONGODB_URI"] = f"mongodb://127.0.0.1:{free_port()}/"
+
+    timings = [one_run(args.app, env, args.timeout) for _ in range(args.runs)]
+    results = {
+        "app": args.app,
+        "runs": args.runs,
+        "mongodb_unreachable": args.unreachable,
+        "median_ms": round(statistics.median(timings) * 1000, 1),
+        "max_ms": round(max(timings) * 1000, 1),
+        "target_ms": args.target_ms,
+    }
+    results["within_target"] = results["median_ms"] <= args.target_ms
+    print(json.dumps(results, indent=2))
+    return 0 if results["within_target"] else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,106 @@
+"""Peticiones concurrentes por worker: pymongo síncrono vs AsyncMongoClient.
+
+Levanta dos aplicaciones FastAPI mínimas contra el mismo mongod (MONGODB_URI)
+y las ataca con N peticiones simultáneas a través de la interfaz ASGI, igual
+que haría uvicorn con un único worker. La versión "antes" usa el
+``MongoClient`` síncrono dentro de un ``async def`` (bloquea el event loop);
+la versión "después" usa ``AsyncMongoClient`` con ``await``.
+
+Uso:
+    python -m benchmarks.concurrency --requests 2000 --concurrency 50 --sleep-ms 5
+"""
+import argparse
+import asyncio
+import json
+import os
+import time
+
+import httpx
+from dotenv import load_dotenv
+from fastapi import FastAPI
+from pymongo import AsyncMongoClient, MongoClient
+
+load_dotenv()
+
+COLLECTION = "bench_concurrency"
+
+
+def _query(sleep_ms):
+    # $where con sleep() simula una consulta lenta en el servidor
+    if sleep_ms:
+        return {"$where": f"sleep({sleep_ms}) || true"}
+    return {}
+
+
+def build_sync_app(uri, db_name, sleep_ms):
+    client = MongoClient(uri)
+    db = client[db_name]
+    app = FastAPI()
+
+    @app.get("/item")
+    async def get_item():
+        doc = db[COLLECTION].find_one(_query(sleep_ms))
+        return {"id": str(doc["_id"])}
+
+    return app, client.close
+
+
+def build_async_app(uri, db_name, sleep_ms):
+    client = AsyncMongoClient(uri)
+    db = client[db_name]
+    app = FastAPI()
+
+    @app.get("/item")
+    async def get_item():
+        doc = await db[COLLECTION].find_one(_query(sleep_ms))
+        return {"id": str(doc["_id"])}
+
+    return app, client.close
+
+
+async def drive(app, total, concurrency):
+    transport = httpx.ASGITransport(app=app)
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as http:
+        async def one():
+            async with semaphore:
+                response = await http.get("/item")
+                response.raise_for_status()
+
+        start = time.perf_counter()
+        await asyncio.gather(*(one() for _ in range(total)))
+        elapsed = time.perf_counter() - start
+
+    return {"requests": total, "seconds": round(elapsed, 4), "rps": round(total / elapsed, 1)}
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=1000)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--sleep-ms", type=int, default=0, help="latencia simulada en el servidor por consulta")
+    parser.add_argument("--db", default="bench")
+    args = parser.parse_args()
+
+    uri = os.getenv("MONGODB_URI", "mongodb://localhost:27017")
+    seed = MongoClient(uri)
+    seed[args.db][COLLECTION].delete_many({})
+    seed[args.db][COLLECTION].insert_one({"name": "bench"})
+
+    results = {}
+    for label, build in (("sync_pymongo", build_sync_app), ("async_pymongo", build_async_app)):
+        app, close = build(uri, args.db, args.sleep_ms)
+        results[label] = await drive(app, args.requests, args.concurrency)
+        result = close()
+        if asyncio.iscoroutine(result):
+            await result
+
+    seed[args.db][COLLECTION].drop()
+    seed.close()
+    results["speedup"] = round(results["async_pymongo"]["rps"] / results["sync_pymongo"]["rps"], 2)
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
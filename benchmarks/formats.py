@@ -0,0 +1,80 @@
+"""Formatos de respuesta: tiempo de codificación y decodificación y tamaño (con y sin gzip).
+
+Genera un listado de estudiantes con la forma en que los devuelve pymongo y
+lo codifica con cada codificador de ``serializer`` (JSON, BSON, MessagePack),
+midiendo el tiempo en el servidor, el tiempo que tarda el cliente en
+decodificarlo y el tamaño del cuerpo, sin comprimir y con gzip al nivel que
+usa la API.
+
+Uso:
+    python -m benchmarks.formats --docs 5000 --repeat 20
+"""
+import argparse
+import datetime
+import gzip
+import json
+import statistics
+import time
+
+import bson
+import msgpack
+import orjson
+from bson import ObjectId
+
+from serializer import BSON_MEDIA_TYPE, ENCODERS, GZIP_COMPRESS_LEVEL, JSON_MEDIA_TYPE, MSGPACK_MEDIA_TYPE
+
+DECODERS = {
+    JSON_MEDIA_TYPE: orjson.loads,
+    BSON_MEDIA_TYPE: bson.decode,
+    MSGPACK_MEDIA_TYPE: msgpack.unpackb,
+}
+
+
+def make_payload(count):
+    now = datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+    students = [
+        {
+            "_id": ObjectId(),
+            "name": f"Estudiante {i}",
+            "age": 18 + i % 50,
+            "created_at": now,
+            "version": 1 + i % 7,
+        }
+        for i in range(count)
+    ]
+    return {"students": students, "next": "NjVmMDAwMDAwMDAwMDAwMDAwMDAwMDAw", "message": "Estudiantes obtenidos exitosamente"}
+
+
+def median_ms(fn, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+    return round(statistics.median(timings) * 1000, 3)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--docs", type=int, default=5000)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    payload = make_payload(args.docs)
+    results = {"docs": args.docs, "gzip_level": GZIP_COMPRESS_LEVEL, "formats": {}}
+    for media_type, encode in ENCODERS.items():
+        body = encode(payload)
+        decode = DECODERS[media_type]
+        compressed = gzip.compress(body, compresslevel=GZIP_COMPRESS_LEVEL)
+        results["formats"][media_type] = {
+            "encode_ms": median_ms(lambda: encode(payload), args.repeat),
+            "decode_ms": median_ms(lambda: decode(body), args.repeat),
+            "gzip_ms": median_ms(lambda: gzip.compress(body, compresslevel=GZIP_COMPRESS_LEVEL), max(1, args.repeat // 4)),
+            "bytes": len(body),
+            "gzip_bytes": len(compressed),
+        }
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
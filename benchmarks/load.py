@@ -0,0 +1,226 @@
+"""Prueba de carga HTTP reproducible de la API completa (main.py).
+
+Siembra una base de datos de mongod (MONGODB_URI, base ``--db``, que se borra
+al empezar) con el volumen indicado de estudiantes, cursos, universidades y
+matrículas, y ataca ``main.app`` a través de la interfaz ASGI con una mezcla
+de lecturas y escrituras: listados paginados, lecturas por ID, listas de
+alumnos de un curso, matrículas y actualizaciones.
+
+La secuencia de operaciones sale de ``--seed``, así que dos ejecuciones con
+los mismos parámetros hacen exactamente las mismas peticiones. El resultado
+es un JSON con p50/p95/p99 y peticiones por segundo por ruta y en total,
+pensado para guardarlo (``--output``) y comparar entre commits.
+
+Uso:
+    python -m benchmarks.load --students 10000 --courses 500 --universities 50 \\
+        --requests 20000 --concurrency 50 --mix list=20,get=45,roster=10,enroll=15,update=10 \\
+        --output load.json
+"""
+import argparse
+import asyncio
+import json
+import logging
+import math
+import os
+import random
+import statistics
+import sys
+import time
+
+import httpx
+from bson import ObjectId
+
+DEFAULT_MIX = "list=20,get=45,roster=10,enroll=15,update=10"
+
+
+def parse_mix(value):
+    mix = {}
+    for part in value.split(","):
+        name, _, weight = part.partition("=")
+        mix[name.strip()] = float(weight)
+    unknown = set(mix) - set(OPERATIONS)
+    if unknown:
+        raise argparse.ArgumentTypeError(f"operaciones desconocidas: {', '.join(sorted(unknown))}")
+    return mix
+
+
+# Cada operación devuelve (ruta, método, url, cuerpo). La ruta es la plantilla,
+# para agrupar las latencias igual que el middleware de métricas
+def op_list(rng, ids):
+    collection = rng.choice(("students", "courses", "universities"))
+    return f"GET /{collection}", "GET", f"/{collection}?limit=50", None
+
+
+def op_get(rng, ids):
+    collection, param = rng.choice((("students", "student_id"), ("courses", "course_id"), ("universities", "university_id")))
+    return f"GET /{collection}/id/{{{param}}}", "GET", f"/{collection}/id/{rng.choice(ids[collection])}", None
+
+
+def op_roster(rng, ids):
+    return "GET /courses/{course_id}/students", "GET", f"/courses/{rng.choice(ids['courses'])}/students?limit=50", None
+
+
+def op_enroll(rng, ids):
+    course_id, student_id = rng.choice(ids["courses"]), rng.choice(ids["students"])
+    return "POST /courses/addstudent/{course_id}/{student_id}", "POST", f"/courses/addstudent/{course_id}/{student_id}", None
+
+
+def op_update(rng, ids):
+    student_id = rng.choice(ids["students"])
+    body = {"name": f"Estudiante {rng.randrange(10**6)}", "age": rng.randint(18, 65)}
+    return "PUT /students/updateStudent/{id}", "PUT", f"/students/updateStudent/{student_id}", body
+
+
+OPERATIONS = {
+    "list": op_list,
+    "get": op_get,
+    "roster": op_roster,
+    "enroll": op_enroll,
+    "update": op_update,
+}
+
+
+async def seed(db, args, rng):
+    from enrollments import ENROLLMENTS, enroll_operation
+    from etag import with_initial_version
+    from indexes import ensure_indexes
+    from search import with_search_key
+
+    await db.client.drop_database(db.name)
+    await ensure_indexes(db)
+
+    def make(doc):
+        return with_initial_version(with_search_key(doc))
+
+    students = [make({"_id": ObjectId(), "name": f"Estudiante {i}", "age": rng.randint(18, 65)}) for i in range(args.students)]
+    courses = [make({"_id": ObjectId(), "name": f"Curso {i}", "faculty": f"Facultad {i % 20}"}) for i in range(args.courses)]
+    universities = [
+        make({
+            "_id": ObjectId(),
+            "name": f"Universidad {i}",
+            "city": f"Ciudad {i % 30}",
+            "country": f"País {i % 10}",
+            "courses": [course["_id"] for course in rng.sample(courses, min(len(courses), args.courses_per_university))],
+        })
+        for i in range(args.universities)
+    ]
+    for collection, docs in (("students", students), ("courses", courses), ("universities", universities)):
+        for start in range(0, len(docs), 1000):
+            await db[collection].insert_many(docs[start:start + 1000], ordered=False)
+
+    operations = [
+        enroll_operation(course["_id"], student["_id"])
+        for course in courses
+        for student in rng.sample(students, min(len(students), args.students_per_course))
+    ]
+    for start in range(0, len(operations), 1000):
+        await db[ENROLLMENTS].bulk_write(operations[start:start + 1000], ordered=False)
+
+    return {
+        "students": [str(doc["_id"]) for doc in students],
+        "courses": [str(doc["_id"]) for doc in courses],
+        "universities": [str(doc["_id"]) for doc in universities],
+    }
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    # Rango más cercano: el menor valor que deja por debajo al menos esa fracción
+    index = min(len(sorted_values) - 1, max(0, math.ceil(fraction * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+def summarize(timings, errors, seconds):
+    ordered = sorted(timings)
+    return {
+        "requests": len(ordered),
+        "errors": errors,
+        "rps": round(len(ordered) / seconds, 1) if seconds else 0.0,
+        "mean_ms": round(statistics.fmean(ordered) * 1000, 3) if ordered else 0.0,
+        "p50_ms": round(percentile(ordered, 0.50) * 1000, 3),
+        "p95_ms": round(percentile(ordered, 0.95) * 1000, 3),
+        "p99_ms": round(percentile(ordered, 0.99) * 1000, 3),
+    }
+
+
+async def drive(app, plan, concurrency):
+    transport = httpx.ASGITransport(app=app)
+    semaphore = asyncio.Semaphore(concurrency)
+    timings, errors = {}, {}
+
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as http:
+        async def one(route, method, url, body):
+            async with semaphore:
+                start = time.perf_counter()
+                response = await http.request(method, url, json=body)
+                elapsed = time.perf_counter() - start
+                timings.setdefault(route, []).append(elapsed)
+                if response.status_code >= 400:
+                    errors[route] = errors.get(route, 0) + 1
+
+        start = time.perf_counter()
+        await asyncio.gather(*(one(*operation) for operation in plan))
+        seconds = time.perf_counter() - start
+
+    return timings, errors, seconds
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--students", type=int, default=10000)
+    parser.add_argument("--courses", type=int, default=500)
+    parser.add_argument("--universities", type=int, default=50)
+    parser.add_argument("--students-per-course", type=int, default=30)
+    parser.add_argument("--courses-per-university", type=int, default=40)
+    parser.add_argument("--requests", type=int, default=20000)
+    parser.add_argument("--warmup", type=int, default=500, help="peticiones previas que no se miden")
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--mix", type=parse_mix, default=parse_mix(DEFAULT_MIX), help=f"pesos por operación (por defecto {DEFAULT_MIX})")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--db", default="bench_load", help="base de datos de la prueba (se borra)")
+    parser.add_argument("--no-seed", action="store_true", help="reutilizar los datos de una ejecución anterior con la misma semilla")
+    parser.add_argument("--with-logs", action="store_true", help="mantener el log INFO de cada petición")
+    parser.add_argument("--output", help="fichero donde guardar el JSON además de imprimirlo")
+    args = parser.parse_args()
+
+    # La API lee la base de datos del entorno al importarse
+    os.environ["MONGODB_DB"] = args.db
+    from main import app
+    from db import get_database
+
+    if not args.with_logs:
+        logging.disable(logging.INFO)
+
+    # Generadores separados: el plan de peticiones es el mismo se siembre o no
+    seed_rng, plan_rng = random.Random(args.seed), random.Random(args.seed + 1)
+    async with app.router.lifespan_context(app):
+        db = get_database()
+        if args.no_seed:
+            ids = {
+                collection: [str(doc["_id"]) for doc in await db[collection].find({}, {"_id": 1}).sort("_id", 1).to_list()]
+                for collection in ("students", "courses", "universities")
+            }
+        else:
+            ids = await seed(db, args, seed_rng)
+
+        names, weights = zip(*args.mix.items())
+        plan = [OPERATIONS[name](plan_rng, ids) for name in plan_rng.choices(names, weights, k=args.warmup + args.requests)]
+        await drive(app, plan[:args.warmup], args.concurrency)
+        timings, errors, seconds = await drive(app, plan[args.warmup:], args.concurrency)
+
+    results = {
+        "config": {key: value for key, value in vars(args).items() if key not in ("output", "with_logs", "no_seed")},
+        "total": summarize([value for values in timings.values() for value in values], sum(errors.values()), seconds),
+        "routes": {route: summarize(timings[route], errors.get(route, 0), seconds) for route in sorted(timings)},
+    }
+    output = json.dumps(results, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    print(output)
+    return 1 if results["total"]["errors"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
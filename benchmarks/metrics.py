@@ -0,0 +1,99 @@
+"""Coste del MetricsMiddleware por petición.
+
+Monta dos aplicaciones FastAPI idénticas con una ruta trivial (sin MongoDB, para
+que el coste del middleware no quede oculto por la base de datos), una con
+``MetricsMiddleware`` y otra sin él, y las ataca a través de la interfaz ASGI.
+También mide por separado el registro de una petición (observe + inc) y el
+tiempo de generar ``/metrics`` con todas las rutas de la API.
+
+Uso:
+    python -m benchmarks.metrics --requests 20000 --concurrency 20 --repeat 5
+"""
+import argparse
+import asyncio
+import json
+import statistics
+import time
+
+import httpx
+from fastapi import FastAPI
+
+import metrics
+from metrics import MetricsMiddleware
+
+
+def build_app(with_metrics):
+    app = FastAPI()
+    if with_metrics:
+        app.add_middleware(MetricsMiddleware)
+
+    @app.get("/students/{student_id}")
+    async def get_student(student_id: str):
+        return {"_id": student_id, "name": "bench"}
+
+    return app
+
+
+async def drive(app, total, concurrency):
+    transport = httpx.ASGITransport(app=app)
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as http:
+        async def one(i):
+            async with semaphore:
+                response = await http.get(f"/students/{i}")
+                response.raise_for_status()
+
+        start = time.perf_counter()
+        await asyncio.gather(*(one(i) for i in range(total)))
+        return time.perf_counter() - start
+
+
+def bookkeeping_us(iterations):
+    start = time.perf_counter()
+    for i in range(iterations):
+        metrics.IN_FLIGHT.inc("GET")
+        metrics.IN_FLIGHT.dec("GET")
+        metrics.REQUEST_DURATION.observe("GET", "/bench/{id}", value=(i % 100) / 1000)
+        metrics.REQUESTS.inc("GET", "/bench/{id}", "200")
+        metrics.RESPONSE_SIZE.observe("GET", "/bench/{id}", value=512)
+    return (time.perf_counter() - start) / iterations * 1e6
+
+
+def render_ms(routes):
+    for i in range(routes):
+        for status in ("200", "404", "500"):
+            metrics.REQUEST_DURATION.observe("GET", f"/route/{i}", value=0.01)
+            metrics.REQUESTS.inc("GET", f"/route/{i}", status)
+            metrics.RESPONSE_SIZE.observe("GET", f"/route/{i}", value=512)
+    start = time.perf_counter()
+    body = metrics.render()
+    return (time.perf_counter() - start) * 1000, len(body)
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=20000)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--routes", type=int, default=50, help="rutas distintas al medir /metrics")
+    args = parser.parse_args()
+
+    results = {"requests": args.requests, "concurrency": args.concurrency}
+    for label, with_metrics in (("without_metrics", False), ("with_metrics", True)):
+        app = build_app(with_metrics)
+        await drive(app, 500, args.concurrency)  # calentamiento
+        runs = [await drive(app, args.requests, args.concurrency) for _ in range(args.repeat)]
+        seconds = statistics.median(runs)
+        results[label] = {"seconds": round(seconds, 4), "rps": round(args.requests / seconds, 1), "us_per_request": round(seconds / args.requests * 1e6, 2)}
+
+    results["overhead_us_per_request"] = round(results["with_metrics"]["us_per_request"] - results["without_metrics"]["us_per_request"], 2)
+    results["overhead_pct"] = round(results["overhead_us_per_request"] / results["without_metrics"]["us_per_request"] * 100, 2)
+    results["bookkeeping_us_per_request"] = round(bookkeeping_us(100_000), 3)
+    elapsed, size = render_ms(args.routes)
+    results["render"] = {"routes": args.routes, "ms": round(elapsed, 3), "bytes": size}
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
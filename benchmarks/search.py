@@ -0,0 +1,109 @@
+"""Búsqueda por prefijo sobre 100k nombres: regex /^q/i vs $text vs name_key.
+
+Siembra una colección con nombres aleatorios (con mayúsculas y acentos) y mide
+la latencia de las tres formas de resolver un autocompletado en mongod:
+
+- ``regex_i``: ``{"name": {"$regex": "^q", "$options": "i"}}`` con índice en
+  ``name``. Al ser insensible a mayúsculas no puede acotar el recorrido del
+  índice y examina todas las claves.
+- ``text``: índice de texto sobre ``name``. Solo encuentra palabras completas
+  (con stemming), así que no sirve para prefijos; se mide como referencia.
+- ``name_key``: rango ``[q, q')`` sobre el nombre normalizado con índice, que
+  es lo que usa ``GET /search``.
+
+Para cada estrategia se informa p50/p95 en ms y las claves examinadas (explain)
+en una consulta de ejemplo.
+
+Uso:
+    python -m benchmarks.search --docs 100000 --queries 500
+"""
+import argparse
+import json
+import math
+import os
+import random
+import statistics
+import time
+
+from dotenv import load_dotenv
+from pymongo import ASCENDING, TEXT, MongoClient
+
+from search import SEARCH_FIELD, normalize_name, normalize_prefix, prefix_range
+
+load_dotenv()
+
+COLLECTION = "bench_search"
+FIRST = ["Ángel", "Álvaro", "Beatriz", "Carmen", "César", "Diego", "Elena", "Iñigo", "José", "Lucía", "María", "Nuria", "Óscar", "Raúl", "Sofía"]
+LAST = ["Aguilar", "Benítez", "Castro", "Díaz", "Fernández", "García", "Gómez", "López", "Martínez", "Muñoz", "Núñez", "Pérez", "Ruiz", "Sánchez", "Vázquez"]
+
+
+def make_names(count, rng):
+    return [f"{rng.choice(FIRST)} {rng.choice(LAST)} {rng.choice(LAST)} {i}" for i in range(count)]
+
+
+def strategies():
+    return {
+        "regex_i": lambda q: ({"name": {"$regex": f"^{q}", "$options": "i"}}, [("name", ASCENDING)]),
+        "text": lambda q: ({"$text": {"$search": q}}, None),
+        "name_key": lambda q: ({SEARCH_FIELD: prefix_range(normalize_prefix(q))}, [(SEARCH_FIELD, ASCENDING)]),
+    }
+
+
+def measure(collection, build, prefixes, limit):
+    timings = []
+    for prefix in prefixes:
+        query, sort = build(prefix)
+        cursor = collection.find(query, {"name": 1}).limit(limit)
+        if sort:
+            cursor = cursor.sort(sort)
+        start = time.perf_counter()
+        cursor.to_list()
+        timings.append(time.perf_counter() - start)
+    timings.sort()
+    query, sort = build(prefixes[0])
+    cursor = collection.find(query, {"name": 1}).limit(limit)
+    if sort:
+        cursor = cursor.sort(sort)
+    stats = cursor.explain()["executionStats"]
+    return {
+        "p50_ms": round(statistics.median(timings) * 1000, 3),
+        "p95_ms": round(timings[max(0, math.ceil(len(timings) * 0.95) - 1)] * 1000, 3),
+        "keys_examined": stats["totalKeysExamined"],
+        "docs_examined": stats["totalDocsExamined"],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--docs", type=int, default=100_000)
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--limit", type=int, default=10)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--db", default="bench")
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    client = MongoClient(os.getenv("MONGODB_URI", "mongodb://localhost:27017"))
+    collection = client[args.db][COLLECTION]
+    collection.drop()
+    names = make_names(args.docs, rng)
+    collection.insert_many([{"name": name, SEARCH_FIELD: normalize_name(name)} for name in names], ordered=False)
+    collection.create_index([("name", ASCENDING)])
+    collection.create_index([(SEARCH_FIELD, ASCENDING)])
+    collection.create_index([("name", TEXT)])
+
+    # Prefijos de 1 a 4 letras tal y como los teclearía el usuario (en minúsculas y sin acento)
+    prefixes = [normalize_prefix(rng.choice(names)[:rng.randint(1, 4)]) for _ in range(args.queries)]
+
+    results = {"docs": args.docs, "queries": args.queries, "limit": args.limit}
+    for label, build in strategies().items():
+        results[label] = measure(collection, build, prefixes, args.limit)
+
+    collection.drop()
+    client.close()
+    results["speedup_vs_regex"] = round(results["regex_i"]["p50_ms"] / results["name_key"]["p50_ms"], 1)
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
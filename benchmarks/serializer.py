@@ -0,0 +1,82 @@
+"""Microbenchmark: serialización actual (str + jsonable_encoder) vs serializer.dumps.
+
+Genera documentos con la forma de un curso tal y como los devuelve pymongo
+(ObjectId en _id y en la lista de estudiantes, fecha de creación) y mide el
+tiempo de convertir un listado completo a bytes JSON por cada camino.
+
+Uso:
+    python -m benchmarks.serializer --docs 5000 --students 30 --repeat 20
+"""
+import argparse
+import copy
+import datetime
+import json
+import statistics
+import time
+
+from bson import ObjectId
+from fastapi.encoders import jsonable_encoder
+
+from serializer import dumps
+
+
+def make_docs(count, students):
+    now = datetime.datetime.now(datetime.timezone.utc)
+    return [
+        {
+            "_id": ObjectId(),
+            "name": f"Curso {i}",
+            "faculty": "Ingeniería",
+            "students": [ObjectId() for _ in range(students)],
+            "created_at": now,
+            "version": 1,
+        }
+        for i in range(count)
+    ]
+
+
+# Camino anterior: mutar cada documento, jsonable_encoder y json.dumps (como JSONResponse)
+def current_path(docs):
+    for doc in docs:
+        doc["_id"] = str(doc["_id"])
+        doc["students"] = [str(student) for student in doc["students"]]
+    content = jsonable_encoder({"courses": docs, "message": "Cursos obtenidos exitosamente"})
+    return json.dumps(content, ensure_ascii=False, allow_nan=False, indent=None, separators=(",", ":")).encode("utf-8")
+
+
+# Camino nuevo: codificación directa de los documentos de MongoDB
+def new_path(docs):
+    return dumps({"courses": docs, "message": "Cursos obtenidos exitosamente"})
+
+
+def measure(fn, docs, repeat, copy_input):
+    timings = []
+    for _ in range(repeat):
+        # El camino anterior modifica los documentos: se le pasa una copia fuera del cronómetro
+        data = copy.deepcopy(docs) if copy_input else docs
+        start = time.perf_counter()
+        fn(data)
+        timings.append(time.perf_counter() - start)
+    return {"median_ms": round(statistics.median(timings) * 1000, 3), "min_ms": round(min(timings) * 1000, 3)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--docs", type=int, default=5000)
+    parser.add_argument("--students", type=int, default=30)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    docs = make_docs(args.docs, args.students)
+    results = {
+        "docs": args.docs,
+        "students_per_doc": args.students,
+        "current": measure(current_path, docs, args.repeat, copy_input=True),
+        "serializer": measure(new_path, docs, args.repeat, copy_input=False),
+    }
+    results["speedup"] = round(results["current"]["median_ms"] / results["serializer"]["median_ms"], 1)
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+"""Consultas a MongoDB durante una ráfaga de lecturas idénticas, con y sin single-flight.
+
+Monta una aplicación FastAPI con una ruta ``/courses/id/{course_id}`` que lee a
+través de ``get_flight`` igual que la API, pero cuya "consulta" es una espera
+de ``--backend-ms`` que cuenta cuántas veces se ejecuta (así se aísla el efecto
+de la agrupación de la latencia real de mongod). Lanza ``--burst`` peticiones
+simultáneas repartidas entre ``--keys`` cursos y compara las consultas hechas
+y la latencia con la agrupación activada y desactivada.
+
+Uso:
+    python -m benchmarks.singleflight --burst 1000 --keys 5 --backend-ms 20 --pool 100
+"""
+import argparse
+import asyncio
+import json
+import statistics
+import time
+
+import httpx
+from fastapi import FastAPI
+
+import singleflight
+from singleflight import get_flight
+
+
+def build_app(backend_ms, pool_size, counter):
+    app = FastAPI()
+    # El pool de conexiones limita cuántas consultas pueden ir a la vez a MongoDB
+    pool = asyncio.Semaphore(pool_size)
+
+    async def query(course_id):
+        async with pool:
+            counter["queries"] += 1
+            await asyncio.sleep(backend_ms / 1000)
+            return {"_id": course_id, "name": "Curso"}
+
+    @app.get("/courses/id/{course_id}")
+    async def get_course(course_id: str):
+        return await get_flight("bench", "id").do(course_id, lambda: query(course_id))
+
+    return app
+
+
+async def burst(app, total, keys):
+    transport = httpx.ASGITransport(app=app)
+    timings = []
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as http:
+        async def one(i):
+            start = time.perf_counter()
+            response = await http.get(f"/courses/id/{i % keys}")
+            response.raise_for_status()
+            timings.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        await asyncio.gather(*(one(i) for i in range(total)))
+        elapsed = time.perf_counter() - start
+    timings.sort()
+    return {
+        "seconds": round(elapsed, 4),
+        "p50_ms": round(statistics.median(timings) * 1000, 2),
+        "p99_ms": round(timings[int(len(timings) * 0.99) - 1] * 1000, 2),
+    }
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--burst", type=int, default=1000)
+    parser.add_argument("--keys", type=int, default=5, help="documentos distintos en la ráfaga")
+    parser.add_argument("--backend-ms", type=float, default=20)
+    parser.add_argument("--pool", type=int, default=100, help="consultas simultáneas máximas (maxPoolSize)")
+    args = parser.parse_args()
+
+    results = {"burst": args.burst, "keys": args.keys, "backend_ms": args.backend_ms, "pool": args.pool}
+    for label, enabled in (("without_singleflight", False), ("with_singleflight", True)):
+        singleflight.SINGLEFLIGHT_ENABLED = enabled
+        counter = {"queries": 0}
+        app = build_app(args.backend_ms, args.pool, counter)
+        results[label] = await burst(app, args.burst, args.keys)
+        results[label]["backend_queries"] = counter["queries"]
+
+    queries = results["with_singleflight"]["backend_queries"]
+    results["coalescing_ratio"] = round(1 - queries / args.burst, 4)
+    results["query_reduction"] = round(results["without_singleflight"]["backend_queries"] / queries, 1)
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
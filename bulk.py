@@ -0,0 +1,97 @@
+import os
+import json
+import logging
+from pydantic import ValidationError
+from pymongo.errors import BulkWriteError
+from etag import with_initial_version
+from search import with_search_key
+
+logger = logging.getLogger(__name__)
+
+# Tamaño de lote por defecto y máximo para insert_many
+BULK_CHUNK_SIZE = int(os.getenv("BULK_CHUNK_SIZE", "1000"))
+MAX_BULK_CHUNK_SIZE = 10000
+
+# Error de formato del cuerpo de la petición (no es un array JSON ni NDJSON)
+class BulkBodyError(ValueError):
+    pass
+
+# Leer los elementos del cuerpo: un array JSON o un stream NDJSON.
+# Las líneas NDJSON que no son JSON válido se devuelven como excepción para
+# informarlas por índice sin rechazar el resto
+async def read_items(request):
+    content_type = request.headers.get("content-type", "")
+    if "ndjson" in content_type:
+        items = []
+        pending = b""
+        async for chunk in request.stream():
+            pending += chunk
+            *lines, pending = pending.split(b"\n")
+            items.extend(_parse_line(line) for line in lines if line.strip())
+        if pending.strip():
+            items.append(_parse_line(pending))
+        return items
+    try:
+        items = json.loads(await request.body())
+    except ValueError:
+        raise BulkBodyError("El cuerpo no es JSON válido")
+    if not isinstance(items, list):
+        raise BulkBodyError("El cuerpo debe ser un array JSON o NDJSON")
+    return items
+
+def _parse_line(line):
+    try:
+        return json.loads(line)
+    except ValueError as e:
+        return e
+
+# Validar todos los elementos con el modelo y separar los válidos de los erróneos.
+# Cada válido se devuelve como (índice, instancia del modelo, documento a insertar)
+def validate_items(model, items, exclude=None):
+    docs, errors = [], []
+    for index, item in enumerate(items):
+        if isinstance(item, Exception):
+            errors.append({"index": index, "error": f"JSON inválido: {item}"})
+            continue
+        if not isinstance(item, dict):
+            errors.append({"index": index, "error": "Se esperaba un objeto JSON"})
+            continue
+        try:
+            instance = model(**item)
+            docs.append((index, instance, with_initial_version(with_search_key(instance.dict(exclude=exclude)))))
+        except ValidationError as e:
+            errors.append({"index": index, "error": e.errors(include_url=False, include_context=False)})
+    return docs, errors
+
+# Insertar los documentos válidos en lotes con insert_many no ordenado:
+# un documento que falla no impide insertar el resto del lote
+async def insert_in_chunks(collection, docs, chunk_size=BULK_CHUNK_SIZE):
+    results, errors, inserted = [], [], []
+    for start in range(0, len(docs), chunk_size):
+        chunk = docs[start:start + chunk_size]
+        try:
+            await collection.insert_many([doc for _, _, doc in chunk], ordered=False)
+            failed = {}
+        except BulkWriteError as e:
+            failed = {error["index"]: error["errmsg"] for error in e.details["writeErrors"]}
+        # insert_many asigna el _id a cada documento antes de enviarlo
+        for position, (index, instance, doc) in enumerate(chunk):
+            if position in failed:
+                errors.append({"index": index, "error": failed[position]})
+            else:
+                results.append({"index": index, "id": str(doc["_id"])})
+                inserted.append((instance, doc["_id"]))
+    return results, errors, inserted
+
+# Leer, validar e insertar en bloque; devuelve resultados y errores por índice.
+# `exclude` quita campos del modelo antes de insertar y `after_insert` recibe
+# los pares (instancia, _id) insertados para completar escrituras relacionadas
+async def bulk_insert(request, collection, model, chunk_size=BULK_CHUNK_SIZE, exclude=None, after_insert=None):
+    items = await read_items(request)
+    docs, errors = validate_items(model, items, exclude)
+    results, write_errors, inserted = await insert_in_chunks(collection, docs, chunk_size)
+    if after_insert is not None and inserted:
+        await after_insert(inserted)
+    errors = sorted(errors + write_errors, key=lambda error: error["index"])
+    logger.info("Inserción en bloque en '%s': %s insertados, %s con error", collection.name, len(results), len(errors))
+    return {"inserted": len(results), "failed": len(errors), "results": results, "errors": errors}
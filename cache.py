@@ -0,0 +1,92 @@
+import os
+import time
+from collections import OrderedDict
+
+# Tamaño máximo (entradas) y tiempo de vida de cada caché; CACHE_MAXSIZE=0 la desactiva
+CACHE_MAXSIZE = int(os.getenv("CACHE_MAXSIZE", "10000"))
+CACHE_TTL_SECONDS = float(os.getenv("CACHE_TTL_SECONDS", "30"))
+
+# Valor centinela para distinguir "no está en caché" de un valor None
+MISSING = object()
+
+# Caché LRU con caducidad (TTL) y contadores para poder dimensionarla
+class ReadCache:
+    def __init__(self, maxsize=CACHE_MAXSIZE, ttl=CACHE_TTL_SECONDS):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()  # clave -> (caduca_en, valor)
+        # Cambia en cada invalidación: una lectura que empezó antes de una
+        # escritura no guarda su resultado (podría estar desactualizado)
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    def get(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return MISSING
+        expires_at, value = entry
+        if expires_at < time.monotonic():
+            del self._entries[key]
+            self.expirations += 1
+            self.misses += 1
+            return MISSING
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key, value, generation=None):
+        if self.maxsize <= 0 or (generation is not None and generation != self.generation):
+            return
+        self._entries[key] = (time.monotonic() + self.ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def delete(self, key):
+        self.generation += 1
+        if self._entries.pop(key, None) is not None:
+            self.invalidations += 1
+
+    def clear(self):
+        self.generation += 1
+        self.invalidations += len(self._entries)
+        self._entries.clear()
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "maxsize": self.maxsize,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "invalidations": self.invalidations,
+        }
+
+# Cachés del proceso: una por colección y tipo de búsqueda ("id" o "name")
+_caches = {}
+
+def get_cache(collection, kind):
+    key = (collection, kind)
+    if key not in _caches:
+        _caches[key] = ReadCache()
+    return _caches[key]
+
+# Invalidar tras una escritura: la entrada por ID del documento afectado y
+# todas las búsquedas por nombre de la colección (el nombre puede haber cambiado)
+def invalidate(collection, doc_id=None):
+    if doc_id is not None:
+        get_cache(collection, "id").delete(str(doc_id))
+    get_cache(collection, "name").clear()
+
+def cache_stats():
+    return {f"{collection}.{kind}": cache.stats() for (collection, kind), cache in sorted(_caches.items())}
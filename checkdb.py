@@ -1,7 +1,15 @@
-from db import get_database
+import asyncio
+from db import close_client, get_database, ping_database
 
 # Comprobación de la conexión con la base de datos MongoDB
-db = get_database()
-print(f"db: {db}") 
-if db is None:
-    raise RuntimeError("La conexión a la base de datos falló")
+async def check():
+    db = get_database()
+    print(f"db: {db}") 
+    if db is None:
+        raise RuntimeError("La conexión a la base de datos falló")
+    try:
+        await ping_database(db)
+    finally:
+        await close_client()
+
+asyncio.run(check())
@@ -1,143 +1,276 @@
-from db import get_database
+from admission import AdmissionMiddleware
+from bulk import BULK_CHUNK_SIZE, MAX_BULK_CHUNK_SIZE, BulkBodyError, bulk_insert
+from cache import MISSING, get_cache, invalidate
+from db import get_db, lifespan
+from enrollments import ENROLLMENTS, enroll_operation, existing_course_ids, find_roster_page, fold_legacy_rosters, replace_roster_operations, unenroll_one_operation, unenroll_operation, write_enrollment
+from etag import document_version, etag_matches, expected_version, fetch_version, make_etag, not_modified, patch_document, with_initial_version
+from export import EXPORT_FORMAT_PATTERN, EXPORT_FORMATS, export_cursor, export_format, export_headers, export_stream
+from metrics import MetricsMiddleware
+from pagination import DEFAULT_LIMIT, MAX_LIMIT, decode_cursor, encode_cursor, find_page
+from references import ObjectIdRef, ref_variants, reverse_lookup, to_object_id
+from search import WITHOUT_SEARCH_KEY, with_search_key
+from serializer import GZIP_COMPRESS_LEVEL, GZIP_MINIMUM_SIZE, BSONJSONResponse
+from singleflight import get_flight
 from pydantic import BaseModel
-from fastapi import FastAPI, HTTPException
+from fastapi import Depends, FastAPI, Header, HTTPException, Query, Request
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import StreamingResponse
 from bson import ObjectId
+from bson.errors import InvalidId
+from pymongo.asynchronous.database import AsyncDatabase
+from system import router as system_router
 import logging
 
 # Configuración del logger para el módulo actual
 logger = logging.getLogger(__name__)
 
-# Creación de la aplicación FastAPI
-app = FastAPI()
-
-# Intentar conectar a la base de datos
-try:
-    db = get_database()  # Obtener la conexión a la base de datos
-    logger.info("Conectado a MongoDB")  # Log de éxito
-except Exception as e:
-    logger.error(f"Error al conectar a MongoDB: {e}")  # Log de error
+# Creación de la aplicación FastAPI (el cliente de MongoDB se gestiona en el lifespan)
+app = FastAPI(lifespan=lifespan)
+app.add_middleware(GZipMiddleware, minimum_size=GZIP_MINIMUM_SIZE, compresslevel=GZIP_COMPRESS_LEVEL)
+app.add_middleware(AdmissionMiddleware)
+app.add_middleware(MetricsMiddleware)  # El último añadido es el más externo: mide también los 503
+app.include_router(system_router)
 
 # Definición del modelo de datos para un curso
 class Course(BaseModel):
     name: str  # Nombre del curso
     faculty: str  # Facultad del curso
-    students: list  # Lista de estudiantes en el curso
+    students: list[ObjectIdRef] = []  # IDs de estudiantes: se guardan en la colección enrollments, no en el curso
+
+# Las lecturas de cursos no devuelven la clave de búsqueda ni el array antiguo
+# students (la lista se lee de enrollments)
+COURSE_PROJECTION = {**WITHOUT_SEARCH_KEY, "students": 0}
 
 # Ruta para crear un nuevo curso
 @app.post("/courses")
-async def create_course(course: Course):
+async def create_course(course: Course, db: AsyncDatabase = Depends(get_db)):
     try:
-        result = db["courses"].insert_one(course.dict())
+        result = await db["courses"].insert_one(with_initial_version(with_search_key(course.dict(exclude={"students"}))))
+        if course.students:
+            await db[ENROLLMENTS].bulk_write([enroll_operation(result.inserted_id, student_id) for student_id in course.students], ordered=False)
+        invalidate("courses")
         logger.info("Curso añadido exitosamente")
         return {
             "id": str(result.inserted_id),
             "message": "Curso añadido exitosamente"
         }
     except Exception as e:
-        logger.error(f"Error al añadir curso: {e}")
+        logger.error("Error al añadir curso: %s", e)
         raise HTTPException(status_code=500, detail="Error al añadir curso")
 
-# Ruta para obtener todos los cursos
+# Ruta para crear cursos en bloque (array JSON o NDJSON) con insert_many no ordenado
+@app.post("/courses/bulk")
+async def create_courses_bulk(request: Request, chunk_size: int = Query(BULK_CHUNK_SIZE, ge=1, le=MAX_BULK_CHUNK_SIZE), db: AsyncDatabase = Depends(get_db)):
+    try:
+        # Los estudiantes de cada curso insertado se matriculan en la colección enrollments
+        async def enroll_students(inserted):
+            operations = [enroll_operation(course_id, student_id) for course, course_id in inserted for student_id in course.students]
+            if operations:
+                await db[ENROLLMENTS].bulk_write(operations, ordered=False)
+        result = await bulk_insert(request, db.courses, Course, chunk_size, exclude={"students"}, after_insert=enroll_students)
+        invalidate("courses")
+        result["message"] = f"Cursos añadidos en bloque: {result['inserted']} insertados, {result['failed']} con error"
+        return result
+    except BulkBodyError as e:
+        logger.warning("Cuerpo inválido en la inserción en bloque de cursos: %s", e)
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        logger.error("Error al añadir cursos en bloque: %s", e)
+        raise HTTPException(status_code=500, detail="Error al añadir cursos en bloque")
+
+# Ruta para obtener los cursos paginados por _id (parámetros limit y after)
 @app.get("/courses")
-async def get_courses():
+async def get_courses(limit: int = Query(DEFAULT_LIMIT, ge=1, le=MAX_LIMIT), after: str | None = None, db: AsyncDatabase = Depends(get_db)):
+    # Validar el cursor de paginación
+    try:
+        after_id = decode_cursor(after) if after else None
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Cursor de paginación inválido")
     try:
-        courses = list(db.courses.find())
-        for course in courses:
-            course["_id"] = str(course["_id"])
+        # Los listados idénticos simultáneos comparten la consulta. La generación de la
+        # caché cambia con cada escritura: una lectura posterior no se une a una anterior
+        generation = get_cache("courses", "name").generation
+        courses, next_cursor = await get_flight("courses", "list").do((limit, after_id, generation), lambda: find_page(db.courses, limit=limit, after_id=after_id, projection=COURSE_PROJECTION))
         logger.info("Cursos obtenidos exitosamente")
-        return {"courses": courses, "message": "Cursos obtenidos exitosamente"}
+        return BSONJSONResponse({"courses": courses, "next": next_cursor, "message": "Cursos obtenidos exitosamente"})
     except Exception as e:
-        logger.error(f"Error al obtener cursos: {e}")
+        logger.error("Error al obtener cursos: %s", e)
         raise HTTPException(status_code=500, detail="Error al obtener cursos")
 
+# Ruta para exportar todos los cursos en streaming (NDJSON, BSON o MessagePack según format o Accept)
+@app.get("/courses/export")
+async def export_courses(format: str | None = Query(None, pattern=EXPORT_FORMAT_PATTERN), accept: str | None = Header(None), db: AsyncDatabase = Depends(get_db)):
+    headers = export_headers(format)
+    format = export_format(format, accept)
+    logger.info("Exportación de cursos iniciada (formato %s)", format)
+    return StreamingResponse(export_stream(export_cursor(db.courses, COURSE_PROJECTION), format), media_type=EXPORT_FORMATS[format], headers=headers)
+
 # Ruta para obtener un curso por nombre (solo el primero que coincida)
 @app.get("/courses/{name}")
-async def get_one_course(name: str):
+async def get_one_course(name: str, db: AsyncDatabase = Depends(get_db)):
     try:
-        course = db["courses"].find_one({"name": name})
+        # Consultar primero la caché de lecturas por nombre
+        cache = get_cache("courses", "name")
+        course = cache.get(("one", name))
+        if course is MISSING:
+            generation = cache.generation
+            course = await db["courses"].find_one({"name": name}, COURSE_PROJECTION)
+            if course:
+                cache.set(("one", name), course, generation)
         if course:
-            course["_id"] = str(course["_id"])
             logger.info("Curso recuperado exitosamente")
-            return course
+            return BSONJSONResponse(course)
         logger.warning("Curso no encontrado")
         raise HTTPException(status_code=404, detail="Curso no encontrado")
     except Exception as e:
-        logger.error(f"Error al buscar curso: {e}")
+        logger.error("Error al buscar curso: %s", e)
         raise HTTPException(status_code=500, detail="Error al buscar curso")
 
 # Ruta para obtener cursos por nombre
 @app.get("/courses/name/{name}")
-async def get_courses_by_name(name: str):
+async def get_courses_by_name(name: str, db: AsyncDatabase = Depends(get_db)):
     try:
-        courses = db["courses"].find({"name": name})
-        courses_list = [{"id": str(course["_id"]), "name": course["name"], "faculty": course["faculty"], "students": course["students"]} for course in courses]
+        # Consultar primero la caché de lecturas por nombre
+        cache = get_cache("courses", "name")
+        courses_list = cache.get(("all", name))
+        if courses_list is MISSING:
+            generation = cache.generation
+            # La proyección renombra _id a id en el servidor
+            courses_list = await db["courses"].find({"name": name}, {"_id": 0, "id": "$_id", "name": 1, "faculty": 1}).to_list()
+            if courses_list:
+                cache.set(("all", name), courses_list, generation)
         if not courses_list:
-            logger.warning(f"No se encontraron cursos con el nombre '{name}'")
+            logger.warning("No se encontraron cursos con el nombre '%s'", name)
             raise HTTPException(status_code=404, detail=f"No se encontraron cursos con el nombre '{name}'")
-        logger.info(f"Cursos con el nombre '{name}' recuperados exitosamente")
-        return courses_list
+        logger.info("Cursos con el nombre '%s' recuperados exitosamente", name)
+        return BSONJSONResponse(courses_list)
     except Exception as e:
-        logger.error(f"Error al buscar cursos por nombre: {e}")
+        logger.error("Error al buscar cursos por nombre: %s", e)
         raise HTTPException(status_code=500, detail="Error al buscar cursos por nombre")
 
 # Ruta para obtener un curso por ID
 @app.get("/courses/id/{course_id}")
-async def get_course_by_id(course_id: str):
+async def get_course_by_id(course_id: str, if_none_match: str | None = Header(None), db: AsyncDatabase = Depends(get_db)):
     try:
         obj_id = ObjectId(course_id)
-        course = db["courses"].find_one({"_id": obj_id})
+        # Consultar primero la caché de lecturas por ID
+        cache = get_cache("courses", "id")
+        course = cache.get(str(obj_id))
+        # GET condicional: si el ETag coincide se responde 304 comparando solo la versión
+        if if_none_match:
+            version = document_version(course) if course is not MISSING else await fetch_version(db.courses, obj_id)
+            if version is not None and etag_matches(if_none_match, make_etag(obj_id, version)):
+                return not_modified(make_etag(obj_id, version))
+        if course is MISSING:
+            generation = cache.generation
+            # Las lecturas simultáneas del mismo documento comparten la consulta
+            course = await get_flight("courses", "id").do((str(obj_id), generation), lambda: db["courses"].find_one({"_id": obj_id}, COURSE_PROJECTION))
+            if course:
+                cache.set(str(obj_id), course, generation)
         if course:
-            course["_id"] = str(course["_id"])
-            logger.info(f"Curso con ID '{course_id}' recuperado exitosamente")
-            return course
-        logger.warning(f"Curso con ID '{course_id}' no encontrado")
+            logger.info("Curso con ID '%s' recuperado exitosamente", course_id)
+            return BSONJSONResponse(course, headers={"ETag": make_etag(obj_id, document_version(course))})
+        logger.warning("Curso con ID '%s' no encontrado", course_id)
         raise HTTPException(status_code=404, detail=f"Curso con ID '{course_id}' no encontrado")
     except Exception as e:
-        logger.error(f"Error al buscar curso por ID: {e}")
+        logger.error("Error al buscar curso por ID: %s", e)
         raise HTTPException(status_code=400, detail="Formato de ID inválido")
 
 # Ruta para actualizar un curso por ID
 @app.put("/courses/updateCourse/{id}")
-async def update_course(id: str, course: Course):
+async def update_course(id: str, course: Course, db: AsyncDatabase = Depends(get_db)):
     try:
         obj_id = ObjectId(id)
-        result = db.courses.update_one({"_id": obj_id}, {"$set": course.dict()})
+        result = await db.courses.update_one({"_id": obj_id}, {"$set": with_search_key(course.dict(exclude={"students"})), "$inc": {"version": 1}})
+        invalidate("courses", obj_id)
         if result.matched_count == 0:
             logger.warning("Curso no encontrado")
             raise HTTPException(status_code=404, detail="Curso no encontrado")
+        # La lista de estudiantes solo se reemplaza si viene en la petición
+        if "students" in course.model_fields_set:
+            await fold_legacy_rosters(db, {"_id": obj_id})
+            await db[ENROLLMENTS].bulk_write(replace_roster_operations(obj_id, course.students))
         logger.info("Curso actualizado exitosamente")
         return {"message": "Curso actualizado exitosamente"}
     except Exception as e:
-        logger.error(f"Error al actualizar curso: {e}")
+        logger.error("Error al actualizar curso: %s", e)
         raise HTTPException(status_code=400, detail="Formato de ID inválido")
 
+# Definición del modelo de datos para actualizar solo algunos campos de un curso
+class CoursePatch(BaseModel):
+    name: str | None = None  # Nombre del curso
+    faculty: str | None = None  # Facultad del curso
+    students: list[ObjectIdRef] | None = None  # Si se envía, reemplaza la lista de estudiantes
+    version: int | None = None  # Versión leída (si no se envía If-Match)
+
+# Ruta para actualizar parcialmente un curso: solo se escriben ($set) los campos
+# enviados. Con If-Match o version, la escritura falla si otra petición lo modificó antes
+@app.patch("/courses/updateCourse/{id}")
+async def patch_course(id: str, course: CoursePatch, if_match: str | None = Header(None), db: AsyncDatabase = Depends(get_db)):
+    try:
+        obj_id = ObjectId(id)
+    except InvalidId:
+        raise HTTPException(status_code=400, detail="Formato de ID inválido")
+    try:
+        version = expected_version(if_match, obj_id, course.version)
+    except ValueError:
+        raise HTTPException(status_code=412, detail="If-Match no corresponde a este curso")
+    # null no borra campos obligatorios: se ignora igual que un campo no enviado
+    fields = course.dict(exclude_unset=True, exclude_none=True, exclude={"version", "students"})
+    replace_roster = course.students is not None
+    if not fields and not replace_roster:
+        raise HTTPException(status_code=400, detail="No hay campos que actualizar")
+    try:
+        new_version = await patch_document(db.courses, obj_id, with_search_key(fields), version)
+        if new_version is None:
+            current = await fetch_version(db.courses, obj_id)
+            if current is None:
+                logger.warning("Curso con ID '%s' no encontrado", id)
+                raise HTTPException(status_code=404, detail="Curso no encontrado")
+            logger.warning("Conflicto al actualizar el curso '%s': versión %s, actual %s", id, version, current)
+            raise HTTPException(status_code=412 if if_match else 409, detail=f"El curso ha sido modificado por otra petición (versión actual {current})")
+        # La lista de estudiantes (colección enrollments) solo se toca si viene en la petición
+        if replace_roster:
+            await fold_legacy_rosters(db, {"_id": obj_id})
+            await db[ENROLLMENTS].bulk_write(replace_roster_operations(obj_id, course.students))
+        invalidate("courses", obj_id)
+        logger.info("Curso con ID '%s' actualizado parcialmente (versión %s)", id, new_version)
+        return BSONJSONResponse({"version": new_version, "message": "Curso actualizado exitosamente"}, headers={"ETag": make_etag(obj_id, new_version)})
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error("Error al actualizar parcialmente el curso: %s", e)
+        raise HTTPException(status_code=500, detail="Error al actualizar curso")
+
 # Ruta para eliminar un curso por ID
 @app.delete("/courses/deleteById/{id}")
-async def delete_course_by_id(id: str):
+async def delete_course_by_id(id: str, db: AsyncDatabase = Depends(get_db)):
     try:
         # Intenta eliminar un curso de la base de datos usando el ID proporcionado
-        result = db.courses.delete_one({"_id": ObjectId(id)})
+        result = await db.courses.delete_one({"_id": ObjectId(id)})
+        invalidate("courses", ObjectId(id))
+        await db[ENROLLMENTS].delete_many({"course_id": ObjectId(id)})
         # Verifica si no se eliminó ningún curso
         if result.deleted_count == 0:
             # Registra una advertencia si no se encontró el curso
-            logger.warning(f"No se encontró curso con ID '{id}' para eliminar")
+            logger.warning("No se encontró curso con ID '%s' para eliminar", id)
             # Lanza una excepción HTTP 404 si no se encontró el curso
             raise HTTPException(status_code=404, detail=f"No se encontró curso con ID '{id}' para eliminar")
         # Registra un mensaje de éxito si el curso fue eliminado
-        logger.info(f"Curso con ID '{id}' eliminado exitosamente")
+        logger.info("Curso con ID '%s' eliminado exitosamente", id)
         # Devuelve un mensaje de éxito
         return {"message": f"Curso con ID '{id}' eliminado exitosamente"}
     except Exception as e:
         # Registra un error si ocurre una excepción
-        logger.error(f"Error al eliminar curso con ID '{id}': {e}")
+        logger.error("Error al eliminar curso con ID '%s': %s", id, e)
         # Lanza una excepción HTTP 400 si el formato del ID es inválido
         raise HTTPException(status_code=400, detail="Formato de ID inválido")
 
 
 # ------------------------------ AÑADIR O ELIMINAR ESTUDIANTE A CURSO ------------------------------
-# Ruta para añadir el ID de un estudiante al array de estudiantes de un curso
+# Ruta para matricular a un estudiante en un curso
 @app.post("/courses/addstudent/{course_id}/{student_id}")
-async def add_student_to_course(course_id: str, student_id: str):
+async def add_student_to_course(course_id: str, student_id: str, db: AsyncDatabase = Depends(get_db)):
     try:
         # Validar y convertir course_id y student_id a ObjectId si es necesario
         try:
@@ -146,26 +279,22 @@ async def add_student_to_course(course_id: str, student_id: str):
         except Exception:
             raise HTTPException(status_code=400, detail="Formato de ID inválido")
 
-        # Actualizar el curso agregando el student_id al array de estudiantes
-        result = db.courses.update_one(
-            {"_id": obj_course_id},
-            {"$push": {"students": str(obj_student_id)}}  # Se almacena como string en el array
-        )
-
-        # Verificar si el curso fue encontrado y actualizado
-        if result.matched_count == 0:
+        # Crear la matrícula (no se duplica si ya existe); falla si el curso no existe
+        if not await write_enrollment(db, obj_course_id, enroll_operation(obj_course_id, obj_student_id)):
             raise HTTPException(status_code=404, detail="Curso no encontrado")
 
-        logger.info(f"ID del estudiante {student_id} añadido al curso con ID {course_id} exitosamente")
+        logger.info("ID del estudiante %s añadido al curso con ID %s exitosamente", student_id, course_id)
         return {"message": f"ID del estudiante {student_id} añadido al curso con ID {course_id} exitosamente"}
 
+    except HTTPException:
+        raise
     except Exception as e:
-        logger.error(f"Error al añadir ID del estudiante al curso: {e}")
+        logger.error("Error al añadir ID del estudiante al curso: %s", e)
         raise HTTPException(status_code=500, detail="Error interno del servidor")
 
-# Ruta para eliminar el ID de un estudiante del array de estudiantes de un curso
+# Ruta para desmatricular a un estudiante de un curso
 @app.delete("/courses/removestudent/{course_id}/{student_id}")
-async def remove_student_from_course(course_id: str, student_id: str):
+async def remove_student_from_course(course_id: str, student_id: str, db: AsyncDatabase = Depends(get_db)):
     try:
         # Validar y convertir course_id y student_id a ObjectId si es necesario
         try:
@@ -174,20 +303,170 @@ async def remove_student_from_course(course_id: str, student_id: str):
         except Exception:
             raise HTTPException(status_code=400, detail="Formato de ID inválido")
 
-        # Actualizar el curso eliminando el student_id del array de estudiantes
-        result = db.courses.update_one(
-            {"_id": obj_course_id},
-            {"$pull": {"students": str(obj_student_id)}}  # Se elimina el ID del array
-        )
-
-        # Verificar si el curso fue encontrado y actualizado
-        if result.matched_count == 0:
+        # Eliminar la matrícula; falla si el curso no existe
+        if not await write_enrollment(db, obj_course_id, unenroll_one_operation(obj_course_id, obj_student_id)):
             raise HTTPException(status_code=404, detail="Curso no encontrado")
 
-        logger.info(f"ID del estudiante {student_id} eliminado del curso con ID {course_id} exitosamente")
+        logger.info("ID del estudiante %s eliminado del curso con ID %s exitosamente", student_id, course_id)
         return {"message": f"ID del estudiante {student_id} eliminado del curso con ID {course_id} exitosamente"}
 
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error("Error al eliminar ID del estudiante del curso: %s", e)
+        raise HTTPException(status_code=500, detail="Error interno del servidor")
+
+# Ruta para obtener la lista de estudiantes de un curso paginada por student_id
+@app.get("/courses/{course_id}/students")
+async def get_course_students(course_id: str, limit: int = Query(DEFAULT_LIMIT, ge=1, le=MAX_LIMIT), after: str | None = None, db: AsyncDatabase = Depends(get_db)):
+    try:
+        obj_course_id = ObjectId(course_id)
+        after_id = decode_cursor(after) if after else None
+    except Exception:
+        raise HTTPException(status_code=400, detail="Formato de ID o cursor inválido")
+    try:
+        if not await existing_course_ids(db, [obj_course_id]):
+            raise HTTPException(status_code=404, detail="Curso no encontrado")
+        await fold_legacy_rosters(db, {"_id": obj_course_id})
+        students, next_after = await find_roster_page(db, obj_course_id, limit, after_id)
+        logger.info("Estudiantes del curso con ID '%s' obtenidos exitosamente", course_id)
+        return BSONJSONResponse({
+            "students": students,
+            "next": encode_cursor(next_after) if next_after else None,
+            "message": f"Estudiantes del curso con ID '{course_id}' obtenidos exitosamente"
+        })
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error("Error al obtener los estudiantes del curso: %s", e)
+        raise HTTPException(status_code=500, detail="Error al obtener los estudiantes del curso")
+
+
+# ------------------------------ MATRÍCULAS EN BLOQUE ------------------------------
+# Definición del modelo de datos para una lista de IDs de estudiantes
+class StudentIds(BaseModel):
+    students: list[str]  # IDs de los estudiantes
+
+# Definición del modelo de datos para los cambios de matrícula de un curso
+class CourseEnrollment(BaseModel):
+    course_id: str  # ID del curso
+    add: list[str] = []  # IDs de estudiantes a añadir
+    remove: list[str] = []  # IDs de estudiantes a eliminar
+
+# Validar una lista de IDs de estudiantes
+def parse_student_ids(student_ids):
+    return [to_object_id(student_id) for student_id in student_ids]
+
+# Ruta para añadir varios estudiantes a un curso en una sola operación
+@app.post("/courses/addstudents/{course_id}")
+async def add_students_to_course(course_id: str, body: StudentIds, db: AsyncDatabase = Depends(get_db)):
+    try:
+        obj_course_id = ObjectId(course_id)
+        student_ids = parse_student_ids(body.students)
+    except Exception:
+        raise HTTPException(status_code=400, detail="Formato de ID inválido")
+    try:
+        if not await existing_course_ids(db, [obj_course_id]):
+            raise HTTPException(status_code=404, detail="Curso no encontrado")
+        await fold_legacy_rosters(db, {"_id": obj_course_id})
+        # Un upsert por estudiante en un único bulk_write: los ya matriculados no se duplican
+        result = await db[ENROLLMENTS].bulk_write([enroll_operation(obj_course_id, student_id) for student_id in student_ids], ordered=False) if student_ids else None
+        enrolled = result.upserted_count if result else 0
+        logger.info("%s estudiantes añadidos al curso con ID %s exitosamente", enrolled, course_id)
+        return {"enrolled": enrolled, "message": f"{enrolled} estudiantes añadidos al curso con ID {course_id} exitosamente"}
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error("Error al añadir estudiantes al curso: %s", e)
+        raise HTTPException(status_code=500, detail="Error interno del servidor")
+
+# Ruta para eliminar varios estudiantes de un curso en una sola operación
+@app.post("/courses/removestudents/{course_id}")
+async def remove_students_from_course(course_id: str, body: StudentIds, db: AsyncDatabase = Depends(get_db)):
+    try:
+        obj_course_id = ObjectId(course_id)
+        student_ids = parse_student_ids(body.students)
+    except Exception:
+        raise HTTPException(status_code=400, detail="Formato de ID inválido")
+    try:
+        if not await existing_course_ids(db, [obj_course_id]):
+            raise HTTPException(status_code=404, detail="Curso no encontrado")
+        await fold_legacy_rosters(db, {"_id": obj_course_id})
+        result = await db[ENROLLMENTS].delete_many({"course_id": obj_course_id, "student_id": {"$in": student_ids}})
+        logger.info("%s estudiantes eliminados del curso con ID %s exitosamente", result.deleted_count, course_id)
+        return {"removed": result.deleted_count, "message": f"{result.deleted_count} estudiantes eliminados del curso con ID {course_id} exitosamente"}
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error("Error al eliminar estudiantes del curso: %s", e)
+        raise HTTPException(status_code=500, detail="Error interno del servidor")
+
+# Ruta para aplicar cambios de matrícula sobre varios cursos con un único bulk_write
+@app.post("/courses/enrollments")
+async def update_enrollments(enrollments: list[CourseEnrollment], db: AsyncDatabase = Depends(get_db)):
+    try:
+        changes = [
+            (ObjectId(enrollment.course_id), parse_student_ids(enrollment.add), parse_student_ids(enrollment.remove))
+            for enrollment in enrollments
+        ]
+    except Exception:
+        raise HTTPException(status_code=400, detail="Formato de ID inválido")
+    try:
+        # Los cambios sobre cursos que no existen no se aplican y se informan
+        found = await existing_course_ids(db, [course_id for course_id, _, _ in changes])
+        missing = [str(course_id) for course_id, _, _ in changes if course_id not in found]
+        await fold_legacy_rosters(db, {"_id": {"$in": list(found)}})
+        operations = []
+        for course_id, add, remove in changes:
+            if course_id not in found:
+                continue
+            operations.extend(enroll_operation(course_id, student_id) for student_id in add)
+            if remove:
+                operations.append(unenroll_operation(course_id, remove))
+        if not operations:
+            return {"enrolled": 0, "removed": 0, "missing": missing, "message": "No hay cambios de matrícula que aplicar"}
+        result = await db[ENROLLMENTS].bulk_write(operations, ordered=False)
+        logger.info("Matrículas actualizadas en %s cursos exitosamente", len(found))
+        return {
+            "enrolled": result.upserted_count,
+            "removed": result.deleted_count,
+            "missing": missing,
+            "message": f"Matrículas actualizadas en {len(found)} cursos exitosamente"
+        }
     except Exception as e:
-        logger.error(f"Error al eliminar ID del estudiante del curso: {e}")
+        logger.error("Error al actualizar matrículas en bloque: %s", e)
         raise HTTPException(status_code=500, detail="Error interno del servidor")
 
+
+# ------------------------------ UNIVERSIDADES DE UN CURSO ------------------------------
+# Definición del modelo de datos para una búsqueda de universidades de varios cursos
+class CourseLookup(BaseModel):
+    courses: list[str]  # IDs de los cursos
+
+# Ruta para obtener las universidades que ofrecen un curso (índice multikey universities.courses)
+@app.get("/courses/{course_id}/universities")
+async def get_course_universities(course_id: str, db: AsyncDatabase = Depends(get_db)):
+    try:
+        refs = ref_variants(course_id)
+    except Exception:
+        raise HTTPException(status_code=400, detail="Formato de ID inválido")
+    try:
+        universities = await db.universities.find({"courses": {"$in": refs}}, {"name": 1, "city": 1, "country": 1}).to_list()
+        logger.info("Universidades del curso con ID '%s' obtenidas exitosamente", course_id)
+        return BSONJSONResponse({"universities": universities, "message": f"Universidades del curso con ID '{course_id}' obtenidas exitosamente"})
+    except Exception as e:
+        logger.error("Error al obtener las universidades del curso: %s", e)
+        raise HTTPException(status_code=500, detail="Error al obtener las universidades del curso")
+
+# Ruta para obtener las universidades de varios cursos en una sola consulta
+@app.post("/courses/universities")
+async def get_courses_universities(body: CourseLookup, db: AsyncDatabase = Depends(get_db)):
+    try:
+        universities = await reverse_lookup(db.universities, "courses", body.courses, {"name": 1, "city": 1, "country": 1})
+        logger.info("Universidades de %s cursos obtenidas exitosamente", len(body.courses))
+        return BSONJSONResponse({"universities": universities, "message": f"Universidades de {len(body.courses)} cursos obtenidas exitosamente"})
+    except InvalidId:
+        raise HTTPException(status_code=400, detail="Formato de ID inválido")
+    except Exception as e:
+        logger.error("Error al obtener las universidades de los cursos: %s", e)
+        raise HTTPException(status_code=500, detail="Error al obtener las universidades de los cursos")
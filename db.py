@@ -1,29 +1,145 @@
 import os
+import time
+import asyncio
 import logging
+import pymongo
+from contextlib import asynccontextmanager
 from dotenv import load_dotenv
-from pymongo import MongoClient
+from fastapi import Request
+from pymongo import AsyncMongoClient
+from enrollments import ENROLLMENT_WRITE_BEHIND, ENROLLMENTS, enrollment_writer
+from indexes import ensure_indexes
+from logconfig import setup_logging
+from monitoring import MONITORING_ENABLED, command_monitor
 
 # Load environmental variables
 load_dotenv()
 
-# Nivel y formato de logging
-logging.basicConfig(level=logging.INFO)
+# Logging asíncrono en JSON (ver logconfig.py)
+setup_logging()
 logger = logging.getLogger(__name__)
 
-# Probar la conexión
+# Nombre de la base de datos
+DB_NAME = os.getenv("MONGODB_DB", "test")
+
+# Aplicar los índices declarados en indexes.py al arrancar
+ENSURE_INDEXES = os.getenv("MONGODB_ENSURE_INDEXES", "1") != "0"
+
+# Vigencia (s) del último ping de /readyz y tiempo máximo de cada ping
+READY_CACHE_SECONDS = float(os.getenv("READY_CACHE_SECONDS", "2"))
+READY_TIMEOUT_SECONDS = float(os.getenv("READY_TIMEOUT_SECONDS", "1"))
+
+# Variables de entorno -> opciones del cliente de MongoDB
+_CLIENT_OPTIONS = {
+    "MONGODB_MAX_POOL_SIZE": ("maxPoolSize", int),
+    "MONGODB_MIN_POOL_SIZE": ("minPoolSize", int),
+    "MONGODB_MAX_IDLE_TIME_MS": ("maxIdleTimeMS", int),
+    "MONGODB_SERVER_SELECTION_TIMEOUT_MS": ("serverSelectionTimeoutMS", int),
+    "MONGODB_COMPRESSORS": ("compressors", str),  # p. ej. "zstd,snappy,zlib"
+    "MONGODB_WRITE_CONCERN": ("w", lambda value: int(value) if value.isdigit() else value),  # "1", "majority"...
+}
+
+# Cliente único para todo el proceso (un solo pool de conexiones)
+_client = None
+
+# Leer las opciones del cliente definidas en el entorno
+def get_client_options():
+    options = {}
+    for env_name, (option, cast) in _CLIENT_OPTIONS.items():
+        value = os.getenv(env_name)
+        if value:
+            options[option] = cast(value)
+    if MONITORING_ENABLED:
+        # Duración de cada comando, por colección y ruta, y log de consultas lentas
+        options["event_listeners"] = [command_monitor]
+    return options
+
+# Obtener (o crear) el cliente compartido
+def get_client():
+    global _client
+    if _client is None:
+        try:
+            # Obtener la URI de MongoDB de las variables de entorno
+            MONGO_URI = os.getenv("MONGODB_URI")
+            # El cliente asíncrono no se conecta hasta la primera operación
+            _client = AsyncMongoClient(MONGO_URI, **get_client_options())
+            logger.info("Cliente de MongoDB creado")
+        except Exception as e:
+            logger.error("Error al crear el cliente de MongoDB: %s", e)
+            raise
+    return _client
+
+# Obtener la base de datos usando el cliente compartido
 def get_database():
-    try: 
-        # Obtener la URI de MongoDB de las variables de entorno
-        MONGO_URI = os.getenv("MONGODB_URI")
-        # Crear un cliente de MongoDB
-        client = MongoClient(MONGO_URI)
-        # El comando ismaster es barato y no requiere autenticación
-        client.admin.command('ismaster')
-
-        # Usando logger
-        db = client['test']
-        logger.info("Conectado a MongoDB")
-        return db
+    return get_client()[DB_NAME]
+
+# Cerrar el cliente compartido y su pool de conexiones
+async def close_client():
+    global _client
+    if _client is not None:
+        await _client.close()
+        _client = None
+        logger.info("Cliente de MongoDB cerrado")
+
+# Probar la conexión
+async def ping_database(db):
+    # El comando ping es barato y no requiere autenticación
+    await db.client.admin.command('ping')
+    logger.info("Conectado a MongoDB")
+
+# Tareas de arranque en segundo plano: abrir la primera conexión y aplicar
+# los índices. El worker acepta peticiones sin esperar a MongoDB
+async def warm_up(db):
+    try:
+        await ping_database(db)
     except Exception as e:
-        logger.error(f"Error al conectar a MongoDB: {e}")
-        raise
+        logger.error("Error al conectar con MongoDB al arrancar: %s", e)
+    if ENSURE_INDEXES:
+        try:
+            await ensure_indexes(db)
+        except Exception as e:
+            logger.error("Error al aplicar los índices: %s", e)
+
+# Ciclo de vida de la aplicación: crea el cliente al arrancar y lo cierra al parar
+@asynccontextmanager
+async def lifespan(app):
+    app.state.db = get_database()
+    app.state.warm_up = asyncio.create_task(warm_up(app.state.db))
+    if ENROLLMENT_WRITE_BEHIND:
+        enrollment_writer.start(app.state.db[ENROLLMENTS])
+    try:
+        yield
+    finally:
+        # Escribir las matrículas pendientes antes de cerrar el cliente
+        await enrollment_writer.close()
+        if not app.state.warm_up.done():
+            app.state.warm_up.cancel()
+            await asyncio.gather(app.state.warm_up, return_exceptions=True)
+        await close_client()
+
+# Estado de la última comprobación de /readyz, compartido por todas las peticiones
+_readiness = {"ready": False, "error": "Sin comprobar", "checked_at": float("-inf")}
+_readiness_lock = asyncio.Lock()
+
+# Comprobar si MongoDB responde. El resultado se reutiliza durante
+# READY_CACHE_SECONDS y las comprobaciones simultáneas esperan a la misma
+async def check_readiness(db):
+    if time.monotonic() - _readiness["checked_at"] < READY_CACHE_SECONDS:
+        return _readiness
+    async with _readiness_lock:
+        if time.monotonic() - _readiness["checked_at"] < READY_CACHE_SECONDS:
+            return _readiness
+        try:
+            with pymongo.timeout(READY_TIMEOUT_SECONDS):
+                await db.client.admin.command('ping')
+            _readiness.update(ready=True, error=None)
+        except Exception as e:
+            if _readiness["ready"] or _readiness["error"] == "Sin comprobar":
+                logger.warning("MongoDB no está disponible: %s", e)
+            _readiness.update(ready=False, error=str(e))
+        _readiness["checked_at"] = time.monotonic()
+    return _readiness
+
+# Dependencia de FastAPI para obtener la base de datos en cada ruta
+def get_db(request: Request):
+    return request.app.state.db
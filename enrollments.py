@@ -0,0 +1,159 @@
+import os
+import time
+import logging
+from datetime import datetime, timezone
+from pymongo import DeleteMany, DeleteOne, UpdateOne
+from bson import ObjectId
+from cache import invalidate
+from references import to_object_id
+from writebehind import QueueClosed, RejectedOperation, WriteBehindQueue
+
+logger = logging.getLogger(__name__)
+
+# Colección de matrículas: un documento por par (curso, estudiante) con índice
+# único compuesto, en lugar de un array sin límite dentro de cada curso
+ENROLLMENTS = "enrollments"
+
+# Matricular (idempotente: el upsert no duplica un par que ya existe)
+def enroll_operation(course_id, student_id):
+    return UpdateOne(
+        {"course_id": course_id, "student_id": student_id},
+        {"$setOnInsert": {"created_at": datetime.now(timezone.utc)}},
+        upsert=True
+    )
+
+# Desmatricular a un estudiante de un curso
+def unenroll_one_operation(course_id, student_id):
+    return DeleteOne({"course_id": course_id, "student_id": student_id})
+
+# Desmatricular varios estudiantes de un curso
+def unenroll_operation(course_id, student_ids):
+    return DeleteMany({"course_id": course_id, "student_id": {"$in": student_ids}})
+
+# Reemplazar la lista de estudiantes de un curso por `student_ids`
+def replace_roster_operations(course_id, student_ids):
+    operations = [DeleteMany({"course_id": course_id, "student_id": {"$nin": student_ids}})]
+    operations.extend(enroll_operation(course_id, student_id) for student_id in student_ids)
+    return operations
+
+# Transición desde las listas antiguas courses.students: hasta que termina la
+# migración "enrollments" puede quedar algún curso con su array. Las rutas que
+# leen o escriben la lista de un curso lo pasan antes a enrollments, así lo que
+# escriben después no lo deshace la migración y las lecturas ven las matrículas
+# antiguas. Se comprueba cada LEGACY_ROSTERS_CHECK_SECONDS si queda alguno;
+# cuando ya no queda ninguno no se vuelve a consultar
+LEGACY_ROSTERS_CHECK_SECONDS = float(os.getenv("LEGACY_ROSTERS_CHECK_SECONDS", "30"))
+_legacy_rosters = {"remaining": True, "checked_at": float("-inf")}
+
+async def legacy_rosters_remain(db):
+    if not _legacy_rosters["remaining"]:
+        return False
+    if time.monotonic() - _legacy_rosters["checked_at"] >= LEGACY_ROSTERS_CHECK_SECONDS:
+        _legacy_rosters["remaining"] = await db.courses.find_one({"students": {"$exists": True}}, {"_id": 1}) is not None
+        _legacy_rosters["checked_at"] = time.monotonic()
+    return _legacy_rosters["remaining"]
+
+# Pasar a enrollments los arrays de `courses` (documentos con _id y students) y
+# quitarlos de cada curso. Primero se escriben las matrículas y después se quita
+# el array: si se interrumpe, repetirlo no duplica nada
+async def move_legacy_rosters(db, courses):
+    operations = []
+    for course in courses:
+        for student_id in course.get("students") or []:
+            try:
+                operations.append(enroll_operation(course["_id"], to_object_id(student_id)))
+            except ValueError:
+                logger.warning("Referencia inválida '%s' en el curso %s, se omite", student_id, course["_id"])
+    if operations:
+        await db[ENROLLMENTS].bulk_write(operations, ordered=False)
+    course_ids = [course["_id"] for course in courses]
+    result = await db.courses.update_many(
+        {"_id": {"$in": course_ids}, "students": {"$exists": True}},
+        {"$unset": {"students": ""}, "$inc": {"version": 1}}
+    )
+    for course_id in course_ids:
+        invalidate("courses", course_id)
+    return result.modified_count
+
+# Pasar a enrollments los arrays que queden en los cursos que cumplen `query`
+async def fold_legacy_rosters(db, query):
+    if not await legacy_rosters_remain(db):
+        return
+    courses = await db.courses.find({**query, "students": {"$exists": True}}, {"students": 1}).to_list()
+    if courses:
+        await move_legacy_rosters(db, courses)
+
+# Lo mismo para los cursos de una universidad (sus referencias pueden ser string)
+async def fold_university_rosters(db, university_id):
+    if not await legacy_rosters_remain(db):
+        return
+    university = await db.universities.find_one({"_id": university_id}, {"courses": 1})
+    if university:
+        course_ids = [ObjectId(ref) for ref in university.get("courses") or [] if ObjectId.is_valid(ref)]
+        await fold_legacy_rosters(db, {"_id": {"$in": course_ids}})
+
+# Escritura diferida de matrículas individuales (ENROLLMENT_WRITE_BEHIND=1): las
+# altas y bajas se agrupan en un bulk_write cada ENROLLMENT_FLUSH_MS o cada
+# ENROLLMENT_FLUSH_OPS operaciones; con ENROLLMENT_MAX_PENDING sin escribir,
+# las nuevas peticiones esperan
+ENROLLMENT_WRITE_BEHIND = os.getenv("ENROLLMENT_WRITE_BEHIND", "0") == "1"
+
+# Comprobar qué cursos existen (solo se lee el _id)
+async def existing_course_ids(db, course_ids):
+    docs = await db.courses.find({"_id": {"$in": list(course_ids)}}, {"_id": 1}).to_list()
+    return {doc["_id"] for doc in docs}
+
+# La cola comprueba los cursos de todo el lote con una sola consulta en el flush
+enrollment_writer = WriteBehindQueue(
+    ENROLLMENTS,
+    flush_ms=float(os.getenv("ENROLLMENT_FLUSH_MS", "5")),
+    flush_ops=int(os.getenv("ENROLLMENT_FLUSH_OPS", "500")),
+    max_pending=int(os.getenv("ENROLLMENT_MAX_PENDING", "5000")),
+    check=lambda collection, course_ids: existing_course_ids(collection.database, course_ids),
+)
+
+# Escribir una matrícula de un curso; devuelve False si el curso no existe. Por
+# la cola diferida si está activa; si no (o si se cierra mientras se espera
+# hueco) se comprueba el curso y se escribe directamente
+async def write_enrollment(db, course_id, operation):
+    await fold_legacy_rosters(db, {"_id": course_id})
+    if enrollment_writer.running:
+        try:
+            await enrollment_writer.submit(operation, course_id)
+            return True
+        except RejectedOperation:
+            return False
+        except QueueClosed:
+            pass
+    if not await existing_course_ids(db, [course_id]):
+        return False
+    await db[ENROLLMENTS].bulk_write([operation])
+    return True
+
+# Página de la lista de estudiantes de un curso ordenada por student_id (índice único compuesto)
+async def find_roster_page(db, course_id, limit, after_id=None):
+    roster_filter = {"course_id": course_id}
+    if after_id is not None:
+        roster_filter["student_id"] = {"$gt": after_id}
+    docs = await db[ENROLLMENTS].find(roster_filter, {"_id": 0, "student_id": 1, "created_at": 1}) \
+        .sort("student_id", 1).limit(limit + 1).to_list()
+    next_after = None
+    if len(docs) > limit:
+        docs = docs[:limit]
+        next_after = docs[-1]["student_id"]
+    return docs, next_after
+
+# Pipeline: cursos (nombre y facultad) de los estudiantes indicados, agrupados por estudiante
+def student_courses_pipeline(student_ids):
+    return [
+        {"$match": {"student_id": {"$in": student_ids}}},
+        {"$lookup": {
+            "from": "courses",
+            "localField": "course_id",
+            "foreignField": "_id",
+            "pipeline": [{"$project": {"name": 1, "faculty": 1}}],
+            "as": "course"
+        }},
+        {"$unwind": "$course"},
+        {"$group": {"_id": "$student_id", "courses": {"$push": "$course"}}},
+    ]
@@ -0,0 +1,68 @@
+from fastapi import Response
+from pymongo import ReturnDocument
+
+# Campo con la versión del documento: vale 1 al crearlo y cada escritura lo incrementa
+VERSION_FIELD = "version"
+
+# Añadir la versión inicial a un documento nuevo
+def with_initial_version(doc):
+    doc[VERSION_FIELD] = 1
+    return doc
+
+# Versión de un documento ya leído (los documentos antiguos no tienen el campo)
+def document_version(doc):
+    return doc.get(VERSION_FIELD, 0)
+
+# ETag débil a partir del _id y la versión del documento: la misma versión se
+# envía en JSON, BSON o MessagePack y con o sin gzip, así que no identifica
+# unos bytes concretos (RFC 9110 §8.8.3), solo el estado del documento
+def make_etag(doc_id, version):
+    return f'W/"{doc_id}-{version}"'
+
+# Comprobar si la cabecera If-None-Match contiene el ETag actual
+def etag_matches(if_none_match, etag):
+    if not if_none_match:
+        return False
+    candidates = [candidate.strip() for candidate in if_none_match.split(",")]
+    # If-None-Match usa comparación débil: W/"x" equivale a "x"
+    return "*" in candidates or any(candidate.removeprefix("W/") == etag.removeprefix("W/") for candidate in candidates)
+
+# Versión que el cliente espera encontrar al escribir: la del ETag de If-Match
+# o, si no hay cabecera, la del cuerpo. None = sin comprobar. El ETag es débil
+# pero la versión identifica el estado del documento, así que se acepta con o
+# sin W/. Un If-Match que no corresponde a este documento lanza ValueError
+def expected_version(if_match, doc_id, body_version=None):
+    if not if_match:
+        return body_version
+    if if_match.strip() == "*":
+        return None
+    prefix = f'"{doc_id}-'
+    for candidate in if_match.split(","):
+        candidate = candidate.strip().removeprefix("W/")
+        if candidate.startswith(prefix) and candidate.endswith('"') and candidate[len(prefix):-1].isdigit():
+            return int(candidate[len(prefix):-1])
+    raise ValueError(f"If-Match no corresponde al documento {doc_id}")
+
+# Actualizar solo los campos indicados en una única escritura (sin leer antes el
+# documento). Con `version` el filtro solo coincide si nadie lo ha modificado
+# desde entonces. Devuelve la nueva versión, o None si no se aplicó
+async def patch_document(collection, obj_id, fields, version=None):
+    query = {"_id": obj_id}
+    if version is not None:
+        # Los documentos anteriores al campo version cuentan como versión 0
+        query[VERSION_FIELD] = version if version else {"$in": [0, None]}
+    update = {"$inc": {VERSION_FIELD: 1}}
+    if fields:
+        update["$set"] = fields
+    doc = await collection.find_one_and_update(query, update, projection={VERSION_FIELD: 1}, return_document=ReturnDocument.AFTER)
+    return None if doc is None else document_version(doc)
+
+# Leer solo la versión del documento (proyección), sin traer el documento entero
+async def fetch_version(collection, obj_id):
+    doc = await collection.find_one({"_id": obj_id}, {VERSION_FIELD: 1})
+    return None if doc is None else document_version(doc)
+
+# Respuesta 304 sin cuerpo, con el mismo Vary que la respuesta 200 (formato
+# según Accept y compresión según Accept-Encoding)
+def not_modified(etag):
+    return Response(status_code=304, headers={"ETag": etag, "Vary": "Accept, Accept-Encoding"})
@@ -0,0 +1,50 @@
+import os
+import bson
+import logging
+from serializer import BSON_MEDIA_TYPE, MSGPACK_MEDIA_TYPE, dumps, dumps_msgpack, negotiate
+
+logger = logging.getLogger(__name__)
+
+# Documentos que se piden a MongoDB en cada lote del cursor
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", "1000"))
+
+# Formatos de exportación soportados, su media type y cómo se codifica cada
+# documento: NDJSON (una línea JSON), BSON concatenado (como un volcado de
+# mongodump) y objetos MessagePack concatenados
+EXPORT_FORMATS = {"ndjson": "application/x-ndjson", "bson": BSON_MEDIA_TYPE, "msgpack": MSGPACK_MEDIA_TYPE}
+EXPORT_FORMAT_PATTERN = "^(ndjson|bson|msgpack)$"
+_EXPORT_ENCODERS = {
+    "ndjson": lambda doc: dumps(doc) + b"\n",  # ObjectId como str y fechas en ISO 8601
+    "bson": bson.encode,
+    "msgpack": dumps_msgpack,
+}
+
+# Formato de la exportación: el del parámetro format o, si no se indica, el
+# que corresponda a la cabecera Accept (NDJSON por defecto)
+def export_format(format, accept):
+    if format:
+        return format
+    return {BSON_MEDIA_TYPE: "bson", MSGPACK_MEDIA_TYPE: "msgpack"}.get(negotiate(accept), "ndjson")
+
+# Cabeceras de la exportación: si el formato sale de Accept la respuesta varía
+# según esa cabecera y las cachés compartidas tienen que distinguirla
+def export_headers(format):
+    return {} if format else {"Vary": "Accept"}
+
+# Recorrer la colección entera en lotes
+def export_cursor(collection, projection=None):
+    return collection.find({}, projection).sort("_id", 1).batch_size(EXPORT_BATCH_SIZE)
+
+# Codificar cada documento a medida que llega del cursor, así la memoria no
+# crece con el tamaño de la colección
+async def export_stream(cursor, format="ndjson"):
+    encode = _EXPORT_ENCODERS[format]
+    try:
+        async for doc in cursor:
+            yield encode(doc)
+    except Exception as e:
+        # La respuesta ya está en curso: solo se puede registrar y cortar el stream
+        logger.error("Error durante la exportación: %s", e)
+        raise
+    finally:
+        await cursor.close()
@@ -0,0 +1,84 @@
+import sys
+import asyncio
+import logging
+from pymongo import ASCENDING, IndexModel
+from pymongo.errors import OperationFailure
+
+logger = logging.getLogger(__name__)
+
+# Índices declarados por colección. Se aplican al arrancar con create_indexes,
+# que no hace nada si el índice ya existe con la misma definición
+INDEXES = {
+    "students": [
+        IndexModel([("name", ASCENDING)], name="name_1"),
+        IndexModel([("name_key", ASCENDING)], name="name_key_1"),  # búsqueda por prefijo
+    ],
+    "courses": [
+        IndexModel([("name", ASCENDING)], name="name_1"),
+        IndexModel([("name_key", ASCENDING)], name="name_key_1"),
+    ],
+    "universities": [
+        IndexModel([("name", ASCENDING)], name="name_1"),
+        IndexModel([("name_key", ASCENDING)], name="name_key_1"),
+        IndexModel([("country", ASCENDING), ("city", ASCENDING)], name="country_1_city_1"),
+        IndexModel([("courses", ASCENDING)], name="courses_1"),  # multikey: universidades de un curso
+    ],
+    "enrollments": [
+        # Un estudiante solo puede estar una vez en cada curso; sirve también para paginar la lista
+        IndexModel([("course_id", ASCENDING), ("student_id", ASCENDING)], name="course_id_1_student_id_1", unique=True),
+        IndexModel([("student_id", ASCENDING), ("course_id", ASCENDING)], name="student_id_1_course_id_1"),  # cursos de un estudiante
+    ],
+}
+
+# Crear los índices declarados que falten en cada colección
+async def ensure_indexes(db):
+    for collection, models in INDEXES.items():
+        try:
+            names = await db[collection].create_indexes(models)
+            logger.info("Índices de '%s' verificados: %s", collection, ', '.join(names))
+        except OperationFailure as e:
+            # Un índice con el mismo nombre y otra definición no se sobrescribe
+            logger.error("Error al crear índices en '%s': %s", collection, e)
+
+# Comparar los índices declarados con los existentes y su uso ($indexStats)
+async def report_indexes(db):
+    report = {}
+    for collection, models in INDEXES.items():
+        declared = {model.document["name"] for model in models}
+        stats = await (await db[collection].aggregate([{"$indexStats": {}}])).to_list()
+        existing = {stat["name"]: stat for stat in stats}
+        report[collection] = {
+            "missing": sorted(declared - existing.keys()),
+            "undeclared": sorted(existing.keys() - declared - {"_id_"}),
+            "unused": sorted(
+                name for name, stat in existing.items()
+                if name != "_id_" and stat["accesses"]["ops"] == 0
+            ),
+        }
+    return report
+
+async def main(command):
+    from db import close_client, get_database
+
+    db = get_database()
+    try:
+        if command == "apply":
+            await ensure_indexes(db)
+            return 0
+        report = await report_indexes(db)
+        for collection, result in report.items():
+            print(f"{collection}:")
+            print(f"  faltan:        {', '.join(result['missing']) or '-'}")
+            print(f"  no declarados: {', '.join(result['undeclared']) or '-'}")
+            print(f"  sin uso:       {', '.join(result['unused']) or '-'}")
+        # Código de salida distinto de cero si falta algún índice declarado
+        return 1 if any(result["missing"] for result in report.values()) else 0
+    finally:
+        await close_client()
+
+# Uso: python indexes.py report | apply
+if __name__ == "__main__":
+    command = sys.argv[1] if len(sys.argv) > 1 else "report"
+    if command not in ("report", "apply"):
+        sys.exit("Uso: python indexes.py [report|apply]")
+    sys.exit(asyncio.run(main(command)))
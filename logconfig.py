@@ -0,0 +1,90 @@
+import os
+import sys
+import json
+import queue
+import atexit
+import random
+import logging
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+from metrics import current_route
+
+# Nivel y formato del log: "json" (una línea JSON por registro) o "text"
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json")
+
+# Fracción de los mensajes de éxito (INFO y DEBUG) que se escriben, en general y
+# por plantilla de ruta: LOG_SAMPLE_ROUTES="/students/id/{student_id}=0.01,/courses=0.1".
+# Los avisos y errores se escriben siempre
+LOG_SAMPLE_RATE = float(os.getenv("LOG_SAMPLE_RATE", "1"))
+
+def parse_sample_routes(value):
+    rates = {}
+    for item in value.split(","):
+        if "=" in item:
+            route, rate = item.rsplit("=", 1)
+            rates[route.strip()] = float(rate)
+    return rates
+
+LOG_SAMPLE_ROUTES = parse_sample_routes(os.getenv("LOG_SAMPLE_ROUTES", ""))
+
+# Atributos estándar de LogRecord; el resto (extra=...) se añade al JSON
+_RECORD_FIELDS = set(vars(logging.makeLogRecord({}))) | {"message", "route", "asctime"}
+
+# Filtro en el lado de la petición: anota la ruta (la contextvar solo se puede
+# leer aquí; se respeta la que venga en extra=) y descarta los mensajes de
+# éxito no muestreados antes de encolarlos
+class RouteSamplingFilter(logging.Filter):
+    def filter(self, record):
+        if not hasattr(record, "route"):
+            record.route = current_route()
+        if record.levelno >= logging.WARNING:
+            return True
+        rate = LOG_SAMPLE_ROUTES.get(record.route, LOG_SAMPLE_RATE)
+        return rate >= 1 or random.random() < rate
+
+# QueueHandler que no formatea al encolar: el mensaje (%s y argumentos) y la
+# traza de las excepciones se componen en el hilo del QueueListener
+class LazyQueueHandler(QueueHandler):
+    def prepare(self, record):
+        return record
+
+# Un registro por línea en JSON, con la ruta y los campos pasados en extra=
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "route": getattr(record, "route", "-"),
+            "message": record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_FIELDS:
+                entry[key] = value
+        if record.exc_info:
+            entry["exc_info"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+_listener = None
+
+# Configurar el logging del proceso: los registros se encolan sin bloquear y un
+# hilo aparte los formatea y los escribe en stderr. Se puede llamar varias veces
+def setup_logging():
+    global _listener
+    if _listener is not None:
+        return
+    output = logging.StreamHandler(sys.stderr)
+    output.setFormatter(JsonFormatter() if LOG_FORMAT == "json" else logging.Formatter("%(levelname)s:%(name)s:%(message)s"))
+    records = queue.SimpleQueue()
+    handler = LazyQueueHandler(records)
+    handler.addFilter(RouteSamplingFilter())
+    root = logging.getLogger()
+    for existing in list(root.handlers):
+        root.removeHandler(existing)
+    root.addHandler(handler)
+    root.setLevel(LOG_LEVEL)
+    _listener = QueueListener(records, output)
+    _listener.start()
+    # Al salir se escriben los registros que queden en la cola
+    atexit.register(_listener.stop)
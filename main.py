@@ -1,21 +1,36 @@
-from db import get_database
+from admission import AdmissionMiddleware
+from bulk import BULK_CHUNK_SIZE, MAX_BULK_CHUNK_SIZE, BulkBodyError, bulk_insert
+from cache import MISSING, get_cache, invalidate
+from db import get_db, lifespan
+from enrollments import ENROLLMENTS, enroll_operation, existing_course_ids, find_roster_page, fold_legacy_rosters, fold_university_rosters, replace_roster_operations, student_courses_pipeline, unenroll_one_operation, unenroll_operation, write_enrollment
+from etag import document_version, etag_matches, expected_version, fetch_version, make_etag, not_modified, patch_document, with_initial_version
+from export import EXPORT_FORMAT_PATTERN, EXPORT_FORMATS, export_cursor, export_format, export_headers, export_stream
+from metrics import MetricsMiddleware
+from pagination import DEFAULT_LIMIT, MAX_LIMIT, decode_cursor, encode_cursor, find_page
+from references import ObjectIdRef, ref_variants, ref_variants_many, reverse_lookup, to_object_id
+from search import SEARCH_FIELD, WITHOUT_SEARCH_KEY, router as search_router, with_search_key
+from serializer import GZIP_COMPRESS_LEVEL, GZIP_MINIMUM_SIZE, BSONJSONResponse
+from singleflight import get_flight
 from pydantic import BaseModel
-from fastapi import FastAPI, HTTPException
+from fastapi import Depends, FastAPI, Header, HTTPException, Query, Request
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import StreamingResponse
 from bson import ObjectId
+from bson.errors import InvalidId
+from pymongo.asynchronous.database import AsyncDatabase
+from system import router as system_router
 import logging
 
 # Configuración del logger para el módulo actual
 logger = logging.getLogger(__name__)
 
-# Creación de la aplicación FastAPI
-app = FastAPI()
-
-# Intentar conectar a la base de datos
-try:
-    db = get_database()  # Obtener la conexión a la base de datos
-    logger.info("Conectado a MongoDB")  # Log de éxito
-except Exception as e:
-    logger.error(f"Error al conectar a MongoDB: {e}")  # Log de error
+# Creación de la aplicación FastAPI (el cliente de MongoDB se gestiona en el lifespan)
+app = FastAPI(lifespan=lifespan)
+app.add_middleware(GZipMiddleware, minimum_size=GZIP_MINIMUM_SIZE, compresslevel=GZIP_COMPRESS_LEVEL)
+app.add_middleware(AdmissionMiddleware)
+app.add_middleware(MetricsMiddleware)  # El último añadido es el más externo: mide también los 503
+app.include_router(system_router)
+app.include_router(search_router)
 
 # Definición del modelo de datos para un estudiante
 class Student(BaseModel):
@@ -24,230 +39,490 @@ class Student(BaseModel):
 
 # Ruta para crear un nuevo estudiante
 @app.post("/students")
-async def create_students(student: Student):
+async def create_students(student: Student, db: AsyncDatabase = Depends(get_db)):
     try:
-        result = db["students"].insert_one(student.dict())
+        result = await db["students"].insert_one(with_initial_version(with_search_key(student.dict())))
+        invalidate("students")
         logger.info("Estudiante añadido exitosamente")
         return {
             "id": str(result.inserted_id),
             "message": "Estudiante añadido exitosamente"
         }
     except Exception as e:
-        logger.error(f"Error al añadir estudiante: {e}")
+        logger.error("Error al añadir estudiante: %s", e)
         raise HTTPException(status_code=500, detail="Error al añadir estudiante")
 
-# Ruta para obtener todos los estudiantes
+# Ruta para crear estudiantes en bloque (array JSON o NDJSON) con insert_many no ordenado
+@app.post("/students/bulk")
+async def create_students_bulk(request: Request, chunk_size: int = Query(BULK_CHUNK_SIZE, ge=1, le=MAX_BULK_CHUNK_SIZE), db: AsyncDatabase = Depends(get_db)):
+    try:
+        result = await bulk_insert(request, db.students, Student, chunk_size)
+        invalidate("students")
+        result["message"] = f"Estudiantes añadidos en bloque: {result['inserted']} insertados, {result['failed']} con error"
+        return result
+    except BulkBodyError as e:
+        logger.warning("Cuerpo inválido en la inserción en bloque de estudiantes: %s", e)
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        logger.error("Error al añadir estudiantes en bloque: %s", e)
+        raise HTTPException(status_code=500, detail="Error al añadir estudiantes en bloque")
+
+# Ruta para obtener los estudiantes paginados por _id (parámetros limit y after)
 @app.get("/students")
-async def get_students():
+async def get_students(limit: int = Query(DEFAULT_LIMIT, ge=1, le=MAX_LIMIT), after: str | None = None, db: AsyncDatabase = Depends(get_db)):
+    # Validar el cursor de paginación
     try:
-        students = list(db.students.find())
-        for student in students:
-            student["_id"] = str(student["_id"])
+        after_id = decode_cursor(after) if after else None
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Cursor de paginación inválido")
+    try:
+        # Los listados idénticos simultáneos comparten la consulta. La generación de la
+        # caché cambia con cada escritura: una lectura posterior no se une a una anterior
+        generation = get_cache("students", "name").generation
+        students, next_cursor = await get_flight("students", "list").do((limit, after_id, generation), lambda: find_page(db.students, limit=limit, after_id=after_id, projection=WITHOUT_SEARCH_KEY))
         logger.info("Estudiantes obtenidos exitosamente")
-        return {"students": students, "message": "Estudiantes obtenidos exitosamente"}
+        return BSONJSONResponse({"students": students, "next": next_cursor, "message": "Estudiantes obtenidos exitosamente"})
     except Exception as e:
-        logger.error(f"Error al obtener estudiantes: {e}")
+        logger.error("Error al obtener estudiantes: %s", e)
         raise HTTPException(status_code=500, detail="Error al obtener estudiantes")
 
+# Ruta para exportar todos los estudiantes en streaming (NDJSON, BSON o MessagePack según format o Accept)
+@app.get("/students/export")
+async def export_students(format: str | None = Query(None, pattern=EXPORT_FORMAT_PATTERN), accept: str | None = Header(None), db: AsyncDatabase = Depends(get_db)):
+    headers = export_headers(format)
+    format = export_format(format, accept)
+    logger.info("Exportación de estudiantes iniciada (formato %s)", format)
+    return StreamingResponse(export_stream(export_cursor(db.students, WITHOUT_SEARCH_KEY), format), media_type=EXPORT_FORMATS[format], headers=headers)
+
 # Ruta para obtener un estudiante por nombre (solo el primero que coincida)
 @app.get("/students/{name}")
-async def get_one_student(name: str):
+async def get_one_student(name: str, db: AsyncDatabase = Depends(get_db)):
     try:
-        student = db["students"].find_one({"name": name})
+        # Consultar primero la caché de lecturas por nombre
+        cache = get_cache("students", "name")
+        student = cache.get(("one", name))
+        if student is MISSING:
+            generation = cache.generation
+            student = await db["students"].find_one({"name": name}, WITHOUT_SEARCH_KEY)
+            if student:
+                cache.set(("one", name), student, generation)
         if student:
-            student["_id"] = str(student["_id"])
             logger.info("Estudiante recuperado exitosamente")
-            return student
+            return BSONJSONResponse(student)
         logger.warning("Estudiante no encontrado")
         raise HTTPException(status_code=404, detail="Estudiante no encontrado")
     except Exception as e:
-        logger.error(f"Error al buscar estudiante: {e}")
+        logger.error("Error al buscar estudiante: %s", e)
         raise HTTPException(status_code=500, detail="Error al buscar estudiante")
 
 # Ruta para obtener estudiantes por nombre
 @app.get("/students/name/{name}")
-async def get_students_by_name(name: str):
+async def get_students_by_name(name: str, db: AsyncDatabase = Depends(get_db)):
     try:
-        students = db["students"].find({"name": name})
-        students_list = [{"id": str(student["_id"]), "name": student["name"], "age": student["age"]} for student in students]
+        # Consultar primero la caché de lecturas por nombre
+        cache = get_cache("students", "name")
+        students_list = cache.get(("all", name))
+        if students_list is MISSING:
+            generation = cache.generation
+            # La proyección renombra _id a id en el servidor
+            students_list = await db["students"].find({"name": name}, {"_id": 0, "id": "$_id", "name": 1, "age": 1}).to_list()
+            if students_list:
+                cache.set(("all", name), students_list, generation)
         if not students_list:
-            logger.warning(f"No se encontraron estudiantes con el nombre '{name}'")
+            logger.warning("No se encontraron estudiantes con el nombre '%s'", name)
             raise HTTPException(status_code=404, detail=f"No se encontraron estudiantes con el nombre '{name}'")
-        logger.info(f"Estudiantes con el nombre '{name}' recuperados exitosamente")
-        return students_list
+        logger.info("Estudiantes con el nombre '%s' recuperados exitosamente", name)
+        return BSONJSONResponse(students_list)
     except Exception as e:
-        logger.error(f"Error al buscar estudiantes por nombre: {e}")
+        logger.error("Error al buscar estudiantes por nombre: %s", e)
         raise HTTPException(status_code=500, detail="Error al buscar estudiantes por nombre")
 
 # Ruta para obtener un estudiante por ID
 @app.get("/students/id/{student_id}")
-async def get_student_by_id(student_id: str):
+async def get_student_by_id(student_id: str, if_none_match: str | None = Header(None), db: AsyncDatabase = Depends(get_db)):
     try:
         obj_id = ObjectId(student_id)
-        student = db["students"].find_one({"_id": obj_id})
+        # Consultar primero la caché de lecturas por ID
+        cache = get_cache("students", "id")
+        student = cache.get(str(obj_id))
+        # GET condicional: si el ETag coincide se responde 304 comparando solo la versión
+        if if_none_match:
+            version = document_version(student) if student is not MISSING else await fetch_version(db.students, obj_id)
+            if version is not None and etag_matches(if_none_match, make_etag(obj_id, version)):
+                return not_modified(make_etag(obj_id, version))
+        if student is MISSING:
+            generation = cache.generation
+            # Las lecturas simultáneas del mismo documento comparten la consulta
+            student = await get_flight("students", "id").do((str(obj_id), generation), lambda: db["students"].find_one({"_id": obj_id}, WITHOUT_SEARCH_KEY))
+            if student:
+                cache.set(str(obj_id), student, generation)
         if student:
-            student["_id"] = str(student["_id"])
-            logger.info(f"Estudiante con ID '{student_id}' recuperado exitosamente")
-            return student
-        logger.warning(f"Estudiante con ID '{student_id}' no encontrado")
+            logger.info("Estudiante con ID '%s' recuperado exitosamente", student_id)
+            return BSONJSONResponse(student, headers={"ETag": make_etag(obj_id, document_version(student))})
+        logger.warning("Estudiante con ID '%s' no encontrado", student_id)
         raise HTTPException(status_code=404, detail=f"Estudiante con ID '{student_id}' no encontrado")
     except Exception as e:
-        logger.error(f"Error al buscar estudiante por ID: {e}")
+        logger.error("Error al buscar estudiante por ID: %s", e)
         raise HTTPException(status_code=400, detail="Formato de ID inválido")
 
 # Ruta para actualizar un estudiante por ID
 @app.put("/students/updateStudent/{id}")
-async def update_student(id: str, student: Student):
+async def update_student(id: str, student: Student, db: AsyncDatabase = Depends(get_db)):
     try:
         obj_id = ObjectId(id)
-        result = db.students.update_one({"_id": obj_id}, {"$set": student.dict()})
+        result = await db.students.update_one({"_id": obj_id}, {"$set": with_search_key(student.dict()), "$inc": {"version": 1}})
+        invalidate("students", obj_id)
         if result.matched_count == 0:
             logger.warning("Estudiante no encontrado")
             raise HTTPException(status_code=404, detail="Estudiante no encontrado")
         logger.info("Estudiante actualizado exitosamente")
         return {"message": "Estudiante actualizado exitosamente"}
     except Exception as e:
-        logger.error(f"Error al actualizar estudiante: {e}")
+        logger.error("Error al actualizar estudiante: %s", e)
         raise HTTPException(status_code=400, detail="Formato de ID inválido")
 
+# Definición del modelo de datos para actualizar solo algunos campos de un estudiante
+class StudentPatch(BaseModel):
+    name: str | None = None  # Nombre del estudiante
+    age: int | None = None   # Edad del estudiante
+    version: int | None = None  # Versión leída (si no se envía If-Match)
+
+# Ruta para actualizar parcialmente un estudiante: solo se escriben ($set) los campos
+# enviados. Con If-Match o version, la escritura falla si otra petición lo modificó antes
+@app.patch("/students/updateStudent/{id}")
+async def patch_student(id: str, student: StudentPatch, if_match: str | None = Header(None), db: AsyncDatabase = Depends(get_db)):
+    try:
+        obj_id = ObjectId(id)
+    except InvalidId:
+        raise HTTPException(status_code=400, detail="Formato de ID inválido")
+    try:
+        version = expected_version(if_match, obj_id, student.version)
+    except ValueError:
+        raise HTTPException(status_code=412, detail="If-Match no corresponde a este estudiante")
+    # null no borra campos obligatorios: se ignora igual que un campo no enviado
+    fields = student.dict(exclude_unset=True, exclude_none=True, exclude={"version"})
+    if not fields:
+        raise HTTPException(status_code=400, detail="No hay campos que actualizar")
+    try:
+        new_version = await patch_document(db.students, obj_id, with_search_key(fields), version)
+        if new_version is None:
+            current = await fetch_version(db.students, obj_id)
+            if current is None:
+                logger.warning("Estudiante con ID '%s' no encontrado", id)
+                raise HTTPException(status_code=404, detail="Estudiante no encontrado")
+            logger.warning("Conflicto al actualizar el estudiante '%s': versión %s, actual %s", id, version, current)
+            raise HTTPException(status_code=412 if if_match else 409, detail=f"El estudiante ha sido modificado por otra petición (versión actual {current})")
+        invalidate("students", obj_id)
+        logger.info("Estudiante con ID '%s' actualizado parcialmente (versión %s)", id, new_version)
+        return BSONJSONResponse({"version": new_version, "message": "Estudiante actualizado exitosamente"}, headers={"ETag": make_etag(obj_id, new_version)})
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error("Error al actualizar parcialmente el estudiante: %s", e)
+        raise HTTPException(status_code=500, detail="Error al actualizar estudiante")
+
 # Ruta para eliminar un estudiante por ID
 @app.delete("/students/deleteById/{id}")
-async def delete_student_by_id(id: str):
+async def delete_student_by_id(id: str, db: AsyncDatabase = Depends(get_db)):
     try:
-        result = db.students.delete_one({"_id": ObjectId(id)})
+        result = await db.students.delete_one({"_id": ObjectId(id)})
+        invalidate("students", ObjectId(id))
+        # Los arrays antiguos que lo contengan pasan antes a enrollments, así también se borran
+        await fold_legacy_rosters(db, {"students": {"$in": ref_variants(id)}})
+        await db[ENROLLMENTS].delete_many({"student_id": ObjectId(id)})
         if result.deleted_count == 0:
-            logger.warning(f"No se encontró estudiante con ID '{id}' para eliminar")
+            logger.warning("No se encontró estudiante con ID '%s' para eliminar", id)
             raise HTTPException(status_code=404, detail=f"No se encontró estudiante con ID '{id}' para eliminar")
-        logger.info(f"Estudiante con ID '{id}' eliminado exitosamente")
+        logger.info("Estudiante con ID '%s' eliminado exitosamente", id)
         return {"message": f"Estudiante con ID '{id}' eliminado exitosamente"}
     except Exception as e:
-        logger.error(f"Error al eliminar estudiante con ID '{id}': {e}")
+        logger.error("Error al eliminar estudiante con ID '%s': %s", id, e)
         raise HTTPException(status_code=400, detail="Formato de ID inválido")
 
 
+# ------------------------------ CURSOS DE UN ESTUDIANTE ------------------------------
+# Definición del modelo de datos para una búsqueda de cursos de varios estudiantes
+class StudentLookup(BaseModel):
+    students: list[str]  # IDs de los estudiantes
+
+# Ruta para obtener los cursos en los que está matriculado un estudiante (índice enrollments.student_id)
+@app.get("/students/{student_id}/courses")
+async def get_student_courses(student_id: str, db: AsyncDatabase = Depends(get_db)):
+    try:
+        obj_id = ObjectId(student_id)
+    except Exception:
+        raise HTTPException(status_code=400, detail="Formato de ID inválido")
+    try:
+        await fold_legacy_rosters(db, {"students": {"$in": ref_variants(obj_id)}})
+        cursor = await db[ENROLLMENTS].aggregate(student_courses_pipeline([obj_id]))
+        groups = await cursor.to_list()
+        courses = groups[0]["courses"] if groups else []
+        logger.info("Cursos del estudiante con ID '%s' obtenidos exitosamente", student_id)
+        return BSONJSONResponse({"courses": courses, "message": f"Cursos del estudiante con ID '{student_id}' obtenidos exitosamente"})
+    except Exception as e:
+        logger.error("Error al obtener los cursos del estudiante: %s", e)
+        raise HTTPException(status_code=500, detail="Error al obtener los cursos del estudiante")
+
+# Ruta para obtener los cursos de varios estudiantes en una sola consulta
+@app.post("/students/courses")
+async def get_students_courses(body: StudentLookup, db: AsyncDatabase = Depends(get_db)):
+    try:
+        student_ids = [ObjectId(student_id) for student_id in body.students]
+        await fold_legacy_rosters(db, {"students": {"$in": ref_variants_many(student_ids)}})
+        cursor = await db[ENROLLMENTS].aggregate(student_courses_pipeline(student_ids))
+        groups = {group["_id"]: group["courses"] async for group in cursor}
+        courses = {str(student_id): groups.get(student_id, []) for student_id in student_ids}
+        logger.info("Cursos de %s estudiantes obtenidos exitosamente", len(body.students))
+        return BSONJSONResponse({"courses": courses, "message": f"Cursos de {len(body.students)} estudiantes obtenidos exitosamente"})
+    except InvalidId:
+        raise HTTPException(status_code=400, detail="Formato de ID inválido")
+    except Exception as e:
+        logger.error("Error al obtener los cursos de los estudiantes: %s", e)
+        raise HTTPException(status_code=500, detail="Error al obtener los cursos de los estudiantes")
+
+
 
 # ------------------------------ CURSOS ------------------------------
 # Definición del modelo de datos para un curso
 class Course(BaseModel):
     name: str  # Nombre del curso
     faculty: str  # Facultad del curso
-    students: list  # Lista de estudiantes en el curso
+    students: list[ObjectIdRef] = []  # IDs de estudiantes: se guardan en la colección enrollments, no en el curso
+
+# Las lecturas de cursos no devuelven la clave de búsqueda ni el array antiguo
+# students (la lista se lee de enrollments)
+COURSE_PROJECTION = {**WITHOUT_SEARCH_KEY, "students": 0}
 
 # Ruta para crear un nuevo curso
 @app.post("/courses")
-async def create_course(course: Course):
+async def create_course(course: Course, db: AsyncDatabase = Depends(get_db)):
     try:
-        result = db["courses"].insert_one(course.dict())
+        result = await db["courses"].insert_one(with_initial_version(with_search_key(course.dict(exclude={"students"}))))
+        if course.students:
+            await db[ENROLLMENTS].bulk_write([enroll_operation(result.inserted_id, student_id) for student_id in course.students], ordered=False)
+        invalidate("courses")
         logger.info("Curso añadido exitosamente")
         return {
             "id": str(result.inserted_id),
             "message": "Curso añadido exitosamente"
         }
     except Exception as e:
-        logger.error(f"Error al añadir curso: {e}")
+        logger.error("Error al añadir curso: %s", e)
         raise HTTPException(status_code=500, detail="Error al añadir curso")
 
-# Ruta para obtener todos los cursos
+# Ruta para crear cursos en bloque (array JSON o NDJSON) con insert_many no ordenado
+@app.post("/courses/bulk")
+async def create_courses_bulk(request: Request, chunk_size: int = Query(BULK_CHUNK_SIZE, ge=1, le=MAX_BULK_CHUNK_SIZE), db: AsyncDatabase = Depends(get_db)):
+    try:
+        # Los estudiantes de cada curso insertado se matriculan en la colección enrollments
+        async def enroll_students(inserted):
+            operations = [enroll_operation(course_id, student_id) for course, course_id in inserted for student_id in course.students]
+            if operations:
+                await db[ENROLLMENTS].bulk_write(operations, ordered=False)
+        result = await bulk_insert(request, db.courses, Course, chunk_size, exclude={"students"}, after_insert=enroll_students)
+        invalidate("courses")
+        result["message"] = f"Cursos añadidos en bloque: {result['inserted']} insertados, {result['failed']} con error"
+        return result
+    except BulkBodyError as e:
+        logger.warning("Cuerpo inválido en la inserción en bloque de cursos: %s", e)
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        logger.error("Error al añadir cursos en bloque: %s", e)
+        raise HTTPException(status_code=500, detail="Error al añadir cursos en bloque")
+
+# Ruta para obtener los cursos paginados por _id (parámetros limit y after)
 @app.get("/courses")
-async def get_courses():
+async def get_courses(limit: int = Query(DEFAULT_LIMIT, ge=1, le=MAX_LIMIT), after: str | None = None, db: AsyncDatabase = Depends(get_db)):
+    # Validar el cursor de paginación
+    try:
+        after_id = decode_cursor(after) if after else None
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Cursor de paginación inválido")
     try:
-        courses = list(db.courses.find())
-        for course in courses:
-            course["_id"] = str(course["_id"])
+        # Los listados idénticos simultáneos comparten la consulta. La generación de la
+        # caché cambia con cada escritura: una lectura posterior no se une a una anterior
+        generation = get_cache("courses", "name").generation
+        courses, next_cursor = await get_flight("courses", "list").do((limit, after_id, generation), lambda: find_page(db.courses, limit=limit, after_id=after_id, projection=COURSE_PROJECTION))
         logger.info("Cursos obtenidos exitosamente")
-        return {"courses": courses, "message": "Cursos obtenidos exitosamente"}
+        return BSONJSONResponse({"courses": courses, "next": next_cursor, "message": "Cursos obtenidos exitosamente"})
     except Exception as e:
-        logger.error(f"Error al obtener cursos: {e}")
+        logger.error("Error al obtener cursos: %s", e)
         raise HTTPException(status_code=500, detail="Error al obtener cursos")
 
+# Ruta para exportar todos los cursos en streaming (NDJSON, BSON o MessagePack según format o Accept)
+@app.get("/courses/export")
+async def export_courses(format: str | None = Query(None, pattern=EXPORT_FORMAT_PATTERN), accept: str | None = Header(None), db: AsyncDatabase = Depends(get_db)):
+    headers = export_headers(format)
+    format = export_format(format, accept)
+    logger.info("Exportación de cursos iniciada (formato %s)", format)
+    return StreamingResponse(export_stream(export_cursor(db.courses, COURSE_PROJECTION), format), media_type=EXPORT_FORMATS[format], headers=headers)
+
 # Ruta para obtener un curso por nombre (solo el primero que coincida)
 @app.get("/courses/{name}")
-async def get_one_course(name: str):
+async def get_one_course(name: str, db: AsyncDatabase = Depends(get_db)):
     try:
-        course = db["courses"].find_one({"name": name})
+        # Consultar primero la caché de lecturas por nombre
+        cache = get_cache("courses", "name")
+        course = cache.get(("one", name))
+        if course is MISSING:
+            generation = cache.generation
+            course = await db["courses"].find_one({"name": name}, COURSE_PROJECTION)
+            if course:
+                cache.set(("one", name), course, generation)
         if course:
-            course["_id"] = str(course["_id"])
             logger.info("Curso recuperado exitosamente")
-            return course
+            return BSONJSONResponse(course)
         logger.warning("Curso no encontrado")
         raise HTTPException(status_code=404, detail="Curso no encontrado")
     except Exception as e:
-        logger.error(f"Error al buscar curso: {e}")
+        logger.error("Error al buscar curso: %s", e)
         raise HTTPException(status_code=500, detail="Error al buscar curso")
 
 # Ruta para obtener cursos por nombre
 @app.get("/courses/name/{name}")
-async def get_courses_by_name(name: str):
+async def get_courses_by_name(name: str, db: AsyncDatabase = Depends(get_db)):
     try:
-        courses = db["courses"].find({"name": name})
-        courses_list = [{"id": str(course["_id"]), "name": course["name"], "faculty": course["faculty"], "students": course["students"]} for course in courses]
+        # Consultar primero la caché de lecturas por nombre
+        cache = get_cache("courses", "name")
+        courses_list = cache.get(("all", name))
+        if courses_list is MISSING:
+            generation = cache.generation
+            # La proyección renombra _id a id en el servidor
+            courses_list = await db["courses"].find({"name": name}, {"_id": 0, "id": "$_id", "name": 1, "faculty": 1}).to_list()
+            if courses_list:
+                cache.set(("all", name), courses_list, generation)
         if not courses_list:
-            logger.warning(f"No se encontraron cursos con el nombre '{name}'")
+            logger.warning("No se encontraron cursos con el nombre '%s'", name)
             raise HTTPException(status_code=404, detail=f"No se encontraron cursos con el nombre '{name}'")
-        logger.info(f"Cursos con el nombre '{name}' recuperados exitosamente")
-        return courses_list
+        logger.info("Cursos con el nombre '%s' recuperados exitosamente", name)
+        return BSONJSONResponse(courses_list)
     except Exception as e:
-        logger.error(f"Error al buscar cursos por nombre: {e}")
+        logger.error("Error al buscar cursos por nombre: %s", e)
         raise HTTPException(status_code=500, detail="Error al buscar cursos por nombre")
 
 # Ruta para obtener un curso por ID
 @app.get("/courses/id/{course_id}")
-async def get_course_by_id(course_id: str):
+async def get_course_by_id(course_id: str, if_none_match: str | None = Header(None), db: AsyncDatabase = Depends(get_db)):
     try:
         obj_id = ObjectId(course_id)
-        course = db["courses"].find_one({"_id": obj_id})
+        # Consultar primero la caché de lecturas por ID
+        cache = get_cache("courses", "id")
+        course = cache.get(str(obj_id))
+        # GET condicional: si el ETag coincide se responde 304 comparando solo la versión
+        if if_none_match:
+            version = document_version(course) if course is not MISSING else await fetch_version(db.courses, obj_id)
+            if version is not None and etag_matches(if_none_match, make_etag(obj_id, version)):
+                return not_modified(make_etag(obj_id, version))
+        if course is MISSING:
+            generation = cache.generation
+            # Las lecturas simultáneas del mismo documento comparten la consulta
+            course = await get_flight("courses", "id").do((str(obj_id), generation), lambda: db["courses"].find_one({"_id": obj_id}, COURSE_PROJECTION))
+            if course:
+                cache.set(str(obj_id), course, generation)
         if course:
-            course["_id"] = str(course["_id"])
-            logger.info(f"Curso con ID '{course_id}' recuperado exitosamente")
-            return course
-        logger.warning(f"Curso con ID '{course_id}' no encontrado")
+            logger.info("Curso con ID '%s' recuperado exitosamente", course_id)
+            return BSONJSONResponse(course, headers={"ETag": make_etag(obj_id, document_version(course))})
+        logger.warning("Curso con ID '%s' no encontrado", course_id)
         raise HTTPException(status_code=404, detail=f"Curso con ID '{course_id}' no encontrado")
     except Exception as e:
-        logger.error(f"Error al buscar curso por ID: {e}")
+        logger.error("Error al buscar curso por ID: %s", e)
         raise HTTPException(status_code=400, detail="Formato de ID inválido")
 
 # Ruta para actualizar un curso por ID
 @app.put("/courses/updateCourse/{id}")
-async def update_course(id: str, course: Course):
+async def update_course(id: str, course: Course, db: AsyncDatabase = Depends(get_db)):
     try:
         obj_id = ObjectId(id)
-        result = db.courses.update_one({"_id": obj_id}, {"$set": course.dict()})
+        result = await db.courses.update_one({"_id": obj_id}, {"$set": with_search_key(course.dict(exclude={"students"})), "$inc": {"version": 1}})
+        invalidate("courses", obj_id)
         if result.matched_count == 0:
             logger.warning("Curso no encontrado")
             raise HTTPException(status_code=404, detail="Curso no encontrado")
+        # La lista de estudiantes solo se reemplaza si viene en la petición
+        if "students" in course.model_fields_set:
+            await fold_legacy_rosters(db, {"_id": obj_id})
+            await db[ENROLLMENTS].bulk_write(replace_roster_operations(obj_id, course.students))
         logger.info("Curso actualizado exitosamente")
         return {"message": "Curso actualizado exitosamente"}
     except Exception as e:
-        logger.error(f"Error al actualizar curso: {e}")
+        logger.error("Error al actualizar curso: %s", e)
+        raise HTTPException(status_code=400, detail="Formato de ID inválido")
+
+# Definición del modelo de datos para actualizar solo algunos campos de un curso
+class CoursePatch(BaseModel):
+    name: str | None = None  # Nombre del curso
+    faculty: str | None = None  # Facultad del curso
+    students: list[ObjectIdRef] | None = None  # Si se envía, reemplaza la lista de estudiantes
+    version: int | None = None  # Versión leída (si no se envía If-Match)
+
+# Ruta para actualizar parcialmente un curso: solo se escriben ($set) los campos
+# enviados. Con If-Match o version, la escritura falla si otra petición lo modificó antes
+@app.patch("/courses/updateCourse/{id}")
+async def patch_course(id: str, course: CoursePatch, if_match: str | None = Header(None), db: AsyncDatabase = Depends(get_db)):
+    try:
+        obj_id = ObjectId(id)
+    except InvalidId:
         raise HTTPException(status_code=400, detail="Formato de ID inválido")
+    try:
+        version = expected_version(if_match, obj_id, course.version)
+    except ValueError:
+        raise HTTPException(status_code=412, detail="If-Match no corresponde a este curso")
+    # null no borra campos obligatorios: se ignora igual que un campo no enviado
+    fields = course.dict(exclude_unset=True, exclude_none=True, exclude={"version", "students"})
+    replace_roster = course.students is not None
+    if not fields and not replace_roster:
+        raise HTTPException(status_code=400, detail="No hay campos que actualizar")
+    try:
+        new_version = await patch_document(db.courses, obj_id, with_search_key(fields), version)
+        if new_version is None:
+            current = await fetch_version(db.courses, obj_id)
+            if current is None:
+                logger.warning("Curso con ID '%s' no encontrado", id)
+                raise HTTPException(status_code=404, detail="Curso no encontrado")
+            logger.warning("Conflicto al actualizar el curso '%s': versión %s, actual %s", id, version, current)
+            raise HTTPException(status_code=412 if if_match else 409, detail=f"El curso ha sido modificado por otra petición (versión actual {current})")
+        # La lista de estudiantes (colección enrollments) solo se toca si viene en la petición
+        if replace_roster:
+            await fold_legacy_rosters(db, {"_id": obj_id})
+            await db[ENROLLMENTS].bulk_write(replace_roster_operations(obj_id, course.students))
+        invalidate("courses", obj_id)
+        logger.info("Curso con ID '%s' actualizado parcialmente (versión %s)", id, new_version)
+        return BSONJSONResponse({"version": new_version, "message": "Curso actualizado exitosamente"}, headers={"ETag": make_etag(obj_id, new_version)})
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error("Error al actualizar parcialmente el curso: %s", e)
+        raise HTTPException(status_code=500, detail="Error al actualizar curso")
 
 # Ruta para eliminar un curso por ID
 @app.delete("/courses/deleteById/{id}")
-async def delete_course_by_id(id: str):
+async def delete_course_by_id(id: str, db: AsyncDatabase = Depends(get_db)):
     try:
         # Intenta eliminar un curso de la base de datos usando el ID proporcionado
-        result = db.courses.delete_one({"_id": ObjectId(id)})
+        result = await db.courses.delete_one({"_id": ObjectId(id)})
+        invalidate("courses", ObjectId(id))
+        await db[ENROLLMENTS].delete_many({"course_id": ObjectId(id)})
         # Verifica si no se eliminó ningún curso
         if result.deleted_count == 0:
             # Registra una advertencia si no se encontró el curso
-            logger.warning(f"No se encontró curso con ID '{id}' para eliminar")
+            logger.warning("No se encontró curso con ID '%s' para eliminar", id)
             # Lanza una excepción HTTP 404 si no se encontró el curso
             raise HTTPException(status_code=404, detail=f"No se encontró curso con ID '{id}' para eliminar")
         # Registra un mensaje de éxito si el curso fue eliminado
-        logger.info(f"Curso con ID '{id}' eliminado exitosamente")
+        logger.info("Curso con ID '%s' eliminado exitosamente", id)
         # Devuelve un mensaje de éxito
         return {"message": f"Curso con ID '{id}' eliminado exitosamente"}
     except Exception as e:
         # Registra un error si ocurre una excepción
-        logger.error(f"Error al eliminar curso con ID '{id}': {e}")
+        logger.error("Error al eliminar curso con ID '%s': %s", id, e)
         # Lanza una excepción HTTP 400 si el formato del ID es inválido
         raise HTTPException(status_code=400, detail="Formato de ID inválido")
 
 
 # ------------------------------ AÑADIR O ELIMINAR ESTUDIANTE A CURSO ------------------------------
-# Ruta para añadir el ID de un estudiante al array de estudiantes de un curso
+# Ruta para matricular a un estudiante en un curso
 @app.post("/courses/addstudent/{course_id}/{student_id}")
-async def add_student_to_course(course_id: str, student_id: str):
+async def add_student_to_course(course_id: str, student_id: str, db: AsyncDatabase = Depends(get_db)):
     try:
         # Validar y convertir course_id y student_id a ObjectId si es necesario
         try:
@@ -256,26 +531,22 @@ async def add_student_to_course(course_id: str, student_id: str):
         except Exception:
             raise HTTPException(status_code=400, detail="Formato de ID inválido")
 
-        # Actualizar el curso agregando el student_id al array de estudiantes
-        result = db.courses.update_one(
-            {"_id": obj_course_id},
-            {"$push": {"students": str(obj_student_id)}}  # Se almacena como string en el array
-        )
-
-        # Verificar si el curso fue encontrado y actualizado
-        if result.matched_count == 0:
+        # Crear la matrícula (no se duplica si ya existe); falla si el curso no existe
+        if not await write_enrollment(db, obj_course_id, enroll_operation(obj_course_id, obj_student_id)):
             raise HTTPException(status_code=404, detail="Curso no encontrado")
 
-        logger.info(f"ID del estudiante {student_id} añadido al curso con ID {course_id} exitosamente")
+        logger.info("ID del estudiante %s añadido al curso con ID %s exitosamente", student_id, course_id)
         return {"message": f"ID del estudiante {student_id} añadido al curso con ID {course_id} exitosamente"}
 
+    except HTTPException:
+        raise
     except Exception as e:
-        logger.error(f"Error al añadir ID del estudiante al curso: {e}")
+        logger.error("Error al añadir ID del estudiante al curso: %s", e)
         raise HTTPException(status_code=500, detail="Error interno del servidor")
 
-# Ruta para eliminar el ID de un estudiante del array de estudiantes de un curso
+# Ruta para desmatricular a un estudiante de un curso
 @app.delete("/courses/removestudent/{course_id}/{student_id}")
-async def remove_student_from_course(course_id: str, student_id: str):
+async def remove_student_from_course(course_id: str, student_id: str, db: AsyncDatabase = Depends(get_db)):
     try:
         # Validar y convertir course_id y student_id a ObjectId si es necesario
         try:
@@ -284,23 +555,174 @@ async def remove_student_from_course(course_id: str, student_id: str):
         except Exception:
             raise HTTPException(status_code=400, detail="Formato de ID inválido")
 
-        # Actualizar el curso eliminando el student_id del array de estudiantes
-        result = db.courses.update_one(
-            {"_id": obj_course_id},
-            {"$pull": {"students": str(obj_student_id)}}  # Se elimina el ID del array
-        )
-
-        # Verificar si el curso fue encontrado y actualizado
-        if result.matched_count == 0:
+        # Eliminar la matrícula; falla si el curso no existe
+        if not await write_enrollment(db, obj_course_id, unenroll_one_operation(obj_course_id, obj_student_id)):
             raise HTTPException(status_code=404, detail="Curso no encontrado")
 
-        logger.info(f"ID del estudiante {student_id} eliminado del curso con ID {course_id} exitosamente")
+        logger.info("ID del estudiante %s eliminado del curso con ID %s exitosamente", student_id, course_id)
         return {"message": f"ID del estudiante {student_id} eliminado del curso con ID {course_id} exitosamente"}
 
+    except HTTPException:
+        raise
     except Exception as e:
-        logger.error(f"Error al eliminar ID del estudiante del curso: {e}")
+        logger.error("Error al eliminar ID del estudiante del curso: %s", e)
         raise HTTPException(status_code=500, detail="Error interno del servidor")
 
+# Ruta para obtener la lista de estudiantes de un curso paginada por student_id
+@app.get("/courses/{course_id}/students")
+async def get_course_students(course_id: str, limit: int = Query(DEFAULT_LIMIT, ge=1, le=MAX_LIMIT), after: str | None = None, db: AsyncDatabase = Depends(get_db)):
+    try:
+        obj_course_id = ObjectId(course_id)
+        after_id = decode_cursor(after) if after else None
+    except Exception:
+        raise HTTPException(status_code=400, detail="Formato de ID o cursor inválido")
+    try:
+        if not await existing_course_ids(db, [obj_course_id]):
+            raise HTTPException(status_code=404, detail="Curso no encontrado")
+        await fold_legacy_rosters(db, {"_id": obj_course_id})
+        students, next_after = await find_roster_page(db, obj_course_id, limit, after_id)
+        logger.info("Estudiantes del curso con ID '%s' obtenidos exitosamente", course_id)
+        return BSONJSONResponse({
+            "students": students,
+            "next": encode_cursor(next_after) if next_after else None,
+            "message": f"Estudiantes del curso con ID '{course_id}' obtenidos exitosamente"
+        })
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error("Error al obtener los estudiantes del curso: %s", e)
+        raise HTTPException(status_code=500, detail="Error al obtener los estudiantes del curso")
+
+
+# ------------------------------ MATRÍCULAS EN BLOQUE ------------------------------
+# Definición del modelo de datos para una lista de IDs de estudiantes
+class StudentIds(BaseModel):
+    students: list[str]  # IDs de los estudiantes
+
+# Definición del modelo de datos para los cambios de matrícula de un curso
+class CourseEnrollment(BaseModel):
+    course_id: str  # ID del curso
+    add: list[str] = []  # IDs de estudiantes a añadir
+    remove: list[str] = []  # IDs de estudiantes a eliminar
+
+# Validar una lista de IDs de estudiantes
+def parse_student_ids(student_ids):
+    return [to_object_id(student_id) for student_id in student_ids]
+
+# Ruta para añadir varios estudiantes a un curso en una sola operación
+@app.post("/courses/addstudents/{course_id}")
+async def add_students_to_course(course_id: str, body: StudentIds, db: AsyncDatabase = Depends(get_db)):
+    try:
+        obj_course_id = ObjectId(course_id)
+        student_ids = parse_student_ids(body.students)
+    except Exception:
+        raise HTTPException(status_code=400, detail="Formato de ID inválido")
+    try:
+        if not await existing_course_ids(db, [obj_course_id]):
+            raise HTTPException(status_code=404, detail="Curso no encontrado")
+        await fold_legacy_rosters(db, {"_id": obj_course_id})
+        # Un upsert por estudiante en un único bulk_write: los ya matriculados no se duplican
+        result = await db[ENROLLMENTS].bulk_write([enroll_operation(obj_course_id, student_id) for student_id in student_ids], ordered=False) if student_ids else None
+        enrolled = result.upserted_count if result else 0
+        logger.info("%s estudiantes añadidos al curso con ID %s exitosamente", enrolled, course_id)
+        return {"enrolled": enrolled, "message": f"{enrolled} estudiantes añadidos al curso con ID {course_id} exitosamente"}
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error("Error al añadir estudiantes al curso: %s", e)
+        raise HTTPException(status_code=500, detail="Error interno del servidor")
+
+# Ruta para eliminar varios estudiantes de un curso en una sola operación
+@app.post("/courses/removestudents/{course_id}")
+async def remove_students_from_course(course_id: str, body: StudentIds, db: AsyncDatabase = Depends(get_db)):
+    try:
+        obj_course_id = ObjectId(course_id)
+        student_ids = parse_student_ids(body.students)
+    except Exception:
+        raise HTTPException(status_code=400, detail="Formato de ID inválido")
+    try:
+        if not await existing_course_ids(db, [obj_course_id]):
+            raise HTTPException(status_code=404, detail="Curso no encontrado")
+        await fold_legacy_rosters(db, {"_id": obj_course_id})
+        result = await db[ENROLLMENTS].delete_many({"course_id": obj_course_id, "student_id": {"$in": student_ids}})
+        logger.info("%s estudiantes eliminados del curso con ID %s exitosamente", result.deleted_count, course_id)
+        return {"removed": result.deleted_count, "message": f"{result.deleted_count} estudiantes eliminados del curso con ID {course_id} exitosamente"}
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error("Error al eliminar estudiantes del curso: %s", e)
+        raise HTTPException(status_code=500, detail="Error interno del servidor")
+
+# Ruta para aplicar cambios de matrícula sobre varios cursos con un único bulk_write
+@app.post("/courses/enrollments")
+async def update_enrollments(enrollments: list[CourseEnrollment], db: AsyncDatabase = Depends(get_db)):
+    try:
+        changes = [
+            (ObjectId(enrollment.course_id), parse_student_ids(enrollment.add), parse_student_ids(enrollment.remove))
+            for enrollment in enrollments
+        ]
+    except Exception:
+        raise HTTPException(status_code=400, detail="Formato de ID inválido")
+    try:
+        # Los cambios sobre cursos que no existen no se aplican y se informan
+        found = await existing_course_ids(db, [course_id for course_id, _, _ in changes])
+        missing = [str(course_id) for course_id, _, _ in changes if course_id not in found]
+        await fold_legacy_rosters(db, {"_id": {"$in": list(found)}})
+        operations = []
+        for course_id, add, remove in changes:
+            if course_id not in found:
+                continue
+            operations.extend(enroll_operation(course_id, student_id) for student_id in add)
+            if remove:
+                operations.append(unenroll_operation(course_id, remove))
+        if not operations:
+            return {"enrolled": 0, "removed": 0, "missing": missing, "message": "No hay cambios de matrícula que aplicar"}
+        result = await db[ENROLLMENTS].bulk_write(operations, ordered=False)
+        logger.info("Matrículas actualizadas en %s cursos exitosamente", len(found))
+        return {
+            "enrolled": result.upserted_count,
+            "removed": result.deleted_count,
+            "missing": missing,
+            "message": f"Matrículas actualizadas en {len(found)} cursos exitosamente"
+        }
+    except Exception as e:
+        logger.error("Error al actualizar matrículas en bloque: %s", e)
+        raise HTTPException(status_code=500, detail="Error interno del servidor")
+
+
+# ------------------------------ UNIVERSIDADES DE UN CURSO ------------------------------
+# Definición del modelo de datos para una búsqueda de universidades de varios cursos
+class CourseLookup(BaseModel):
+    courses: list[str]  # IDs de los cursos
+
+# Ruta para obtener las universidades que ofrecen un curso (índice multikey universities.courses)
+@app.get("/courses/{course_id}/universities")
+async def get_course_universities(course_id: str, db: AsyncDatabase = Depends(get_db)):
+    try:
+        refs = ref_variants(course_id)
+    except Exception:
+        raise HTTPException(status_code=400, detail="Formato de ID inválido")
+    try:
+        universities = await db.universities.find({"courses": {"$in": refs}}, {"name": 1, "city": 1, "country": 1}).to_list()
+        logger.info("Universidades del curso con ID '%s' obtenidas exitosamente", course_id)
+        return BSONJSONResponse({"universities": universities, "message": f"Universidades del curso con ID '{course_id}' obtenidas exitosamente"})
+    except Exception as e:
+        logger.error("Error al obtener las universidades del curso: %s", e)
+        raise HTTPException(status_code=500, detail="Error al obtener las universidades del curso")
+
+# Ruta para obtener las universidades de varios cursos en una sola consulta
+@app.post("/courses/universities")
+async def get_courses_universities(body: CourseLookup, db: AsyncDatabase = Depends(get_db)):
+    try:
+        universities = await reverse_lookup(db.universities, "courses", body.courses, {"name": 1, "city": 1, "country": 1})
+        logger.info("Universidades de %s cursos obtenidas exitosamente", len(body.courses))
+        return BSONJSONResponse({"universities": universities, "message": f"Universidades de {len(body.courses)} cursos obtenidas exitosamente"})
+    except InvalidId:
+        raise HTTPException(status_code=400, detail="Formato de ID inválido")
+    except Exception as e:
+        logger.error("Error al obtener las universidades de los cursos: %s", e)
+        raise HTTPException(status_code=500, detail="Error al obtener las universidades de los cursos")
+
 
 
 # ------------------------------ UNIVERSIDADES ------------------------------
@@ -309,135 +731,273 @@ class University(BaseModel):
     name: str  # Nombre de la universidad
     city: str  # Ciudad de la universidad
     country: str  # País de la universidad
-    courses: list[str]  # Lista de IDs de cursos
+    courses: list[ObjectIdRef]  # Lista de IDs de cursos
+
+# Proyección de los listados: renombra _id a id en el servidor
+UNIVERSITY_SUMMARY = {"_id": 0, "id": "$_id", "name": 1, "city": 1, "country": 1, "courses": {"$ifNull": ["$courses", []]}}
 
 # Ruta para crear una nueva universidad
 @app.post("/universities")
-async def create_university(university: University):
+async def create_university(university: University, db: AsyncDatabase = Depends(get_db)):
     try:
-        result = db["universities"].insert_one(university.dict())
+        result = await db["universities"].insert_one(with_initial_version(with_search_key(university.dict())))
+        invalidate("universities")
         logger.info("Universidad añadida exitosamente")
         return {
             "id": str(result.inserted_id),
             "message": "Universidad añadida exitosamente"
         }
     except Exception as e:
-        logger.error(f"Error al añadir universidad: {e}")
+        logger.error("Error al añadir universidad: %s", e)
         raise HTTPException(status_code=500, detail="Error al añadir universidad")
     
-# Ruta para obtener todas las universidades
-@app.get("/universities")
-async def get_universities():
+# Ruta para crear universidades en bloque (array JSON o NDJSON) con insert_many no ordenado
+@app.post("/universities/bulk")
+async def create_universities_bulk(request: Request, chunk_size: int = Query(BULK_CHUNK_SIZE, ge=1, le=MAX_BULK_CHUNK_SIZE), db: AsyncDatabase = Depends(get_db)):
     try:
-        universities = db.universities.find()
-        universities_list = []
-
-        for university in universities:
-            universities_list.append({
-                "id": str(university["_id"]),  # Convertimos ObjectId a str
-                "name": university["name"],
-                "city": university["city"],
-                "country": university["country"],
-                "courses": [str(course) for course in university.get("courses", [])]  # Convertimos ObjectId en courses
-            })
+        result = await bulk_insert(request, db.universities, University, chunk_size)
+        invalidate("universities")
+        result["message"] = f"Universidades añadidas en bloque: {result['inserted']} insertados, {result['failed']} con error"
+        return result
+    except BulkBodyError as e:
+        logger.warning("Cuerpo inválido en la inserción en bloque de universidades: %s", e)
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        logger.error("Error al añadir universidades en bloque: %s", e)
+        raise HTTPException(status_code=500, detail="Error al añadir universidades en bloque")
 
+# Ruta para obtener las universidades paginadas por _id (parámetros limit y after)
+@app.get("/universities")
+async def get_universities(limit: int = Query(DEFAULT_LIMIT, ge=1, le=MAX_LIMIT), after: str | None = None, db: AsyncDatabase = Depends(get_db)):
+    # Validar el cursor de paginación
+    try:
+        after_id = decode_cursor(after) if after else None
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Cursor de paginación inválido")
+    try:
+        # Los listados idénticos simultáneos comparten la consulta. La generación de la
+        # caché cambia con cada escritura: una lectura posterior no se une a una anterior
+        generation = get_cache("universities", "name").generation
+        universities_list, next_cursor = await get_flight("universities", "list").do((limit, after_id, generation), lambda: find_page(db.universities, limit=limit, after_id=after_id, projection=UNIVERSITY_SUMMARY, cursor_key="id"))
         logger.info("Universidades obtenidas exitosamente")
-        return {"universities": universities_list, "message": "Universidades obtenidas exitosamente"}
+        return BSONJSONResponse({"universities": universities_list, "next": next_cursor, "message": "Universidades obtenidas exitosamente"})
 
     except Exception as e:
-        logger.error(f"Error al obtener universidades: {e}")
+        logger.error("Error al obtener universidades: %s", e)
         raise HTTPException(status_code=500, detail="Error al obtener universidades")
 
+# Ruta para exportar todas las universidades en streaming (NDJSON, BSON o MessagePack según format o Accept)
+@app.get("/universities/export")
+async def export_universities(format: str | None = Query(None, pattern=EXPORT_FORMAT_PATTERN), accept: str | None = Header(None), db: AsyncDatabase = Depends(get_db)):
+    headers = export_headers(format)
+    format = export_format(format, accept)
+    logger.info("Exportación de universidades iniciada (formato %s)", format)
+    return StreamingResponse(export_stream(export_cursor(db.universities, WITHOUT_SEARCH_KEY), format), media_type=EXPORT_FORMATS[format], headers=headers)
+
 # Ruta para obtener universidades por nombre
 @app.get("/universities/name/{name}")
-async def get_universities_by_name(name: str):
-    try:
-        universities = db["universities"].find({"name": name})
-        universities_list = []
-        
-        for university in universities:
-            universities_list.append({
-                "id": str(university["_id"]),  # Convertimos ObjectId a str
-                "name": university["name"],
-                "city": university["city"],
-                "country": university["country"],
-                "courses": [str(course) for course in university.get("courses", [])]  # Convertimos ObjectId en courses
-            })
+async def get_universities_by_name(name: str, db: AsyncDatabase = Depends(get_db)):
+    try:
+        # Consultar primero la caché de lecturas por nombre
+        cache = get_cache("universities", "name")
+        universities_list = cache.get(("all", name))
+        if universities_list is MISSING:
+            generation = cache.generation
+            universities_list = await db["universities"].find({"name": name}, UNIVERSITY_SUMMARY).to_list()
+            if universities_list:
+                cache.set(("all", name), universities_list, generation)
 
         if not universities_list:
-            logger.warning(f"No se encontraron universidades con el nombre '{name}'")
+            logger.warning("No se encontraron universidades con el nombre '%s'", name)
             raise HTTPException(status_code=404, detail=f"No se encontraron universidades con el nombre '{name}'")
 
-        logger.info(f"Universidades con el nombre '{name}' recuperadas exitosamente")
-        return universities_list
+        logger.info("Universidades con el nombre '%s' recuperadas exitosamente", name)
+        return BSONJSONResponse(universities_list)
 
     except Exception as e:
-        logger.error(f"Error al buscar universidades por nombre: {e}")
+        logger.error("Error al buscar universidades por nombre: %s", e)
         raise HTTPException(status_code=500, detail="Error al buscar universidades por nombre")
 
 # Ruta para obtener una universidad por ID
 @app.get("/universities/id/{university_id}")
-async def get_university_by_id(university_id: str):
+async def get_university_by_id(university_id: str, if_none_match: str | None = Header(None), db: AsyncDatabase = Depends(get_db)):
     try:
         obj_id = ObjectId(university_id)
-        university = db["universities"].find_one({"_id": obj_id})
+        # Consultar primero la caché de lecturas por ID
+        cache = get_cache("universities", "id")
+        university = cache.get(str(obj_id))
+        # GET condicional: si el ETag coincide se responde 304 comparando solo la versión
+        if if_none_match:
+            version = document_version(university) if university is not MISSING else await fetch_version(db.universities, obj_id)
+            if version is not None and etag_matches(if_none_match, make_etag(obj_id, version)):
+                return not_modified(make_etag(obj_id, version))
+        if university is MISSING:
+            generation = cache.generation
+            # Las lecturas simultáneas del mismo documento comparten la consulta
+            university = await get_flight("universities", "id").do((str(obj_id), generation), lambda: db["universities"].find_one({"_id": obj_id}, WITHOUT_SEARCH_KEY))
+            if university:
+                cache.set(str(obj_id), university, generation)
         if university:
-            university["_id"] = str(university["_id"])  # Convertimos ObjectId a str
-            university["courses"] = [str(course) for course in university.get("courses", [])]  # Convertimos los IDs de los cursos
-            logger.info(f"Universidad con ID '{university_id}' recuperada exitosamente")
-            return university
-        logger.warning(f"Universidad con ID '{university_id}' no encontrada")
+            logger.info("Universidad con ID '%s' recuperada exitosamente", university_id)
+            return BSONJSONResponse(university, headers={"ETag": make_etag(obj_id, document_version(university))})
+        logger.warning("Universidad con ID '%s' no encontrada", university_id)
         raise HTTPException(status_code=404, detail=f"Universidad con ID '{university_id}' no encontrada")
     except Exception as e:
-        logger.error(f"Error al buscar universidad por ID: {e}")
+        logger.error("Error al buscar universidad por ID: %s", e)
         raise HTTPException(status_code=400, detail="Formato de ID inválido")
 
 # Ruta para actualizar una universidad por ID
 @app.put("/universities/updateUniversity/{id}")
-async def update_university(id: str, university: University):
+async def update_university(id: str, university: University, db: AsyncDatabase = Depends(get_db)):
     try:
         obj_id = ObjectId(id)
-        update_data = university.dict()
-        update_data["courses"] = [ObjectId(course) for course in update_data.get("courses", [])]  # Convertimos a ObjectId
-        
-        result = db["universities"].update_one({"_id": obj_id}, {"$set": update_data})
+        update_data = with_search_key(university.dict())  # El modelo ya convierte los cursos a ObjectId
+        result = await db["universities"].update_one({"_id": obj_id}, {"$set": update_data, "$inc": {"version": 1}})
+        invalidate("universities", obj_id)
         if result.matched_count == 0:
             logger.warning("Universidad no encontrada")
             raise HTTPException(status_code=404, detail="Universidad no encontrada")
         logger.info("Universidad actualizada exitosamente")
         return {"message": "Universidad actualizada exitosamente"}
     except Exception as e:
-        logger.error(f"Error al actualizar universidad: {e}")
+        logger.error("Error al actualizar universidad: %s", e)
         raise HTTPException(status_code=400, detail="Formato de ID inválido")
 
+# Definición del modelo de datos para actualizar solo algunos campos de una universidad
+class UniversityPatch(BaseModel):
+    name: str | None = None  # Nombre de la universidad
+    city: str | None = None  # Ciudad de la universidad
+    country: str | None = None  # País de la universidad
+    courses: list[ObjectIdRef] | None = None  # Lista de IDs de cursos (se reemplaza entera)
+    version: int | None = None  # Versión leída (si no se envía If-Match)
+
+# Ruta para actualizar parcialmente una universidad: solo se escriben ($set) los campos
+# enviados. Con If-Match o version, la escritura falla si otra petición la modificó antes
+@app.patch("/universities/updateUniversity/{id}")
+async def patch_university(id: str, university: UniversityPatch, if_match: str | None = Header(None), db: AsyncDatabase = Depends(get_db)):
+    try:
+        obj_id = ObjectId(id)
+    except InvalidId:
+        raise HTTPException(status_code=400, detail="Formato de ID inválido")
+    try:
+        version = expected_version(if_match, obj_id, university.version)
+    except ValueError:
+        raise HTTPException(status_code=412, detail="If-Match no corresponde a esta universidad")
+    # null no borra campos obligatorios: se ignora igual que un campo no enviado
+    fields = university.dict(exclude_unset=True, exclude_none=True, exclude={"version"})
+    if not fields:
+        raise HTTPException(status_code=400, detail="No hay campos que actualizar")
+    try:
+        new_version = await patch_document(db.universities, obj_id, with_search_key(fields), version)
+        if new_version is None:
+            current = await fetch_version(db.universities, obj_id)
+            if current is None:
+                logger.warning("Universidad con ID '%s' no encontrada", id)
+                raise HTTPException(status_code=404, detail="Universidad no encontrada")
+            logger.warning("Conflicto al actualizar la universidad '%s': versión %s, actual %s", id, version, current)
+            raise HTTPException(status_code=412 if if_match else 409, detail=f"La universidad ha sido modificada por otra petición (versión actual {current})")
+        invalidate("universities", obj_id)
+        logger.info("Universidad con ID '%s' actualizada parcialmente (versión %s)", id, new_version)
+        return BSONJSONResponse({"version": new_version, "message": "Universidad actualizada exitosamente"}, headers={"ETag": make_etag(obj_id, new_version)})
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error("Error al actualizar parcialmente la universidad: %s", e)
+        raise HTTPException(status_code=500, detail="Error al actualizar universidad")
+
 # Ruta para eliminar una universidad por ID
 @app.delete("/universities/{university_id}")
-async def delete_university(university_id: str):
+async def delete_university(university_id: str, db: AsyncDatabase = Depends(get_db)):
     try:
         obj_university_id = ObjectId(university_id)
-        result = db["universities"].delete_one({"_id": obj_university_id})
+        result = await db["universities"].delete_one({"_id": obj_university_id})
+        invalidate("universities", obj_university_id)
         if result.deleted_count == 0:
             raise HTTPException(status_code=404, detail="Universidad no encontrada")
-        logger.info(f"Universidad con ID {university_id} eliminada exitosamente")
+        logger.info("Universidad con ID %s eliminada exitosamente", university_id)
         return {"message": f"Universidad con ID {university_id} eliminada exitosamente"}
     except Exception as e:
-        logger.error(f"Error al eliminar universidad: {e}")
+        logger.error("Error al eliminar universidad: %s", e)
         raise HTTPException(status_code=500, detail="Error al eliminar universidad")
 
 # Ruta para añadir un curso a una universidad por ID
 @app.post("/universities/{university_id}/courses/{course_id}")
-async def add_course_to_university(university_id: str, course_id: str):
+async def add_course_to_university(university_id: str, course_id: str, db: AsyncDatabase = Depends(get_db)):
     try:
         obj_university_id = ObjectId(university_id)
         obj_course_id = ObjectId(course_id)
-        result = db["universities"].update_one(
+        result = await db["universities"].update_one(
             {"_id": obj_university_id},
-            {"$addToSet": {"courses": str(obj_course_id)}}  # Convertimos el ObjectId en string antes de insertar
+            {"$addToSet": {"courses": obj_course_id}, "$inc": {"version": 1}}  # Se almacena como ObjectId
         )
+        invalidate("universities", obj_university_id)
         if result.matched_count == 0:
             raise HTTPException(status_code=404, detail="Universidad no encontrada")
-        logger.info(f"Curso con ID {course_id} añadido a la universidad con ID {university_id} exitosamente")
+        logger.info("Curso con ID %s añadido a la universidad con ID %s exitosamente", course_id, university_id)
         return {"message": f"Curso con ID {course_id} añadido a la universidad con ID {university_id} exitosamente"}
     except Exception as e:
-        logger.error(f"Error al añadir curso a la universidad: {e}")
+        logger.error("Error al añadir curso a la universidad: %s", e)
         raise HTTPException(status_code=500, detail="Error al añadir curso a la universidad")
+
+# ------------------------------ VISTA COMPLETA DE UNA UNIVERSIDAD ------------------------------
+# Convertir un array de referencias (string u ObjectId) a ObjectId para poder hacer $lookup por _id
+def refs_to_object_ids(field):
+    return {"$map": {
+        "input": {"$ifNull": [field, []]},
+        "in": {"$convert": {"input": "$$this", "to": "objectId", "onError": None, "onNull": None}}
+    }}
+
+# Pipeline de agregación que resuelve los cursos (depth=1) y sus estudiantes (depth=2)
+def university_view_pipeline(obj_id, depth):
+    course_pipeline = [{"$project": {"name": 1, "faculty": 1}}]
+    if depth >= 2:
+        course_pipeline.append({"$lookup": {
+            "from": ENROLLMENTS,
+            "localField": "_id",
+            "foreignField": "course_id",
+            "pipeline": [
+                {"$lookup": {
+                    "from": "students",
+                    "localField": "student_id",
+                    "foreignField": "_id",
+                    "pipeline": [{"$project": {"name": 1, "age": 1}}],
+                    "as": "student"
+                }},
+                {"$unwind": "$student"},
+                {"$replaceRoot": {"newRoot": "$student"}},
+            ],
+            "as": "students"
+        }})
+    return [
+        {"$match": {"_id": obj_id}},
+        {"$addFields": {"course_refs": refs_to_object_ids("$courses")}},
+        {"$lookup": {
+            "from": "courses",
+            "localField": "course_refs",
+            "foreignField": "_id",
+            "pipeline": course_pipeline,
+            "as": "courses"
+        }},
+        {"$project": {"course_refs": 0, SEARCH_FIELD: 0}},
+    ]
+
+# Ruta para obtener una universidad con sus cursos y estudiantes en un único documento
+@app.get("/universities/{university_id}/full")
+async def get_university_full(university_id: str, depth: int = Query(2, ge=1, le=2), db: AsyncDatabase = Depends(get_db)):
+    try:
+        obj_id = ObjectId(university_id)
+    except Exception:
+        raise HTTPException(status_code=400, detail="Formato de ID inválido")
+    try:
+        if depth >= 2:
+            await fold_university_rosters(db, obj_id)
+        cursor = await db.universities.aggregate(university_view_pipeline(obj_id, depth))
+        universities = await cursor.to_list(1)
+    except Exception as e:
+        logger.error("Error al obtener la vista completa de la universidad: %s", e)
+        raise HTTPException(status_code=500, detail="Error al obtener la vista completa de la universidad")
+    if not universities:
+        logger.warning("Universidad con ID '%s' no encontrada", university_id)
+        raise HTTPException(status_code=404, detail=f"Universidad con ID '{university_id}' no encontrada")
+    logger.info("Vista completa de la universidad con ID '%s' recuperada exitosamente", university_id)
+    return BSONJSONResponse(universities[0])
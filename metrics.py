@@ -0,0 +1,175 @@
+import os
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+
+# Límites (segundos) de los histogramas de latencia y (bytes) de tamaño de respuesta
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (100, 1_000, 10_000, 100_000, 1_000_000, 10_000_000)
+
+# METRICS_ENABLED=0 desactiva el middleware (las rutas siguen funcionando igual)
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "1") != "0"
+
+# Rutas que no se miden: el propio scrape no debe aparecer en sus métricas
+METRICS_EXCLUDED = {"/metrics"}
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _labels(names, values, extra=""):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+# Métricas en memoria del proceso. Las series se guardan en un dict por tupla de
+# etiquetas; el event loop es de un solo hilo, así que no hace falta bloqueo
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.values = {}
+
+    def inc(self, *labels, amount=1):
+        self.values[labels] = self.values.get(labels, 0) + amount
+
+    def samples(self):
+        for labels, value in sorted(self.values.items()):
+            yield f"{self.name}{_labels(self.labels, labels)} {value}"
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def dec(self, *labels, amount=1):
+        self.values[labels] = self.values.get(labels, 0) - amount
+
+    def set(self, *labels, value):
+        self.values[labels] = value
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        self.values = {}  # etiquetas -> [cuentas por cubo (+Inf al final), suma]
+
+    def observe(self, *labels, value):
+        series = self.values.get(labels)
+        if series is None:
+            series = self.values[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+        # Se guarda la cuenta de cada cubo; los acumulados se calculan al exportar
+        series[0][bisect_left(self.buckets, value)] += 1
+        series[1] += value
+
+    def samples(self):
+        for labels, (counts, total) in sorted(self.values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), counts):
+                cumulative += count
+                le = f'le="{bound}"'
+                yield f"{self.name}_bucket{_labels(self.labels, labels, le)} {cumulative}"
+            yield f"{self.name}_sum{_labels(self.labels, labels)} {round(total, 6)}"
+            yield f"{self.name}_count{_labels(self.labels, labels)} {cumulative}"
+
+# Registro de todas las métricas del proceso (otros módulos añaden las suyas)
+REGISTRY = {}
+
+def register(metric):
+    return REGISTRY.setdefault(metric.name, metric)
+
+def counter(name, help, labels=()):
+    return register(Counter(name, help, labels))
+
+def gauge(name, help, labels=()):
+    return register(Gauge(name, help, labels))
+
+def histogram(name, help, labels=(), buckets=LATENCY_BUCKETS):
+    return register(Histogram(name, help, labels, buckets))
+
+# Exportar el registro en el formato de texto de Prometheus
+def render():
+    lines = []
+    for metric in REGISTRY.values():
+        lines.append(f"# HELP {metric.name} {metric.help}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        lines.extend(metric.samples())
+    return "\n".join(lines) + "\n"
+
+# Scope ASGI de la petición en curso, para que el código que no recibe la
+# petición (p. ej. los listeners de pymongo) sepa desde qué ruta se le llama
+CURRENT_SCOPE = ContextVar("current_scope", default=None)
+
+# Clave del scope con la que un middleware etiqueta una petición que responde
+# sin llegar a resolver la ruta (los 503 del control de admisión: "admission:read")
+ROUTE_LABEL_KEY = "metrics.route"
+
+# Etiqueta de ruta de una petición: la plantilla ("/students/{student_id}"), la
+# que haya puesto un middleware o "unmatched" (404)
+def route_label(scope):
+    return getattr(scope.get("route"), "path", None) or scope.get(ROUTE_LABEL_KEY) or "unmatched"
+
+# Plantilla de la ruta en curso, o "-" fuera de una petición
+def current_route():
+    scope = CURRENT_SCOPE.get()
+    if scope is None:
+        return "-"
+    return route_label(scope)
+
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+REQUEST_DURATION = histogram("http_request_duration_seconds", "Latencia de las peticiones HTTP", ("method", "route"))
+REQUESTS = counter("http_requests_total", "Peticiones HTTP atendidas", ("method", "route", "status"))
+RESPONSE_SIZE = histogram("http_response_size_bytes", "Tamaño del cuerpo de las respuestas HTTP", ("method", "route"), SIZE_BUCKETS)
+IN_FLIGHT = gauge("http_requests_in_flight", "Peticiones HTTP en curso", ("method",))
+
+# Middleware ASGI puro (sin BaseHTTPMiddleware, que copia la respuesta en un
+# stream intermedio). Las series se etiquetan con la plantilla de la ruta
+# ("/students/{student_id}") y no con la URL, para que su número no crezca con
+# cada ID distinto
+class MetricsMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        if not METRICS_ENABLED or scope["path"] in METRICS_EXCLUDED:
+            token = CURRENT_SCOPE.set(scope)
+            try:
+                await self.app(scope, receive, send)
+            finally:
+                CURRENT_SCOPE.reset(token)
+            return
+
+        method = scope["method"]
+        status = 500
+        size = 0
+
+        async def send_wrapper(message):
+            nonlocal status, size
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            elif message["type"] == "http.response.body":
+                size += len(message.get("body", b""))
+            await send(message)
+
+        IN_FLIGHT.inc(method)
+        token = CURRENT_SCOPE.set(scope)
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - start
+            CURRENT_SCOPE.reset(token)
+            IN_FLIGHT.dec(method)
+            template = route_label(scope)
+            REQUEST_DURATION.observe(method, template, value=elapsed)
+            REQUESTS.inc(method, template, str(status))
+            RESPONSE_SIZE.observe(method, template, value=size)
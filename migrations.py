@@ -0,0 +1,136 @@
+import sys
+import time
+import asyncio
+import logging
+import argparse
+from datetime import datetime, timezone
+
+logger = logging.getLogger(__name__)
+
+# Colección donde se guarda el progreso de cada migración para poder reanudarla
+CHECKPOINTS = "migrations"
+
+# Campos con referencias a otras colecciones: colección -> array de IDs
+REFERENCE_FIELDS = {
+    "courses": "students",
+    "universities": "courses",
+}
+
+# Leer el punto de control de una migración (None si no ha empezado)
+async def load_checkpoint(db, name):
+    return await db[CHECKPOINTS].find_one({"_id": name})
+
+async def save_checkpoint(db, name, **fields):
+    fields["updated_at"] = datetime.now(timezone.utc)
+    await db[CHECKPOINTS].update_one({"_id": name}, {"$set": fields}, upsert=True)
+
+# Recorrer una colección por lotes de _id ascendente desde el último punto de
+# control y aplicar `migrate_batch(first_id, last_id)` a cada lote. Si se
+# interrumpe, la siguiente ejecución continúa desde el último lote completado
+async def run_batched(db, name, collection, migrate_batch, batch_size, restart=False):
+    checkpoint = None if restart else await load_checkpoint(db, name)
+    if checkpoint and checkpoint.get("done"):
+        logger.info("[%s] ya completada (%s documentos)", name, checkpoint['processed'])
+        return
+    last_id = checkpoint["last_id"] if checkpoint else None
+    processed = checkpoint["processed"] if checkpoint else 0
+    modified = checkpoint["modified"] if checkpoint else 0
+    total = await db[collection].estimated_document_count()
+    start = time.monotonic()
+    while True:
+        page_filter = {"_id": {"$gt": last_id}} if last_id is not None else {}
+        ids = await db[collection].find(page_filter, {"_id": 1}).sort("_id", 1).limit(batch_size).to_list()
+        if not ids:
+            break
+        modified += await migrate_batch(ids[0]["_id"], ids[-1]["_id"])
+        processed += len(ids)
+        last_id = ids[-1]["_id"]
+        await save_checkpoint(db, name, last_id=last_id, processed=processed, modified=modified, done=False)
+        rate = processed / max(time.monotonic() - start, 1e-6)
+        logger.info("[%s] %s/%s documentos, %s modificados (%.0f docs/s)", name, processed, total, modified, rate)
+    await save_checkpoint(db, name, last_id=last_id, processed=processed, modified=modified, done=True)
+    logger.info("[%s] completada: %s documentos, %s modificados", name, processed, modified)
+
+# Migración "refs": convertir a ObjectId las referencias guardadas como string.
+# La conversión se hace en el servidor con una actualización por pipeline, así
+# cada documento se reescribe de forma atómica aunque la API siga escribiendo
+async def migrate_refs(db, batch_size, restart=False):
+    for collection, field in REFERENCE_FIELDS.items():
+        async def migrate_batch(first_id, last_id, collection=collection, field=field):
+            result = await db[collection].update_many(
+                {"_id": {"$gte": first_id, "$lte": last_id}, field: {"$type": "string"}},
+                [{"$set": {field: {"$map": {
+                    "input": f"${field}",
+                    # Los valores que no son un ObjectId válido se dejan como están
+                    "in": {"$convert": {"input": "$$this", "to": "objectId", "onError": "$$this"}}
+                }}}}]
+            )
+            return result.modified_count
+        await run_batched(db, f"refs.{collection}.{field}", collection, migrate_batch, batch_size, restart)
+
+# Migración "enrollments": pasar los arrays courses.students a la colección
+# enrollments y quitar el array del curso una vez guardadas las matrículas
+async def migrate_enrollments(db, batch_size, restart=False):
+    from enrollments import ENROLLMENTS, move_legacy_rosters
+    from indexes import INDEXES
+
+    # El índice único evita matrículas duplicadas aunque la API escriba a la vez
+    await db[ENROLLMENTS].create_indexes(INDEXES[ENROLLMENTS])
+
+    async def migrate_batch(first_id, last_id):
+        courses = await db.courses.find(
+            {"_id": {"$gte": first_id, "$lte": last_id}, "students": {"$exists": True}},
+            {"students": 1}
+        ).to_list()
+        if not courses:
+            return 0
+        # Las rutas hacen lo mismo con los cursos que tocan antes de que llegue la migración
+        return await move_legacy_rosters(db, courses)
+
+    await run_batched(db, "enrollments", "courses", migrate_batch, batch_size, restart)
+
+# Migración "search": rellenar la clave de búsqueda (name_key) en los documentos
+# creados antes de existir. La normalización (sin acentos) se hace en Python, así
+# que cada lote se lee y se escribe con un bulk_write no ordenado
+async def migrate_search_keys(db, batch_size, restart=False):
+    from pymongo import UpdateOne
+    from search import SEARCH_FIELD, SEARCH_TYPES, normalize_name
+
+    for collection in SEARCH_TYPES:
+        async def migrate_batch(first_id, last_id, collection=collection):
+            docs = await db[collection].find(
+                {"_id": {"$gte": first_id, "$lte": last_id}, "name": {"$type": "string"}},
+                {"name": 1, SEARCH_FIELD: 1}
+            ).to_list()
+            operations = [
+                UpdateOne({"_id": doc["_id"], "name": doc["name"]}, {"$set": {SEARCH_FIELD: normalize_name(doc["name"])}})
+                for doc in docs if doc.get(SEARCH_FIELD) != normalize_name(doc["name"])
+            ]
+            if not operations:
+                return 0
+            result = await db[collection].bulk_write(operations, ordered=False)
+            return result.modified_count
+        await run_batched(db, f"search.{collection}", collection, migrate_batch, batch_size, restart)
+
+MIGRATIONS = {
+    "refs": migrate_refs,
+    "enrollments": migrate_enrollments,
+    "search": migrate_search_keys,
+}
+
+async def main(args):
+    from db import close_client, get_database
+
+    db = get_database()
+    try:
+        await MIGRATIONS[args.migration](db, args.batch_size, args.restart)
+    finally:
+        await close_client()
+
+# Uso: python migrations.py {refs|enrollments|search} [--batch-size 1000] [--restart]
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Migraciones de datos por lotes y reanudables")
+    parser.add_argument("migration", choices=sorted(MIGRATIONS))
+    parser.add_argument("--batch-size", type=int, default=1000, help="documentos por lote")
+    parser.add_argument("--restart", action="store_true", help="ignorar el punto de control y empezar de cero")
+    sys.exit(asyncio.run(main(parser.parse_args())))
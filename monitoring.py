@@ -0,0 +1,123 @@
+import os
+import time
+import asyncio
+import logging
+from pymongo import monitoring
+from metrics import counter, current_route, histogram
+
+logger = logging.getLogger(__name__)
+
+# Monitorizar los comandos de MongoDB (MONGODB_MONITORING=0 lo desactiva)
+MONITORING_ENABLED = os.getenv("MONGODB_MONITORING", "1") != "0"
+
+# Umbral (ms) a partir del cual un comando se escribe en el log de consultas lentas
+SLOW_MS = float(os.getenv("MONGODB_SLOW_MS", "100"))
+
+# Capturar el plan (explain) de las consultas lentas; como mucho uno por
+# comando y colección cada SLOW_EXPLAIN_INTERVAL segundos
+SLOW_EXPLAIN = os.getenv("MONGODB_SLOW_EXPLAIN", "0") == "1"
+SLOW_EXPLAIN_INTERVAL = float(os.getenv("MONGODB_SLOW_EXPLAIN_INTERVAL", "60"))
+
+# Comandos de los que se puede pedir el plan sin efectos secundarios
+EXPLAINABLE = {"find", "aggregate", "count", "distinct"}
+
+COMMAND_DURATION = histogram("mongodb_command_duration_seconds", "Duración de los comandos de MongoDB", ("collection", "command"))
+COMMAND_FAILURES = counter("mongodb_command_failures_total", "Comandos de MongoDB fallidos", ("collection", "command"))
+# Suma del tiempo en MongoDB por ruta: comparándolo con http_request_duration_seconds_sum
+# se ve cuánto de cada petición se pasa esperando a la base de datos
+ROUTE_MONGO_SECONDS = counter("mongodb_route_seconds_total", "Tiempo en comandos de MongoDB por ruta", ("route", "collection"))
+
+# Colección sobre la que actúa un comando ("" si no aplica, p. ej. ping)
+def command_collection(command_name, command):
+    if command_name == "getMore":
+        return command.get("collection", "")
+    value = command.get(command_name)
+    return value if isinstance(value, str) else ""
+
+# Parte del comando que identifica la consulta (sin documentos insertados ni opciones de sesión)
+def command_filter(command_name, command):
+    if command_name == "aggregate":
+        return {"pipeline": command.get("pipeline")}
+    if command_name in ("update", "delete"):
+        statements = command.get("updates") or command.get("deletes") or []
+        return {"q": [statement.get("q") for statement in statements[:10]]}
+    return {key: command[key] for key in ("filter", "query", "key", "sort", "projection", "limit") if key in command}
+
+# Listener de comandos de pymongo. Se ejecuta en la misma tarea que la operación,
+# así que la ruta que la lanzó se lee de la contextvar del middleware de métricas
+class CommandMonitor(monitoring.CommandListener):
+    def __init__(self, slow_ms=SLOW_MS, explain=SLOW_EXPLAIN):
+        self.slow_ms = slow_ms
+        self.explain = explain
+        self._pending = {}  # (conexión, request_id) -> (colección, ruta, base de datos, comando)
+        self._explained = {}  # (comando, colección) -> último explain (monotonic)
+
+    def started(self, event):
+        command = event.command
+        self._pending[(event.connection_id, event.request_id)] = (
+            command_collection(event.command_name, command),
+            current_route(),
+            event.database_name,
+            command,
+        )
+
+    def succeeded(self, event):
+        self._finish(event, failed=False)
+
+    def failed(self, event):
+        self._finish(event, failed=True)
+
+    def _finish(self, event, failed):
+        pending = self._pending.pop((event.connection_id, event.request_id), None)
+        if pending is None:
+            return
+        collection, route, database, command = pending
+        seconds = event.duration_micros / 1_000_000
+        COMMAND_DURATION.observe(collection, event.command_name, value=seconds)
+        ROUTE_MONGO_SECONDS.inc(route, collection, amount=seconds)
+        if failed:
+            COMMAND_FAILURES.inc(collection, event.command_name)
+        if seconds * 1000 >= self.slow_ms and event.command_name != "explain":
+            self._log_slow(event, collection, route, database, command, seconds, failed)
+
+    def _log_slow(self, event, collection, route, database, command, seconds, failed):
+        entry = {
+            "event": "slow_command",
+            "command": event.command_name,
+            "database": database,
+            "collection": collection,
+            "route": route,
+            "duration_ms": round(seconds * 1000, 3),
+            "failed": failed,
+            "filter": command_filter(event.command_name, command),
+        }
+        # Los campos van en extra=: con LOG_FORMAT=json son claves de primer nivel del registro
+        logger.warning("Comando lento en MongoDB: %s en %s.%s (%s ms)", event.command_name, database, collection, entry["duration_ms"], extra=entry)
+        if self.explain and event.command_name in EXPLAINABLE and self._should_explain(event.command_name, collection):
+            try:
+                asyncio.get_running_loop().create_task(self._log_explain(database, command, entry))
+            except RuntimeError:
+                pass  # Cliente síncrono (scripts): no hay event loop para lanzar el explain
+
+    def _should_explain(self, command_name, collection):
+        now = time.monotonic()
+        key = (command_name, collection)
+        if now - self._explained.get(key, float("-inf")) < SLOW_EXPLAIN_INTERVAL:
+            return False
+        self._explained[key] = now
+        return True
+
+    # Pedir el plan del comando lento (solo queryPlanner: no vuelve a ejecutarlo)
+    async def _log_explain(self, database, command, entry):
+        from db import get_client
+
+        explained = {key: value for key, value in command.items() if not key.startswith("$") and key not in ("lsid", "txnNumber")}
+        try:
+            plan = await get_client()[database].command({"explain": explained, "verbosity": "queryPlanner"})
+            winning = plan.get("queryPlanner", {}).get("winningPlan", plan.get("stages"))
+            logger.warning("Plan del comando lento: %s en %s.%s", entry["command"], database, entry["collection"], extra={**entry, "event": "slow_command_plan", "plan": winning})
+        except Exception as e:
+            logger.error("Error al obtener el plan del comando lento en '%s': %s", entry['collection'], e)
+
+# Listener compartido por el cliente del proceso
+command_monitor = CommandMonitor()
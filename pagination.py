@@ -0,0 +1,34 @@
+import base64
+from bson import ObjectId
+from bson.errors import InvalidId
+
+# Tamaño de página por defecto y máximo para las rutas de listado
+DEFAULT_LIMIT = 100
+MAX_LIMIT = 1000
+
+# Codificar el último _id de la página como cursor opaco
+def encode_cursor(last_id):
+    return base64.urlsafe_b64encode(ObjectId(last_id).binary).decode().rstrip("=")
+
+# Decodificar un cursor opaco al _id a partir del cual continuar
+def decode_cursor(token):
+    try:
+        padding = "=" * (-len(token) % 4)
+        return ObjectId(base64.urlsafe_b64decode(token + padding))
+    except (ValueError, TypeError, InvalidId):
+        raise ValueError(f"Cursor inválido: '{token}'")
+
+# Obtener una página ordenada por _id sin usar skip: el coste de cada página
+# es el mismo sin importar lo lejos que esté del principio. cursor_key indica
+# dónde está el _id en los documentos devueltos (la proyección puede renombrarlo)
+async def find_page(collection, query=None, limit=DEFAULT_LIMIT, after_id=None, projection=None, cursor_key="_id"):
+    page_filter = dict(query or {})
+    if after_id is not None:
+        page_filter["_id"] = {"$gt": after_id}
+    # Se pide un documento de más para saber si hay página siguiente
+    docs = await collection.find(page_filter, projection).sort("_id", 1).limit(limit + 1).to_list()
+    next_cursor = None
+    if len(docs) > limit:
+        docs = docs[:limit]
+        next_cursor = encode_cursor(docs[-1][cursor_key])
+    return docs, next_cursor
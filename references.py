@@ -0,0 +1,51 @@
+from typing import Annotated
+from bson import ObjectId
+from pydantic import PlainSerializer, PlainValidator, WithJsonSchema
+
+# Convertir una referencia recibida (string hexadecimal u ObjectId) a ObjectId
+def to_object_id(value):
+    if isinstance(value, ObjectId):
+        return value
+    if isinstance(value, str) and ObjectId.is_valid(value):
+        return ObjectId(value)
+    raise ValueError(f"ID inválido: '{value}'")
+
+# Tipo canónico de las referencias entre colecciones: se valida y se guarda como
+# ObjectId, y en JSON se expone como string
+ObjectIdRef = Annotated[
+    ObjectId,
+    PlainValidator(to_object_id),
+    PlainSerializer(str, return_type=str, when_used="json"),
+    WithJsonSchema({"type": "string", "pattern": "^[0-9a-fA-F]{24}$"}),
+]
+
+# Mientras la migración (python migrations.py refs) no haya terminado puede
+# haber referencias antiguas guardadas como string: se buscan ambas formas
+# (dos claves en el mismo índice multikey)
+def ref_variants(ref_id):
+    obj_id = ObjectId(ref_id)
+    return [str(obj_id), obj_id]
+
+def ref_variants_many(ref_ids):
+    return [variant for ref_id in ref_ids for variant in ref_variants(ref_id)]
+
+# Pipeline para búsquedas inversas en bloque: para cada ID pedido, los documentos
+# cuyo array `field` lo contiene. El primer $match usa el índice multikey
+def reverse_lookup_pipeline(field, ref_ids, projection):
+    refs = ref_variants_many(ref_ids)
+    return [
+        {"$match": {field: {"$in": refs}}},
+        {"$project": {field: 1, **projection}},
+        {"$unwind": f"${field}"},
+        {"$match": {field: {"$in": refs}}},
+        {"$group": {
+            "_id": {"$toString": f"${field}"},
+            "items": {"$push": {"_id": "$_id", **{name: f"${name}" for name in projection}}}
+        }},
+    ]
+
+# Ejecutar la búsqueda inversa y devolver {id pedido: [documentos]}
+async def reverse_lookup(collection, field, ref_ids, projection):
+    cursor = await collection.aggregate(reverse_lookup_pipeline(field, ref_ids, projection))
+    groups = {group["_id"]: group["items"] async for group in cursor}
+    return {str(ObjectId(ref_id)): groups.get(str(ObjectId(ref_id)), []) for ref_id in ref_ids}
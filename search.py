@@ -0,0 +1,77 @@
+import asyncio
+import logging
+import unicodedata
+from fastapi import APIRouter, Depends, HTTPException, Query
+from db import get_db
+from pymongo.asynchronous.database import AsyncDatabase
+from serializer import BSONJSONResponse
+
+logger = logging.getLogger(__name__)
+
+# Campo con el nombre normalizado (minúsculas y sin acentos) y su índice en cada colección
+SEARCH_FIELD = "name_key"
+SEARCH_TYPES = ("students", "courses", "universities")
+MAX_SEARCH_LIMIT = 50
+
+# La clave de búsqueda es interna: las lecturas la excluyen en la proyección
+WITHOUT_SEARCH_KEY = {SEARCH_FIELD: 0}
+
+# Quitar mayúsculas y acentos
+def _fold(text):
+    decomposed = unicodedata.normalize("NFKD", text.casefold())
+    return "".join(char for char in decomposed if not unicodedata.combining(char))
+
+# Normalizar un nombre para búsquedas: sin distinguir mayúsculas ni acentos
+def normalize_name(name):
+    return _fold(name).strip()
+
+# Normalizar el texto tecleado en una búsqueda por prefijo: el espacio final se
+# conserva porque forma parte del prefijo ("ana " no debe encontrar "Anabel")
+def normalize_prefix(text):
+    return _fold(text).lstrip()
+
+# Añadir la clave de búsqueda a un documento (o a un $set) que contiene el nombre
+def with_search_key(doc):
+    if "name" in doc:
+        doc[SEARCH_FIELD] = normalize_name(doc["name"])
+    return doc
+
+# Rango [prefijo, siguiente prefijo) sobre la clave normalizada: el índice
+# resuelve la búsqueda por prefijo con un recorrido acotado, sin regex
+def prefix_range(prefix):
+    upper = prefix[:-1] + chr(ord(prefix[-1]) + 1)
+    return {"$gte": prefix, "$lt": upper}
+
+async def search_collection(db, collection, prefix, limit):
+    docs = await db[collection].find(
+        {SEARCH_FIELD: prefix_range(prefix)},
+        {"name": 1, SEARCH_FIELD: 1}
+    ).sort(SEARCH_FIELD, 1).limit(limit).to_list()
+    return [{"type": collection, "_id": doc["_id"], "name": doc["name"], SEARCH_FIELD: doc[SEARCH_FIELD]} for doc in docs]
+
+# Rutas de búsqueda
+router = APIRouter()
+
+# Ruta para buscar por prefijo de nombre (autocompletado) en una o todas las colecciones
+@router.get("/search")
+async def search(
+    q: str = Query(..., min_length=1, max_length=100),
+    type: str | None = Query(None, pattern="^(students|courses|universities)$"),
+    limit: int = Query(10, ge=1, le=MAX_SEARCH_LIMIT),
+    db: AsyncDatabase = Depends(get_db),
+):
+    prefix = normalize_prefix(q)
+    if not prefix:
+        raise HTTPException(status_code=400, detail="Texto de búsqueda vacío")
+    try:
+        collections = [type] if type else SEARCH_TYPES
+        groups = await asyncio.gather(*(search_collection(db, collection, prefix, limit) for collection in collections))
+        # Mezclar los resultados de cada colección por orden alfabético normalizado
+        results = sorted((item for group in groups for item in group), key=lambda item: item[SEARCH_FIELD])[:limit]
+        for item in results:
+            del item[SEARCH_FIELD]
+        logger.info("Búsqueda '%s' completada: %s resultados", q, len(results))
+        return BSONJSONResponse({"results": results, "message": "Búsqueda completada exitosamente"})
+    except Exception as e:
+        logger.error("Error al buscar '%s': %s", q, e)
+        raise HTTPException(status_code=500, detail="Error al buscar")
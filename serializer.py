@@ -0,0 +1,95 @@
+import os
+import bson
+import orjson
+import msgpack
+from datetime import datetime
+from functools import lru_cache
+from bson import Decimal128, ObjectId
+from fastapi.responses import Response
+from starlette.datastructures import Headers
+
+# Formatos de respuesta que se pueden pedir con la cabecera Accept
+JSON_MEDIA_TYPE = "application/json"
+BSON_MEDIA_TYPE = "application/bson"
+MSGPACK_MEDIA_TYPE = "application/msgpack"
+
+# Compresión gzip (según Accept-Encoding) de las respuestas a partir de este tamaño
+GZIP_MINIMUM_SIZE = int(os.getenv("GZIP_MINIMUM_SIZE", "1024"))
+GZIP_COMPRESS_LEVEL = int(os.getenv("GZIP_COMPRESS_LEVEL", "5"))
+
+# Tipos de BSON que JSON no conoce; las fechas (datetime) las codifica orjson directamente
+def _default(value):
+    if isinstance(value, ObjectId):
+        return str(value)
+    if isinstance(value, Decimal128):
+        return str(value.to_decimal())
+    raise TypeError(f"Tipo no serializable a JSON: {type(value).__name__}")
+
+# Codificar documentos de MongoDB a JSON en una sola pasada, sin convertir
+# antes los ObjectId a str ni recorrerlos con jsonable_encoder
+def dumps(content):
+    return orjson.dumps(content, default=_default)
+
+# BSON conserva los tipos de MongoDB (ObjectId, fechas, Decimal128). Un documento
+# BSON tiene que ser un objeto: las listas se envían como {"items": [...]}
+def dumps_bson(content):
+    return bson.encode(content if isinstance(content, dict) else {"items": content})
+
+# MessagePack: los mismos valores que en JSON (ObjectId como str, fechas en ISO 8601)
+def _msgpack_default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return _default(value)
+
+def dumps_msgpack(content):
+    return msgpack.packb(content, default=_msgpack_default)
+
+ENCODERS = {
+    JSON_MEDIA_TYPE: dumps,
+    BSON_MEDIA_TYPE: dumps_bson,
+    MSGPACK_MEDIA_TYPE: dumps_msgpack,
+}
+
+_MEDIA_TYPE_ALIASES = {"application/x-msgpack": MSGPACK_MEDIA_TYPE, "application/*": JSON_MEDIA_TYPE, "*/*": JSON_MEDIA_TYPE}
+
+# Elegir el formato con mayor q de la cabecera Accept entre los soportados (JSON
+# si no se indica ninguno). Los clientes repiten siempre la misma cabecera
+@lru_cache(maxsize=256)
+def negotiate(accept):
+    best, best_q = JSON_MEDIA_TYPE, 0.0
+    for item in (accept or "").split(","):
+        media_type, _, params = item.partition(";")
+        media_type = media_type.strip().lower()
+        media_type = _MEDIA_TYPE_ALIASES.get(media_type, media_type)
+        if media_type not in ENCODERS:
+            continue
+        q = 1.0
+        for param in params.split(";"):
+            name, _, value = param.partition("=")
+            if name.strip() == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        if q > best_q:
+            best, best_q = media_type, q
+    return best
+
+# Respuesta con los documentos de MongoDB codificados en el formato que pide el
+# cliente (JSON, BSON o MessagePack). FastAPI no aplica jsonable_encoder cuando
+# la ruta devuelve directamente una Response; la codificación se hace al enviar,
+# cuando ya se conoce la cabecera Accept de la petición
+class BSONJSONResponse(Response):
+    media_type = JSON_MEDIA_TYPE
+
+    def __init__(self, content, status_code=200, headers=None, media_type=None, background=None):
+        self.content = content
+        super().__init__(None, status_code, headers, media_type, background)
+
+    async def __call__(self, scope, receive, send):
+        media_type = negotiate(Headers(scope=scope).get("accept"))
+        self.body = ENCODERS[media_type](self.content)
+        self.headers["content-type"] = media_type
+        self.headers["content-length"] = str(len(self.body))
+        self.headers.add_vary_header("Accept")
+        await super().__call__(scope, receive, send)
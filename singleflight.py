@@ -0,0 +1,49 @@
+import os
+import asyncio
+from metrics import counter, gauge
+
+# Agrupar lecturas idénticas simultáneas (SINGLEFLIGHT_ENABLED=0 lo desactiva)
+SINGLEFLIGHT_ENABLED = os.getenv("SINGLEFLIGHT_ENABLED", "1") != "0"
+
+# Ratio de agrupación = shared / (leader + shared)
+SINGLEFLIGHT_CALLS = counter("singleflight_calls_total", "Lecturas por grupo: leader consulta MongoDB, shared reutiliza una consulta en curso", ("group", "result"))
+SINGLEFLIGHT_IN_FLIGHT = gauge("singleflight_in_flight", "Consultas distintas en curso por grupo", ("group",))
+
+# Las peticiones simultáneas con la misma clave comparten una única consulta
+# y su resultado. La consulta corre en su propia tarea: si la petición que la
+# lanzó se cancela (el cliente se desconecta), las demás siguen esperándola
+class SingleFlight:
+    def __init__(self, name):
+        self.name = name
+        self._calls = {}
+
+    async def do(self, key, fn):
+        if not SINGLEFLIGHT_ENABLED:
+            return await fn()
+        task = self._calls.get(key)
+        if task is None:
+            task = asyncio.ensure_future(fn())
+            self._calls[key] = task
+            task.add_done_callback(lambda done: self._finished(key, done))
+            SINGLEFLIGHT_IN_FLIGHT.set(self.name, value=len(self._calls))
+            SINGLEFLIGHT_CALLS.inc(self.name, "leader")
+        else:
+            SINGLEFLIGHT_CALLS.inc(self.name, "shared")
+        return await asyncio.shield(task)
+
+    def _finished(self, key, task):
+        if self._calls.get(key) is task:
+            del self._calls[key]
+        SINGLEFLIGHT_IN_FLIGHT.set(self.name, value=len(self._calls))
+        # Marcar la excepción como recogida aunque todas las peticiones se hayan ido
+        if not task.cancelled():
+            task.exception()
+
+# Un grupo por colección y tipo de lectura ("id", "list")
+_flights = {}
+
+def get_flight(collection, kind):
+    key = (collection, kind)
+    if key not in _flights:
+        _flights[key] = SingleFlight(f"{collection}.{kind}")
+    return _flights[key]
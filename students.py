@@ -1,21 +1,35 @@
-from db import get_database
+from admission import AdmissionMiddleware
+from bulk import BULK_CHUNK_SIZE, MAX_BULK_CHUNK_SIZE, BulkBodyError, bulk_insert
+from cache import MISSING, get_cache, invalidate
+from db import get_db, lifespan
+from enrollments import ENROLLMENTS, fold_legacy_rosters, student_courses_pipeline
+from etag import document_version, etag_matches, expected_version, fetch_version, make_etag, not_modified, patch_document, with_initial_version
+from export import EXPORT_FORMAT_PATTERN, EXPORT_FORMATS, export_cursor, export_format, export_headers, export_stream
+from metrics import MetricsMiddleware
+from pagination import DEFAULT_LIMIT, MAX_LIMIT, decode_cursor, find_page
+from references import ref_variants, ref_variants_many
+from search import WITHOUT_SEARCH_KEY, with_search_key
+from serializer import GZIP_COMPRESS_LEVEL, GZIP_MINIMUM_SIZE, BSONJSONResponse
+from singleflight import get_flight
 from pydantic import BaseModel
-from fastapi import FastAPI, HTTPException
+from fastapi import Depends, FastAPI, Header, HTTPException, Query, Request
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import StreamingResponse
 from bson import ObjectId
+from bson.errors import InvalidId
+from pymongo.asynchronous.database import AsyncDatabase
+from system import router as system_router
 import logging
 
 # Configuración del logger para el módulo actual
 logger = logging.getLogger(__name__)
 
-# Creación de la aplicación FastAPI
-app = FastAPI()
-
-# Intentar conectar a la base de datos
-try:
-    db = get_database()  # Obtener la conexión a la base de datos
-    logger.info("Conectado a MongoDB")  # Log de éxito
-except Exception as e:
-    logger.error(f"Error al conectar a MongoDB: {e}")  # Log de error
+# Creación de la aplicación FastAPI (el cliente de MongoDB se gestiona en el lifespan)
+app = FastAPI(lifespan=lifespan)
+app.add_middleware(GZipMiddleware, minimum_size=GZIP_MINIMUM_SIZE, compresslevel=GZIP_COMPRESS_LEVEL)
+app.add_middleware(AdmissionMiddleware)
+app.add_middleware(MetricsMiddleware)  # El último añadido es el más externo: mide también los 503
+app.include_router(system_router)
 
 
 # Definición del modelo de datos para un estudiante
@@ -25,102 +39,243 @@ class Student(BaseModel):
 
 # Ruta para crear un nuevo estudiante
 @app.post("/students")
-async def create_students(student: Student):
+async def create_students(student: Student, db: AsyncDatabase = Depends(get_db)):
     try:
-        result = db["students"].insert_one(student.dict())
+        result = await db["students"].insert_one(with_initial_version(with_search_key(student.dict())))
+        invalidate("students")
         logger.info("Estudiante añadido exitosamente")
         return {
             "id": str(result.inserted_id),
             "message": "Estudiante añadido exitosamente"
         }
     except Exception as e:
-        logger.error(f"Error al añadir estudiante: {e}")
+        logger.error("Error al añadir estudiante: %s", e)
         raise HTTPException(status_code=500, detail="Error al añadir estudiante")
 
-# Ruta para obtener todos los estudiantes
+# Ruta para crear estudiantes en bloque (array JSON o NDJSON) con insert_many no ordenado
+@app.post("/students/bulk")
+async def create_students_bulk(request: Request, chunk_size: int = Query(BULK_CHUNK_SIZE, ge=1, le=MAX_BULK_CHUNK_SIZE), db: AsyncDatabase = Depends(get_db)):
+    try:
+        result = await bulk_insert(request, db.students, Student, chunk_size)
+        invalidate("students")
+        result["message"] = f"Estudiantes añadidos en bloque: {result['inserted']} insertados, {result['failed']} con error"
+        return result
+    except BulkBodyError as e:
+        logger.warning("Cuerpo inválido en la inserción en bloque de estudiantes: %s", e)
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        logger.error("Error al añadir estudiantes en bloque: %s", e)
+        raise HTTPException(status_code=500, detail="Error al añadir estudiantes en bloque")
+
+# Ruta para obtener los estudiantes paginados por _id (parámetros limit y after)
 @app.get("/students")
-async def get_students():
+async def get_students(limit: int = Query(DEFAULT_LIMIT, ge=1, le=MAX_LIMIT), after: str | None = None, db: AsyncDatabase = Depends(get_db)):
+    # Validar el cursor de paginación
     try:
-        students = list(db.students.find())
-        for student in students:
-            student["_id"] = str(student["_id"])
+        after_id = decode_cursor(after) if after else None
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Cursor de paginación inválido")
+    try:
+        # Los listados idénticos simultáneos comparten la consulta. La generación de la
+        # caché cambia con cada escritura: una lectura posterior no se une a una anterior
+        generation = get_cache("students", "name").generation
+        students, next_cursor = await get_flight("students", "list").do((limit, after_id, generation), lambda: find_page(db.students, limit=limit, after_id=after_id, projection=WITHOUT_SEARCH_KEY))
         logger.info("Estudiantes obtenidos exitosamente")
-        return {"students": students, "message": "Estudiantes obtenidos exitosamente"}
+        return BSONJSONResponse({"students": students, "next": next_cursor, "message": "Estudiantes obtenidos exitosamente"})
     except Exception as e:
-        logger.error(f"Error al obtener estudiantes: {e}")
+        logger.error("Error al obtener estudiantes: %s", e)
         raise HTTPException(status_code=500, detail="Error al obtener estudiantes")
 
+# Ruta para exportar todos los estudiantes en streaming (NDJSON, BSON o MessagePack según format o Accept)
+@app.get("/students/export")
+async def export_students(format: str | None = Query(None, pattern=EXPORT_FORMAT_PATTERN), accept: str | None = Header(None), db: AsyncDatabase = Depends(get_db)):
+    headers = export_headers(format)
+    format = export_format(format, accept)
+    logger.info("Exportación de estudiantes iniciada (formato %s)", format)
+    return StreamingResponse(export_stream(export_cursor(db.students, WITHOUT_SEARCH_KEY), format), media_type=EXPORT_FORMATS[format], headers=headers)
+
 # Ruta para obtener un estudiante por nombre (solo el primero que coincida)
 @app.get("/students/{name}")
-async def get_one_student(name: str):
+async def get_one_student(name: str, db: AsyncDatabase = Depends(get_db)):
     try:
-        student = db["students"].find_one({"name": name})
+        # Consultar primero la caché de lecturas por nombre
+        cache = get_cache("students", "name")
+        student = cache.get(("one", name))
+        if student is MISSING:
+            generation = cache.generation
+            student = await db["students"].find_one({"name": name}, WITHOUT_SEARCH_KEY)
+            if student:
+                cache.set(("one", name), student, generation)
         if student:
-            student["_id"] = str(student["_id"])
             logger.info("Estudiante recuperado exitosamente")
-            return student
+            return BSONJSONResponse(student)
         logger.warning("Estudiante no encontrado")
         raise HTTPException(status_code=404, detail="Estudiante no encontrado")
     except Exception as e:
-        logger.error(f"Error al buscar estudiante: {e}")
+        logger.error("Error al buscar estudiante: %s", e)
         raise HTTPException(status_code=500, detail="Error al buscar estudiante")
 
 # Ruta para obtener estudiantes por nombre
 @app.get("/students/name/{name}")
-async def get_students_by_name(name: str):
+async def get_students_by_name(name: str, db: AsyncDatabase = Depends(get_db)):
     try:
-        students = db["students"].find({"name": name})
-        students_list = [{"id": str(student["_id"]), "name": student["name"], "age": student["age"]} for student in students]
+        # Consultar primero la caché de lecturas por nombre
+        cache = get_cache("students", "name")
+        students_list = cache.get(("all", name))
+        if students_list is MISSING:
+            generation = cache.generation
+            # La proyección renombra _id a id en el servidor
+            students_list = await db["students"].find({"name": name}, {"_id": 0, "id": "$_id", "name": 1, "age": 1}).to_list()
+            if students_list:
+                cache.set(("all", name), students_list, generation)
         if not students_list:
-            logger.warning(f"No se encontraron estudiantes con el nombre '{name}'")
+            logger.warning("No se encontraron estudiantes con el nombre '%s'", name)
             raise HTTPException(status_code=404, detail=f"No se encontraron estudiantes con el nombre '{name}'")
-        logger.info(f"Estudiantes con el nombre '{name}' recuperados exitosamente")
-        return students_list
+        logger.info("Estudiantes con el nombre '%s' recuperados exitosamente", name)
+        return BSONJSONResponse(students_list)
     except Exception as e:
-        logger.error(f"Error al buscar estudiantes por nombre: {e}")
+        logger.error("Error al buscar estudiantes por nombre: %s", e)
         raise HTTPException(status_code=500, detail="Error al buscar estudiantes por nombre")
 
 # Ruta para obtener un estudiante por ID
 @app.get("/students/id/{student_id}")
-async def get_student_by_id(student_id: str):
+async def get_student_by_id(student_id: str, if_none_match: str | None = Header(None), db: AsyncDatabase = Depends(get_db)):
     try:
         obj_id = ObjectId(student_id)
-        student = db["students"].find_one({"_id": obj_id})
+        # Consultar primero la caché de lecturas por ID
+        cache = get_cache("students", "id")
+        student = cache.get(str(obj_id))
+        # GET condicional: si el ETag coincide se responde 304 comparando solo la versión
+        if if_none_match:
+            version = document_version(student) if student is not MISSING else await fetch_version(db.students, obj_id)
+            if version is not None and etag_matches(if_none_match, make_etag(obj_id, version)):
+                return not_modified(make_etag(obj_id, version))
+        if student is MISSING:
+            generation = cache.generation
+            # Las lecturas simultáneas del mismo documento comparten la consulta
+            student = await get_flight("students", "id").do((str(obj_id), generation), lambda: db["students"].find_one({"_id": obj_id}, WITHOUT_SEARCH_KEY))
+            if student:
+                cache.set(str(obj_id), student, generation)
         if student:
-            student["_id"] = str(student["_id"])
-            logger.info(f"Estudiante con ID '{student_id}' recuperado exitosamente")
-            return student
-        logger.warning(f"Estudiante con ID '{student_id}' no encontrado")
+            logger.info("Estudiante con ID '%s' recuperado exitosamente", student_id)
+            return BSONJSONResponse(student, headers={"ETag": make_etag(obj_id, document_version(student))})
+        logger.warning("Estudiante con ID '%s' no encontrado", student_id)
         raise HTTPException(status_code=404, detail=f"Estudiante con ID '{student_id}' no encontrado")
     except Exception as e:
-        logger.error(f"Error al buscar estudiante por ID: {e}")
+        logger.error("Error al buscar estudiante por ID: %s", e)
         raise HTTPException(status_code=400, detail="Formato de ID inválido")
 
 # Ruta para actualizar un estudiante por ID
 @app.put("/students/updateStudent/{id}")
-async def update_student(id: str, student: Student):
+async def update_student(id: str, student: Student, db: AsyncDatabase = Depends(get_db)):
     try:
         obj_id = ObjectId(id)
-        result = db.students.update_one({"_id": obj_id}, {"$set": student.dict()})
+        result = await db.students.update_one({"_id": obj_id}, {"$set": with_search_key(student.dict()), "$inc": {"version": 1}})
+        invalidate("students", obj_id)
         if result.matched_count == 0:
             logger.warning("Estudiante no encontrado")
             raise HTTPException(status_code=404, detail="Estudiante no encontrado")
         logger.info("Estudiante actualizado exitosamente")
         return {"message": "Estudiante actualizado exitosamente"}
     except Exception as e:
-        logger.error(f"Error al actualizar estudiante: {e}")
+        logger.error("Error al actualizar estudiante: %s", e)
         raise HTTPException(status_code=400, detail="Formato de ID inválido")
 
+# Definición del modelo de datos para actualizar solo algunos campos de un estudiante
+class StudentPatch(BaseModel):
+    name: str | None = None  # Nombre del estudiante
+    age: int | None = None   # Edad del estudiante
+    version: int | None = None  # Versión leída (si no se envía If-Match)
+
+# Ruta para actualizar parcialmente un estudiante: solo se escriben ($set) los campos
+# enviados. Con If-Match o version, la escritura falla si otra petición lo modificó antes
+@app.patch("/students/updateStudent/{id}")
+async def patch_student(id: str, student: StudentPatch, if_match: str | None = Header(None), db: AsyncDatabase = Depends(get_db)):
+    try:
+        obj_id = ObjectId(id)
+    except InvalidId:
+        raise HTTPException(status_code=400, detail="Formato de ID inválido")
+    try:
+        version = expected_version(if_match, obj_id, student.version)
+    except ValueError:
+        raise HTTPException(status_code=412, detail="If-Match no corresponde a este estudiante")
+    # null no borra campos obligatorios: se ignora igual que un campo no enviado
+    fields = student.dict(exclude_unset=True, exclude_none=True, exclude={"version"})
+    if not fields:
+        raise HTTPException(status_code=400, detail="No hay campos que actualizar")
+    try:
+        new_version = await patch_document(db.students, obj_id, with_search_key(fields), version)
+        if new_version is None:
+            current = await fetch_version(db.students, obj_id)
+            if current is None:
+                logger.warning("Estudiante con ID '%s' no encontrado", id)
+                raise HTTPException(status_code=404, detail="Estudiante no encontrado")
+            logger.warning("Conflicto al actualizar el estudiante '%s': versión %s, actual %s", id, version, current)
+            raise HTTPException(status_code=412 if if_match else 409, detail=f"El estudiante ha sido modificado por otra petición (versión actual {current})")
+        invalidate("students", obj_id)
+        logger.info("Estudiante con ID '%s' actualizado parcialmente (versión %s)", id, new_version)
+        return BSONJSONResponse({"version": new_version, "message": "Estudiante actualizado exitosamente"}, headers={"ETag": make_etag(obj_id, new_version)})
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error("Error al actualizar parcialmente el estudiante: %s", e)
+        raise HTTPException(status_code=500, detail="Error al actualizar estudiante")
+
 # Ruta para eliminar un estudiante por ID
 @app.delete("/students/deleteById/{id}")
-async def delete_student_by_id(id: str):
+async def delete_student_by_id(id: str, db: AsyncDatabase = Depends(get_db)):
     try:
-        result = db.students.delete_one({"_id": ObjectId(id)})
+        result = await db.students.delete_one({"_id": ObjectId(id)})
+        invalidate("students", ObjectId(id))
+        # Los arrays antiguos que lo contengan pasan antes a enrollments, así también se borran
+        await fold_legacy_rosters(db, {"students": {"$in": ref_variants(id)}})
+        await db[ENROLLMENTS].delete_many({"student_id": ObjectId(id)})
         if result.deleted_count == 0:
-            logger.warning(f"No se encontró estudiante con ID '{id}' para eliminar")
+            logger.warning("No se encontró estudiante con ID '%s' para eliminar", id)
             raise HTTPException(status_code=404, detail=f"No se encontró estudiante con ID '{id}' para eliminar")
-        logger.info(f"Estudiante con ID '{id}' eliminado exitosamente")
+        logger.info("Estudiante con ID '%s' eliminado exitosamente", id)
         return {"message": f"Estudiante con ID '{id}' eliminado exitosamente"}
     except Exception as e:
-        logger.error(f"Error al eliminar estudiante con ID '{id}': {e}")
+        logger.error("Error al eliminar estudiante con ID '%s': %s", id, e)
+        raise HTTPException(status_code=400, detail="Formato de ID inválido")
+
+
+# ------------------------------ CURSOS DE UN ESTUDIANTE ------------------------------
+# Definición del modelo de datos para una búsqueda de cursos de varios estudiantes
+class StudentLookup(BaseModel):
+    students: list[str]  # IDs de los estudiantes
+
+# Ruta para obtener los cursos en los que está matriculado un estudiante (índice enrollments.student_id)
+@app.get("/students/{student_id}/courses")
+async def get_student_courses(student_id: str, db: AsyncDatabase = Depends(get_db)):
+    try:
+        obj_id = ObjectId(student_id)
+    except Exception:
         raise HTTPException(status_code=400, detail="Formato de ID inválido")
+    try:
+        await fold_legacy_rosters(db, {"students": {"$in": ref_variants(obj_id)}})
+        cursor = await db[ENROLLMENTS].aggregate(student_courses_pipeline([obj_id]))
+        groups = await cursor.to_list()
+        courses = groups[0]["courses"] if groups else []
+        logger.info("Cursos del estudiante con ID '%s' obtenidos exitosamente", student_id)
+        return BSONJSONResponse({"courses": courses, "message": f"Cursos del estudiante con ID '{student_id}' obtenidos exitosamente"})
+    except Exception as e:
+        logger.error("Error al obtener los cursos del estudiante: %s", e)
+        raise HTTPException(status_code=500, detail="Error al obtener los cursos del estudiante")
+
+# Ruta para obtener los cursos de varios estudiantes en una sola consulta
+@app.post("/students/courses")
+async def get_students_courses(body: StudentLookup, db: AsyncDatabase = Depends(get_db)):
+    try:
+        student_ids = [ObjectId(student_id) for student_id in body.students]
+        await fold_legacy_rosters(db, {"students": {"$in": ref_variants_many(student_ids)}})
+        cursor = await db[ENROLLMENTS].aggregate(student_courses_pipeline(student_ids))
+        groups = {group["_id"]: group["courses"] async for group in cursor}
+        courses = {str(student_id): groups.get(student_id, []) for student_id in student_ids}
+        logger.info("Cursos de %s estudiantes obtenidos exitosamente", len(body.students))
+        return BSONJSONResponse({"courses": courses, "message": f"Cursos de {len(body.students)} estudiantes obtenidos exitosamente"})
+    except InvalidId:
+        raise HTTPException(status_code=400, detail="Formato de ID inválido")
+    except Exception as e:
+        logger.error("Error al obtener los cursos de los estudiantes: %s", e)
+        raise HTTPException(status_code=500, detail="Error al obtener los cursos de los estudiantes")
@@ -0,0 +1,37 @@
+from fastapi import APIRouter, Depends, Request
+from fastapi.responses import JSONResponse, Response
+from pymongo.asynchronous.database import AsyncDatabase
+from cache import cache_stats
+from db import check_readiness, get_db
+from metrics import PROMETHEUS_CONTENT_TYPE, render
+
+# Rutas comunes a todas las aplicaciones (estado interno del proceso)
+router = APIRouter()
+
+# Ruta para consultar los contadores de la caché de lecturas
+@router.get("/cache/stats")
+async def get_cache_stats():
+    return {"caches": cache_stats(), "message": "Estadísticas de la caché obtenidas exitosamente"}
+
+# Ruta para exportar las métricas del proceso en formato Prometheus
+@router.get("/metrics", include_in_schema=False)
+async def get_metrics():
+    return Response(render(), media_type=PROMETHEUS_CONTENT_TYPE)
+
+# Ruta de vida (liveness): el proceso atiende peticiones, sin consultar MongoDB
+@router.get("/healthz", include_in_schema=False)
+async def get_health():
+    return {"status": "ok"}
+
+# Ruta de disponibilidad (readiness): MongoDB responde al ping (resultado cacheado)
+@router.get("/readyz", include_in_schema=False)
+async def get_readiness(request: Request, db: AsyncDatabase = Depends(get_db)):
+    readiness = await check_readiness(db)
+    warm_up = getattr(request.app.state, "warm_up", None)
+    body = {
+        "status": "ready" if readiness["ready"] else "unavailable",
+        # El detalle del error solo va al log, no a la respuesta
+        "mongodb": "ok" if readiness["ready"] else "unavailable",
+        "startup": "done" if warm_up is None or warm_up.done() else "running",
+    }
+    return JSONResponse(body, status_code=200 if readiness["ready"] else 503)
@@ -0,0 +1,144 @@
+import asyncio
+
+import pytest
+from pymongo.errors import BulkWriteError
+
+from writebehind import QueueClosed, RejectedOperation, WriteBehindQueue
+
+
+# Colección falsa: registra cada bulk_write y falla según `error`
+class FakeCollection:
+    def __init__(self, error=None):
+        self.error = error
+        self.database = None
+        self.batches = []
+
+    async def bulk_write(self, operations, ordered=True):
+        self.batches.append(list(operations))
+        if self.error is not None:
+            raise self.error
+
+
+def run(coroutine):
+    return asyncio.run(asyncio.wait_for(coroutine, 5))
+
+
+def free_slots(queue):
+    return queue._slots._value
+
+
+def test_batches_concurrent_operations():
+    async def scenario():
+        queue = WriteBehindQueue("test", flush_ms=5, flush_ops=100, max_pending=10)
+        collection = FakeCollection()
+        queue.start(collection)
+        await asyncio.gather(*(queue.submit(f"op{i}") for i in range(6)))
+        await queue.close()
+        return queue, collection
+
+    queue, collection = run(scenario())
+    assert collection.batches == [[f"op{i}" for i in range(6)]]
+    assert free_slots(queue) == 10
+
+
+def test_write_concern_error_fails_whole_batch():
+    async def scenario():
+        error = BulkWriteError({"writeErrors": [], "writeConcernErrors": [{"errmsg": "timeout"}]})
+        queue = WriteBehindQueue("test", flush_ms=5, flush_ops=100, max_pending=10)
+        queue.start(FakeCollection(error))
+        results = await asyncio.gather(*(queue.submit(f"op{i}") for i in range(3)), return_exceptions=True)
+        await queue.close()
+        return queue, results
+
+    queue, results = run(scenario())
+    assert all(isinstance(result, BulkWriteError) for result in results)
+    assert free_slots(queue) == 10
+
+
+def test_check_rejects_invalid_keys():
+    async def check(collection, keys):
+        return {key for key in keys if key % 2 == 0}
+
+    async def scenario():
+        queue = WriteBehindQueue("test", flush_ms=5, flush_ops=100, max_pending=10, check=check)
+        collection = FakeCollection()
+        queue.start(collection)
+        results = await asyncio.gather(*(queue.submit(f"op{i}", i) for i in range(4)), return_exceptions=True)
+        await queue.close()
+        return queue, collection, results
+
+    queue, collection, results = run(scenario())
+    assert results[0] is None and results[2] is None
+    assert isinstance(results[1], RejectedOperation) and isinstance(results[3], RejectedOperation)
+    assert collection.batches == [["op0", "op2"]]
+    assert free_slots(queue) == 10
+
+
+def test_unexpected_flush_error_keeps_queue_running():
+    async def scenario():
+        queue = WriteBehindQueue("test", flush_ms=5, flush_ops=100, max_pending=10)
+        queue.start(FakeCollection())
+        flush = queue._flush
+
+        async def broken(batch):
+            raise ValueError("fallo")
+
+        queue._flush = broken
+        results = await asyncio.gather(queue.submit("a"), return_exceptions=True)
+        queue._flush = flush
+        await queue.submit("b")
+        running = queue.running
+        await queue.close()
+        return queue, results, running
+
+    queue, results, running = run(scenario())
+    assert isinstance(results[0], ValueError)
+    assert running
+    assert free_slots(queue) == 10
+
+
+def test_cancelled_task_fails_pending_operations():
+    async def scenario():
+        queue = WriteBehindQueue("test", flush_ms=1000, flush_ops=100, max_pending=10)
+        queue.start(FakeCollection())
+        submitted = asyncio.ensure_future(queue.submit("a"))
+        await asyncio.sleep(0.01)
+        queue._task.cancel()
+        results = await asyncio.gather(submitted, return_exceptions=True)
+        return queue, results
+
+    queue, results = run(scenario())
+    assert isinstance(results[0], RuntimeError)
+    assert free_slots(queue) == 10
+
+
+def test_close_while_waiting_for_a_slot_raises_queue_closed():
+    async def scenario():
+        queue = WriteBehindQueue("test", flush_ms=1000, flush_ops=100, max_pending=1)
+        collection = FakeCollection()
+        queue.start(collection)
+        first = asyncio.ensure_future(queue.submit("a"))
+        await asyncio.sleep(0)
+        # Sin hueco libre: la segunda operación espera en el semáforo
+        second = asyncio.ensure_future(queue.submit("b"))
+        await asyncio.sleep(0)
+        await queue.close()
+        results = await asyncio.gather(first, second, return_exceptions=True)
+        return queue, collection, results
+
+    queue, collection, results = run(scenario())
+    assert results[0] is None
+    assert isinstance(results[1], QueueClosed)
+    assert collection.batches == [["a"]]
+    assert free_slots(queue) == 1
+
+
+def test_submit_after_close_raises_queue_closed():
+    async def scenario():
+        queue = WriteBehindQueue("test", flush_ms=5, flush_ops=100, max_pending=10)
+        queue.start(FakeCollection())
+        await queue.close()
+        with pytest.raises(QueueClosed):
+            await queue.submit("a")
+
+    run(scenario())
@@ -1,156 +1,308 @@
-from db import get_database
+from admission import AdmissionMiddleware
+from bulk import BULK_CHUNK_SIZE, MAX_BULK_CHUNK_SIZE, BulkBodyError, bulk_insert
+from cache import MISSING, get_cache, invalidate
+from db import get_db, lifespan
+from enrollments import ENROLLMENTS, fold_university_rosters
+from etag import document_version, etag_matches, expected_version, fetch_version, make_etag, not_modified, patch_document, with_initial_version
+from export import EXPORT_FORMAT_PATTERN, EXPORT_FORMATS, export_cursor, export_format, export_headers, export_stream
+from metrics import MetricsMiddleware
+from pagination import DEFAULT_LIMIT, MAX_LIMIT, decode_cursor, find_page
+from references import ObjectIdRef
+from search import SEARCH_FIELD, WITHOUT_SEARCH_KEY, with_search_key
+from serializer import GZIP_COMPRESS_LEVEL, GZIP_MINIMUM_SIZE, BSONJSONResponse
+from singleflight import get_flight
 from pydantic import BaseModel
-from fastapi import FastAPI, HTTPException
+from fastapi import Depends, FastAPI, Header, HTTPException, Query, Request
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import StreamingResponse
 from bson import ObjectId
+from bson.errors import InvalidId
+from pymongo.asynchronous.database import AsyncDatabase
+from system import router as system_router
 import logging
 
 # Configuración del logger para el módulo actual
 logger = logging.getLogger(__name__)
 
-# Creación de la aplicación FastAPI
-app = FastAPI()
-
-# Intentar conectar a la base de datos
-try:
-    db = get_database()  # Obtener la conexión a la base de datos
-    logger.info("Conectado a MongoDB")  # Log de éxito
-except Exception as e:
-    logger.error(f"Error al conectar a MongoDB: {e}")  # Log de error
+# Creación de la aplicación FastAPI (el cliente de MongoDB se gestiona en el lifespan)
+app = FastAPI(lifespan=lifespan)
+app.add_middleware(GZipMiddleware, minimum_size=GZIP_MINIMUM_SIZE, compresslevel=GZIP_COMPRESS_LEVEL)
+app.add_middleware(AdmissionMiddleware)
+app.add_middleware(MetricsMiddleware)  # El último añadido es el más externo: mide también los 503
+app.include_router(system_router)
 
 # Definición del modelo de datos para una universidad
 class University(BaseModel):
     name: str  # Nombre de la universidad
     city: str  # Ciudad de la universidad
     country: str  # País de la universidad
-    courses: list[str]  # Lista de IDs de cursos
+    courses: list[ObjectIdRef]  # Lista de IDs de cursos
+
+# Proyección de los listados: renombra _id a id en el servidor
+UNIVERSITY_SUMMARY = {"_id": 0, "id": "$_id", "name": 1, "city": 1, "country": 1, "courses": {"$ifNull": ["$courses", []]}}
 
 # Ruta para crear una nueva universidad
 @app.post("/universities")
-async def create_university(university: University):
+async def create_university(university: University, db: AsyncDatabase = Depends(get_db)):
     try:
-        result = db["universities"].insert_one(university.dict())
+        result = await db["universities"].insert_one(with_initial_version(with_search_key(university.dict())))
+        invalidate("universities")
         logger.info("Universidad añadida exitosamente")
         return {
             "id": str(result.inserted_id),
             "message": "Universidad añadida exitosamente"
         }
     except Exception as e:
-        logger.error(f"Error al añadir universidad: {e}")
+        logger.error("Error al añadir universidad: %s", e)
         raise HTTPException(status_code=500, detail="Error al añadir universidad")
     
-# Ruta para obtener todas las universidades
-@app.get("/universities")
-async def get_universities():
+# Ruta para crear universidades en bloque (array JSON o NDJSON) con insert_many no ordenado
+@app.post("/universities/bulk")
+async def create_universities_bulk(request: Request, chunk_size: int = Query(BULK_CHUNK_SIZE, ge=1, le=MAX_BULK_CHUNK_SIZE), db: AsyncDatabase = Depends(get_db)):
     try:
-        universities = db.universities.find()
-        universities_list = []
-
-        for university in universities:
-            universities_list.append({
-                "id": str(university["_id"]),  # Convertimos ObjectId a str
-                "name": university["name"],
-                "city": university["city"],
-                "country": university["country"],
-                "courses": [str(course) for course in university.get("courses", [])]  # Convertimos ObjectId en courses
-            })
+        result = await bulk_insert(request, db.universities, University, chunk_size)
+        invalidate("universities")
+        result["message"] = f"Universidades añadidas en bloque: {result['inserted']} insertados, {result['failed']} con error"
+        return result
+    except BulkBodyError as e:
+        logger.warning("Cuerpo inválido en la inserción en bloque de universidades: %s", e)
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        logger.error("Error al añadir universidades en bloque: %s", e)
+        raise HTTPException(status_code=500, detail="Error al añadir universidades en bloque")
 
+# Ruta para obtener las universidades paginadas por _id (parámetros limit y after)
+@app.get("/universities")
+async def get_universities(limit: int = Query(DEFAULT_LIMIT, ge=1, le=MAX_LIMIT), after: str | None = None, db: AsyncDatabase = Depends(get_db)):
+    # Validar el cursor de paginación
+    try:
+        after_id = decode_cursor(after) if after else None
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Cursor de paginación inválido")
+    try:
+        # Los listados idénticos simultáneos comparten la consulta. La generación de la
+        # caché cambia con cada escritura: una lectura posterior no se une a una anterior
+        generation = get_cache("universities", "name").generation
+        universities_list, next_cursor = await get_flight("universities", "list").do((limit, after_id, generation), lambda: find_page(db.universities, limit=limit, after_id=after_id, projection=UNIVERSITY_SUMMARY, cursor_key="id"))
         logger.info("Universidades obtenidas exitosamente")
-        return {"universities": universities_list, "message": "Universidades obtenidas exitosamente"}
+        return BSONJSONResponse({"universities": universities_list, "next": next_cursor, "message": "Universidades obtenidas exitosamente"})
 
     except Exception as e:
-        logger.error(f"Error al obtener universidades: {e}")
+        logger.error("Error al obtener universidades: %s", e)
         raise HTTPException(status_code=500, detail="Error al obtener universidades")
 
+# Ruta para exportar todas las universidades en streaming (NDJSON, BSON o MessagePack según format o Accept)
+@app.get("/universities/export")
+async def export_universities(format: str | None = Query(None, pattern=EXPORT_FORMAT_PATTERN), accept: str | None = Header(None), db: AsyncDatabase = Depends(get_db)):
+    headers = export_headers(format)
+    format = export_format(format, accept)
+    logger.info("Exportación de universidades iniciada (formato %s)", format)
+    return StreamingResponse(export_stream(export_cursor(db.universities, WITHOUT_SEARCH_KEY), format), media_type=EXPORT_FORMATS[format], headers=headers)
+
 # Ruta para obtener universidades por nombre
 @app.get("/universities/name/{name}")
-async def get_universities_by_name(name: str):
+async def get_universities_by_name(name: str, db: AsyncDatabase = Depends(get_db)):
     try:
-        universities = db["universities"].find({"name": name})
-        universities_list = []
-        
-        for university in universities:
-            universities_list.append({
-                "id": str(university["_id"]),  # Convertimos ObjectId a str
-                "name": university["name"],
-                "city": university["city"],
-                "country": university["country"],
-                "courses": [str(course) for course in university.get("courses", [])]  # Convertimos ObjectId en courses
-            })
+        # Consultar primero la caché de lecturas por nombre
+        cache = get_cache("universities", "name")
+        universities_list = cache.get(("all", name))
+        if universities_list is MISSING:
+            generation = cache.generation
+            universities_list = await db["universities"].find({"name": name}, UNIVERSITY_SUMMARY).to_list()
+            if universities_list:
+                cache.set(("all", name), universities_list, generation)
 
         if not universities_list:
-            logger.warning(f"No se encontraron universidades con el nombre '{name}'")
+            logger.warning("No se encontraron universidades con el nombre '%s'", name)
             raise HTTPException(status_code=404, detail=f"No se encontraron universidades con el nombre '{name}'")
 
-        logger.info(f"Universidades con el nombre '{name}' recuperadas exitosamente")
-        return universities_list
+        logger.info("Universidades con el nombre '%s' recuperadas exitosamente", name)
+        return BSONJSONResponse(universities_list)
 
     except Exception as e:
-        logger.error(f"Error al buscar universidades por nombre: {e}")
+        logger.error("Error al buscar universidades por nombre: %s", e)
         raise HTTPException(status_code=500, detail="Error al buscar universidades por nombre")
 
 # Ruta para obtener una universidad por ID
 @app.get("/universities/id/{university_id}")
-async def get_university_by_id(university_id: str):
+async def get_university_by_id(university_id: str, if_none_match: str | None = Header(None), db: AsyncDatabase = Depends(get_db)):
     try:
         obj_id = ObjectId(university_id)
-        university = db["universities"].find_one({"_id": obj_id})
+        # Consultar primero la caché de lecturas por ID
+        cache = get_cache("universities", "id")
+        university = cache.get(str(obj_id))
+        # GET condicional: si el ETag coincide se responde 304 comparando solo la versión
+        if if_none_match:
+            version = document_version(university) if university is not MISSING else await fetch_version(db.universities, obj_id)
+            if version is not None and etag_matches(if_none_match, make_etag(obj_id, version)):
+                return not_modified(make_etag(obj_id, version))
+        if university is MISSING:
+            generation = cache.generation
+            # Las lecturas simultáneas del mismo documento comparten la consulta
+            university = await get_flight("universities", "id").do((str(obj_id), generation), lambda: db["universities"].find_one({"_id": obj_id}, WITHOUT_SEARCH_KEY))
+            if university:
+                cache.set(str(obj_id), university, generation)
         if university:
-            university["_id"] = str(university["_id"])  # Convertimos ObjectId a str
-            university["courses"] = [str(course) for course in university.get("courses", [])]  # Convertimos los IDs de los cursos
-            logger.info(f"Universidad con ID '{university_id}' recuperada exitosamente")
-            return university
-        logger.warning(f"Universidad con ID '{university_id}' no encontrada")
+            logger.info("Universidad con ID '%s' recuperada exitosamente", university_id)
+            return BSONJSONResponse(university, headers={"ETag": make_etag(obj_id, document_version(university))})
+        logger.warning("Universidad con ID '%s' no encontrada", university_id)
         raise HTTPException(status_code=404, detail=f"Universidad con ID '{university_id}' no encontrada")
     except Exception as e:
-        logger.error(f"Error al buscar universidad por ID: {e}")
+        logger.error("Error al buscar universidad por ID: %s", e)
         raise HTTPException(status_code=400, detail="Formato de ID inválido")
 
 # Ruta para actualizar una universidad por ID
 @app.put("/universities/updateUniversity/{id}")
-async def update_university(id: str, university: University):
+async def update_university(id: str, university: University, db: AsyncDatabase = Depends(get_db)):
     try:
         obj_id = ObjectId(id)
-        update_data = university.dict()
-        update_data["courses"] = [ObjectId(course) for course in update_data.get("courses", [])]  # Convertimos a ObjectId
-        
-        result = db["universities"].update_one({"_id": obj_id}, {"$set": update_data})
+        update_data = with_search_key(university.dict())  # El modelo ya convierte los cursos a ObjectId
+        result = await db["universities"].update_one({"_id": obj_id}, {"$set": update_data, "$inc": {"version": 1}})
+        invalidate("universities", obj_id)
         if result.matched_count == 0:
             logger.warning("Universidad no encontrada")
             raise HTTPException(status_code=404, detail="Universidad no encontrada")
         logger.info("Universidad actualizada exitosamente")
         return {"message": "Universidad actualizada exitosamente"}
     except Exception as e:
-        logger.error(f"Error al actualizar universidad: {e}")
+        logger.error("Error al actualizar universidad: %s", e)
         raise HTTPException(status_code=400, detail="Formato de ID inválido")
 
+# Definición del modelo de datos para actualizar solo algunos campos de una universidad
+class UniversityPatch(BaseModel):
+    name: str | None = None  # Nombre de la universidad
+    city: str | None = None  # Ciudad de la universidad
+    country: str | None = None  # País de la universidad
+    courses: list[ObjectIdRef] | None = None  # Lista de IDs de cursos (se reemplaza entera)
+    version: int | None = None  # Versión leída (si no se envía If-Match)
+
+# Ruta para actualizar parcialmente una universidad: solo se escriben ($set) los campos
+# enviados. Con If-Match o version, la escritura falla si otra petición la modificó antes
+@app.patch("/universities/updateUniversity/{id}")
+async def patch_university(id: str, university: UniversityPatch, if_match: str | None = Header(None), db: AsyncDatabase = Depends(get_db)):
+    try:
+        obj_id = ObjectId(id)
+    except InvalidId:
+        raise HTTPException(status_code=400, detail="Formato de ID inválido")
+    try:
+        version = expected_version(if_match, obj_id, university.version)
+    except ValueError:
+        raise HTTPException(status_code=412, detail="If-Match no corresponde a esta universidad")
+    # null no borra campos obligatorios: se ignora igual que un campo no enviado
+    fields = university.dict(exclude_unset=True, exclude_none=True, exclude={"version"})
+    if not fields:
+        raise HTTPException(status_code=400, detail="No hay campos que actualizar")
+    try:
+        new_version = await patch_document(db.universities, obj_id, with_search_key(fields), version)
+        if new_version is None:
+            current = await fetch_version(db.universities, obj_id)
+            if current is None:
+                logger.warning("Universidad con ID '%s' no encontrada", id)
+                raise HTTPException(status_code=404, detail="Universidad no encontrada")
+            logger.warning("Conflicto al actualizar la universidad '%s': versión %s, actual %s", id, version, current)
+            raise HTTPException(status_code=412 if if_match else 409, detail=f"La universidad ha sido modificada por otra petición (versión actual {current})")
+        invalidate("universities", obj_id)
+        logger.info("Universidad con ID '%s' actualizada parcialmente (versión %s)", id, new_version)
+        return BSONJSONResponse({"version": new_version, "message": "Universidad actualizada exitosamente"}, headers={"ETag": make_etag(obj_id, new_version)})
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error("Error al actualizar parcialmente la universidad: %s", e)
+        raise HTTPException(status_code=500, detail="Error al actualizar universidad")
+
 # Ruta para eliminar una universidad por ID
 @app.delete("/universities/{university_id}")
-async def delete_university(university_id: str):
+async def delete_university(university_id: str, db: AsyncDatabase = Depends(get_db)):
     try:
         obj_university_id = ObjectId(university_id)
-        result = db["universities"].delete_one({"_id": obj_university_id})
+        result = await db["universities"].delete_one({"_id": obj_university_id})
+        invalidate("universities", obj_university_id)
         if result.deleted_count == 0:
             raise HTTPException(status_code=404, detail="Universidad no encontrada")
-        logger.info(f"Universidad con ID {university_id} eliminada exitosamente")
+        logger.info("Universidad con ID %s eliminada exitosamente", university_id)
         return {"message": f"Universidad con ID {university_id} eliminada exitosamente"}
     except Exception as e:
-        logger.error(f"Error al eliminar universidad: {e}")
+        logger.error("Error al eliminar universidad: %s", e)
         raise HTTPException(status_code=500, detail="Error al eliminar universidad")
 
 # Ruta para añadir un curso a una universidad por ID
 @app.post("/universities/{university_id}/courses/{course_id}")
-async def add_course_to_university(university_id: str, course_id: str):
+async def add_course_to_university(university_id: str, course_id: str, db: AsyncDatabase = Depends(get_db)):
     try:
         obj_university_id = ObjectId(university_id)
         obj_course_id = ObjectId(course_id)
-        result = db["universities"].update_one(
+        result = await db["universities"].update_one(
             {"_id": obj_university_id},
-            {"$addToSet": {"courses": str(obj_course_id)}}  # Convertimos el ObjectId en string antes de insertar
+            {"$addToSet": {"courses": obj_course_id}, "$inc": {"version": 1}}  # Se almacena como ObjectId
         )
+        invalidate("universities", obj_university_id)
         if result.matched_count == 0:
             raise HTTPException(status_code=404, detail="Universidad no encontrada")
-        logger.info(f"Curso con ID {course_id} añadido a la universidad con ID {university_id} exitosamente")
+        logger.info("Curso con ID %s añadido a la universidad con ID %s exitosamente", course_id, university_id)
         return {"message": f"Curso con ID {course_id} añadido a la universidad con ID {university_id} exitosamente"}
     except Exception as e:
-        logger.error(f"Error al añadir curso a la universidad: {e}")
+        logger.error("Error al añadir curso a la universidad: %s", e)
         raise HTTPException(status_code=500, detail="Error al añadir curso a la universidad")
+
+# ------------------------------ VISTA COMPLETA DE UNA UNIVERSIDAD ------------------------------
+# Convertir un array de referencias (string u ObjectId) a ObjectId para poder hacer $lookup por _id
+def refs_to_object_ids(field):
+    return {"$map": {
+        "input": {"$ifNull": [field, []]},
+        "in": {"$convert": {"input": "$$this", "to": "objectId", "onError": None, "onNull": None}}
+    }}
+
+# Pipeline de agregación que resuelve los cursos (depth=1) y sus estudiantes (depth=2)
+def university_view_pipeline(obj_id, depth):
+    course_pipeline = [{"$project": {"name": 1, "faculty": 1}}]
+    if depth >= 2:
+        course_pipeline.append({"$lookup": {
+            "from": ENROLLMENTS,
+            "localField": "_id",
+            "foreignField": "course_id",
+            "pipeline": [
+                {"$lookup": {
+                    "from": "students",
+                    "localField": "student_id",
+                    "foreignField": "_id",
+                    "pipeline": [{"$project": {"name": 1, "age": 1}}],
+                    "as": "student"
+                }},
+                {"$unwind": "$student"},
+                {"$replaceRoot": {"newRoot": "$student"}},
+            ],
+            "as": "students"
+        }})
+    return [
+        {"$match": {"_id": obj_id}},
+        {"$addFields": {"course_refs": refs_to_object_ids("$courses")}},
+        {"$lookup": {
+            "from": "courses",
+            "localField": "course_refs",
+            "foreignField": "_id",
+            "pipeline": course_pipeline,
+            "as": "courses"
+        }},
+        {"$project": {"course_refs": 0, SEARCH_FIELD: 0}},
+    ]
+
+# Ruta para obtener una universidad con sus cursos y estudiantes en un único documento
+@app.get("/universities/{university_id}/full")
+async def get_university_full(university_id: str, depth: int = Query(2, ge=1, le=2), db: AsyncDatabase = Depends(get_db)):
+    try:
+        obj_id = ObjectId(university_id)
+    except Exception:
+        raise HTTPException(status_code=400, detail="Formato de ID inválido")
+    try:
+        if depth >= 2:
+            await fold_university_rosters(db, obj_id)
+        cursor = await db.universities.aggregate(university_view_pipeline(obj_id, depth))
+        universities = await cursor.to_list(1)
+    except Exception as e:
+        logger.error("Error al obtener la vista completa de la universidad: %s", e)
+        raise HTTPException(status_code=500, detail="Error al obtener la vista completa de la universidad")
+    if not universities:
+        logger.warning("Universidad con ID '%s' no encontrada", university_id)
+        raise HTTPException(status_code=404, detail=f"Universidad con ID '{university_id}' no encontrada")
+    logger.info("Vista completa de la universidad con ID '%s' recuperada exitosamente", university_id)
+    return BSONJSONResponse(universities[0])
@@ -0,0 +1,163 @@
+import time
+import asyncio
+import logging
+from collections import deque
+from pymongo.errors import BulkWriteError, OperationFailure
+from metrics import counter, gauge, histogram
+
+WRITE_BEHIND_BATCH = histogram("write_behind_batch_size", "Operaciones por bulk_write agrupado", ("queue",), (1, 5, 10, 50, 100, 500, 1000, 5000))
+WRITE_BEHIND_FLUSH = histogram("write_behind_flush_seconds", "Duración de cada bulk_write agrupado", ("queue",))
+WRITE_BEHIND_PENDING = gauge("write_behind_pending", "Operaciones en cola o escribiéndose", ("queue",))
+WRITE_BEHIND_ERRORS = counter("write_behind_errors_total", "Operaciones agrupadas que fallaron", ("queue",))
+
+logger = logging.getLogger(__name__)
+
+# Operación descartada en el flush porque check no admite su clave
+class RejectedOperation(Exception):
+    pass
+
+# La cola está cerrada (o su tarea terminó): la operación no se ha encolado
+class QueueClosed(Exception):
+    pass
+
+# Cola de escrituras diferidas: agrupa las operaciones que llegan en un
+# intervalo de flush_ms (o hasta flush_ops) en un único bulk_write ordenado.
+# Cada llamador espera al resultado de su operación, así que la respuesta HTTP
+# sigue saliendo después de escribir; solo cambia el número de viajes a MongoDB.
+# check (opcional) valida las claves de todo el lote con una sola consulta:
+# recibe la colección y el conjunto de claves y devuelve las que son válidas
+class WriteBehindQueue:
+    def __init__(self, name, flush_ms, flush_ops, max_pending, check=None):
+        self.name = name
+        self.flush_ms = flush_ms
+        self.flush_ops = flush_ops
+        self.max_pending = max_pending
+        self.check = check
+        self.collection = None
+        self._pending = deque()  # (operación, clave, future)
+        self._task = None
+        self._closing = False
+
+    @property
+    def running(self):
+        return self._task is not None and not self._task.done() and not self._closing
+
+    def start(self, collection):
+        self.collection = collection
+        self._closing = False
+        # Contrapresión: con max_pending operaciones sin escribir, submit espera hueco
+        self._slots = asyncio.Semaphore(self.max_pending)
+        self._wakeup = asyncio.Event()
+        self._full = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+
+    # Encolar una operación y esperar a que se escriba (propaga su error; con
+    # check, RejectedOperation si su clave no es válida). QueueClosed si la cola
+    # no acepta operaciones: el llamador tiene que escribirla por su cuenta
+    async def submit(self, operation, key=None):
+        if not self.running:
+            raise QueueClosed(self.name)
+        await self._slots.acquire()
+        # Mientras se esperaba hueco la cola pudo cerrarse o detenerse: nadie
+        # escribiría ya esta operación
+        if not self.running:
+            self._slots.release()
+            raise QueueClosed(self.name)
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append((operation, key, future))
+        WRITE_BEHIND_PENDING.inc(self.name)
+        self._wakeup.set()
+        if len(self._pending) >= self.flush_ops:
+            self._full.set()
+        # shield: si el cliente se desconecta la operación ya encolada se escribe igualmente
+        return await asyncio.shield(future)
+
+    # Escribir todo lo pendiente y parar (al apagar la aplicación)
+    async def close(self):
+        if self._task is None:
+            return
+        self._closing = True
+        self._wakeup.set()
+        self._full.set()
+        await self._task
+        self._task = None
+
+    async def _run(self):
+        batch = []
+        try:
+            while True:
+                if not self._pending:
+                    if self._closing:
+                        return
+                    self._wakeup.clear()
+                    await self._wakeup.wait()
+                    continue
+                # Esperar a que se junten flush_ops operaciones o pasen flush_ms
+                if len(self._pending) < self.flush_ops and not self._closing:
+                    try:
+                        await asyncio.wait_for(self._full.wait(), self.flush_ms / 1000)
+                    except asyncio.TimeoutError:
+                        pass
+                self._full.clear()
+                batch = [self._pending.popleft() for _ in range(min(self.flush_ops, len(self._pending)))]
+                if len(self._pending) >= self.flush_ops:
+                    self._full.set()
+                try:
+                    await self._flush(batch)
+                except Exception as e:
+                    # Un fallo inesperado no para la cola: el lote recibe el error
+                    logger.exception("Error inesperado al escribir el lote de %s", self.name)
+                    self._resolve(batch, e)
+        finally:
+            # Si la tarea termina (p. ej. cancelada) nadie se queda esperando ni retiene huecos
+            self._resolve(batch + list(self._pending), RuntimeError(f"Cola de escritura {self.name} detenida"))
+            self._pending.clear()
+
+    async def _flush(self, batch):
+        WRITE_BEHIND_BATCH.observe(self.name, value=len(batch))
+        start = time.perf_counter()
+        remaining = batch
+        if self.check is not None:
+            try:
+                valid = await self.check(self.collection, {key for _, key, _ in batch})
+            except Exception as e:
+                self._resolve(batch, e)
+                remaining = []
+            else:
+                self._resolve([item for item in batch if item[1] not in valid], RejectedOperation(self.name))
+                remaining = [item for item in batch if item[1] in valid]
+        while remaining:
+            try:
+                await self.collection.bulk_write([operation for operation, _, _ in remaining], ordered=True)
+                self._resolve(remaining)
+                remaining = []
+            except BulkWriteError as e:
+                write_errors = e.details.get("writeErrors")
+                if not write_errors:
+                    # Solo errores de write concern: no se sabe qué quedó escrito
+                    self._resolve(remaining, e)
+                    break
+                # En modo ordenado se para en el primer error: las anteriores están
+                # escritas, la que falla recibe su error y el resto se reintenta
+                write_error = write_errors[0]
+                index = write_error["index"]
+                self._resolve(remaining[:index])
+                self._resolve(remaining[index:index + 1], OperationFailure(write_error.get("errmsg"), write_error.get("code"), write_error))
+                remaining = remaining[index + 1:]
+            except Exception as e:
+                self._resolve(remaining, e)
+                remaining = []
+        WRITE_BEHIND_FLUSH.observe(self.name, value=time.perf_counter() - start)
+
+    # Cada operación se resuelve una sola vez: las ya resueltas se ignoran
+    def _resolve(self, items, error=None):
+        items = [item for item in items if not item[2].done()]
+        for _, _, future in items:
+            if error is None:
+                future.set_result(None)
+            else:
+                future.set_exception(error)
+            self._slots.release()
+        WRITE_BEHIND_PENDING.dec(self.name, amount=len(items))
+        if error is not None:
+            WRITE_BEHIND_ERRORS.inc(self.name, amount=len(items))